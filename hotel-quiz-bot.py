@@ -3,15 +3,36 @@
 # ===============================
 
 import logging
+import numpy as np
 import pandas as pd
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, ConversationHandler, CallbackQueryHandler
 import os
+import io
 import json
+import re
 import asyncio
-from telegram.ext import ApplicationBuilder
+import time
+import hashlib
+import itertools
+import sqlite3
+import sys
+import zlib
+import shutil
+import signal
+import threading
+import functools
+import heapq
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from telegram.ext import ApplicationBuilder, BasePersistence, PersistenceInput, BaseRateLimiter, BaseUpdateProcessor
 import ssl
 from aiohttp import web
+from telegram.request import HTTPXRequest
+from telegram.error import BadRequest, RetryAfter
 
 # ===============================
 # ЧАСТИНА 2: КОНФІГУРАЦІЯ ТА ГЛОБАЛЬНІ ЗМІННІ
@@ -29,23 +50,720 @@ logger = logging.getLogger(__name__)
 # Етапи розмови
 LANGUAGE, REGION, WAITING_REGION_SUBMIT, CATEGORY, WAITING_STYLE_SUBMIT, WAITING_PURPOSE_SUBMIT = range(6)
 
-# Зберігання даних користувача
-user_data_global = {}
+# Налаштування кешу результатів
+RESULTS_CACHE_SIZE = int(os.environ.get("RESULTS_CACHE_SIZE", "2048"))
+RESULTS_CACHE_TTL = float(os.environ.get("RESULTS_CACHE_TTL", "3600"))
+RESULTS_TOP_K = int(os.environ.get("RESULTS_TOP_K", "5"))  # Програм у детальному звіті
+
+# Налаштування пулу для розрахунку балів поза циклом подій asyncio
+SCORING_EXECUTOR = os.environ.get("SCORING_EXECUTOR", "thread")  # "thread" або "process"
+SCORING_WORKERS = int(os.environ.get("SCORING_WORKERS", "2"))
+SCORING_QUEUE_SIZE = int(os.environ.get("SCORING_QUEUE_SIZE", "16"))  # Максимум розрахунків у роботі та в черзі
+
+# Максимальна кількість оновлень Telegram, що обробляються одночасно (одного користувача - по черзі)
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", "64"))
+
+# Налаштування сесій користувачів
+SESSION_MAX_SIZE = int(os.environ.get("SESSION_MAX_SIZE", "10000"))  # Найдавніші сесії витісняються
+SESSION_IDLE_TTL = float(os.environ.get("SESSION_IDLE_TTL", "21600"))  # Секунди неактивності до видалення
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "sqlite")  # "sqlite" або "memory"
+SESSION_DB_PATH = os.environ.get("SESSION_DB_PATH", "sessions.sqlite3")
+SESSION_FLUSH_INTERVAL = float(os.environ.get("SESSION_FLUSH_INTERVAL", "2"))  # Секунди між пакетними записами
+
+# Перезавантаження даних готелів без перезапуску
+HOTEL_DATA_WATCH_INTERVAL = float(os.environ.get("HOTEL_DATA_WATCH_INTERVAL", "30"))  # Секунди; 0 - не стежити за CSV
+ADMIN_IDS = {int(user_id) for user_id in os.environ.get("ADMIN_IDS", "").split(",") if user_id.strip()}  # Доступ до /reload
+
+# CSV читається частинами по стільки рядків і одразу агрегується (0 - весь файл за раз)
+HOTEL_DATA_CHUNK_SIZE = int(os.environ.get("HOTEL_DATA_CHUNK_SIZE", "100000"))
+
+# Бінарний знімок даних готелів поруч із CSV: наступний старт читає його без розбору CSV
+HOTEL_DATA_SNAPSHOT = os.environ.get("HOTEL_DATA_SNAPSHOT", "1") != "0"
+
+# Обмеження вихідних запитів до Telegram (відро токенів): запит чекає, лише якщо перевищив би ліміт
+RATE_LIMIT_CHAT_PER_SECOND = float(os.environ.get("RATE_LIMIT_CHAT_PER_SECOND", "1"))  # Особисті чати
+# Ліміт Telegram для особистого чату - середній: короткий сплеск повідомлень дозволено, 429 дає
+# лише тривале перевищення. Повна вікторина надсилає 8-10 повідомлень, тож сплеск 20 не затримує
+# навіть вікторину без пауз між відповідями, а тривалий потік однаково обмежено 1 повідомленням на секунду
+RATE_LIMIT_CHAT_BURST = int(os.environ.get("RATE_LIMIT_CHAT_BURST", "20"))  # Повідомлень в особистий чат без затримки
+RATE_LIMIT_GROUP_PER_MINUTE = float(os.environ.get("RATE_LIMIT_GROUP_PER_MINUTE", "20"))  # Групові чати
+RATE_LIMIT_GROUP_BURST = int(os.environ.get("RATE_LIMIT_GROUP_BURST", "5"))  # Повідомлень у групу без затримки
+RATE_LIMIT_GLOBAL_PER_SECOND = float(os.environ.get("RATE_LIMIT_GLOBAL_PER_SECOND", "30"))  # Усі запити бота
+RATE_LIMIT_MAX_RETRIES = int(os.environ.get("RATE_LIMIT_MAX_RETRIES", "3"))  # Повтори після RetryAfter (HTTP 429)
+
+# Натискання чекбоксів у межах цього вікна (секунди) об'єднуються в одне оновлення клавіатури
+KEYBOARD_EDIT_DELAY = float(os.environ.get("KEYBOARD_EDIT_DELAY", "0.3"))
+
+# Дані готелів
 hotel_data = None  # Глобальна змінна для даних готелів
+hotel_data_version = 0  # Збільшується при кожному (пере)завантаженні даних готелів
+hotel_data_signature = None  # SHA-256 CSV файлу, з якого завантажено дані
+
+# Назви регіонів у порядку питання 1/4
+REGION_NAMES = {
+    'uk': [
+        "Європа", "Північна Америка", "Азія",
+        "Близький Схід", "Африка", "Південна Америка",
+        "Карибський басейн", "Океанія"
+    ],
+    'en': [
+        "Europe", "North America", "Asia",
+        "Middle East", "Africa", "South America",
+        "Caribbean", "Oceania"
+    ]
+}
+
+# Текст кнопки підтвердження вибору
+SUBMIT_TEXT = {'uk': "Відповісти", 'en': "Submit"}
+
+# ===============================
+# ЧАСТИНА 3: МЕТРИКИ ТА ВИМІРЮВАННЯ ЧАСУ
+# ===============================
+
+# Межі кошиків гістограм тривалості (секунди)
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+metrics_lock = threading.Lock()  # Стадії розрахунку виконуються в потоках пулу
+metrics_histograms = {}  # {назва: {'help': ..., 'label': ..., 'series': {значення мітки: {...}}}}
+metrics_gauges = {}  # {назва: (тип, опис, функція без аргументів)}
+
+# Спостереження стадій у процесі пулу (None - записувати одразу в гістограму)
+stage_observations = None
+
+def register_histogram(name, help_text, label):
+    """Реєструє гістограму тривалості з однією міткою"""
+    metrics_histograms[name] = {'help': help_text, 'label': label, 'series': {}}
+
+def register_gauge(name, help_text, func, metric_type='gauge'):
+    """Реєструє метрику, значення якої обчислюється під час запиту /metrics"""
+    metrics_gauges[name] = (metric_type, help_text, func)
+
+def observe_histogram(name, label_value, seconds):
+    """Додає спостереження тривалості до гістограми"""
+    with metrics_lock:
+        series = metrics_histograms[name]['series'].setdefault(
+            label_value, {'buckets': [0] * len(METRICS_BUCKETS), 'sum': 0.0, 'count': 0}
+        )
+        for i, bound in enumerate(METRICS_BUCKETS):
+            if seconds <= bound:
+                series['buckets'][i] += 1
+        series['sum'] += seconds
+        series['count'] += 1
+
+def render_metrics():
+    """Повертає всі метрики у текстовому форматі Prometheus"""
+    lines = []
+    with metrics_lock:
+        for name, histogram in metrics_histograms.items():
+            lines.append(f"# HELP {name} {histogram['help']}")
+            lines.append(f"# TYPE {name} histogram")
+            label = histogram['label']
+            for label_value, series in sorted(histogram['series'].items()):
+                for bound, count in zip(METRICS_BUCKETS, series['buckets']):
+                    lines.append(f'{name}_bucket{{{label}="{label_value}",le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{{label}="{label_value}",le="+Inf"}} {series["count"]}')
+                lines.append(f'{name}_sum{{{label}="{label_value}"}} {series["sum"]:.6f}')
+                lines.append(f'{name}_count{{{label}="{label_value}"}} {series["count"]}')
+    
+    for name, (metric_type, help_text, func) in metrics_gauges.items():
+        try:
+            value = func()
+        except Exception as e:
+            logger.error(f"Error collecting metric {name}: {e}")
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.append(f"{name} {value}")
+    
+    return "\n".join(lines) + "\n"
+
+register_histogram(
+    "hotel_bot_handler_duration_seconds",
+    "Time spent in a Telegram update handler, including Telegram API calls.", "handler"
+)
+register_histogram(
+    "hotel_bot_scoring_stage_duration_seconds",
+    "Time spent in each stage of score calculation and formatting.", "stage"
+)
+register_histogram(
+    "hotel_bot_telegram_api_duration_seconds",
+    "Round-trip time of Telegram Bot API requests.", "method"
+)
+register_histogram(
+    "hotel_bot_rate_limit_wait_seconds",
+    "Time a Telegram Bot API request waited in the outbound rate limiter and queue.", "method"
+)
+
+def timed_handler(func):
+    """Декоратор: вимірює тривалість асинхронного обробника"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            observe_histogram("hotel_bot_handler_duration_seconds", func.__name__, time.perf_counter() - started)
+    return wrapper
+
+def observe_stage(stage, seconds):
+    """Записує тривалість стадії розрахунку (у процесі пулу - для передачі в основний процес)"""
+    if stage_observations is not None:
+        stage_observations.append((stage, seconds))
+    else:
+        observe_histogram("hotel_bot_scoring_stage_duration_seconds", stage, seconds)
+
+class StageTimer:
+    """Вимірює послідовні стадії: кожен lap() записує час від попереднього"""
+    
+    def __init__(self):
+        self.started = time.perf_counter()
+    
+    def lap(self, stage):
+        now = time.perf_counter()
+        observe_stage(stage, now - self.started)
+        self.started = now
+
+class TimedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest, що вимірює час кожного запиту до Telegram Bot API"""
+    
+    async def do_request(self, url, method, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().do_request(url, method, *args, **kwargs)
+        finally:
+            api_method = url.rsplit('/', 1)[-1]
+            observe_histogram("hotel_bot_telegram_api_duration_seconds", api_method, time.perf_counter() - started)
+
+class TokenBucket:
+    """Відро токенів: поповнюється на rate токенів за секунду, вміщує не більше capacity"""
+    
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+    
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+    
+    def reserve(self):
+        """
+        Забирає токен і повертає, скільки секунд чекати до його появи (0 - можна одразу)
+        
+        Баланс може ставати від'ємним: кожен наступний запит резервує свій токен
+        після попередніх, тож запити одного відра виконуються по черзі.
+        """
+        self._refill(time.monotonic())
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+    
+    def wait_time(self):
+        """Скільки секунд до появи цілого токена (0 - токен уже є), без списання"""
+        self._refill(time.monotonic())
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+    
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def is_full(self, now):
+        """Чи відро вже повне (тобто його можна видалити без зміни поведінки)"""
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+# Методи Bot API, що надсилають нове повідомлення в чат (на них діє ліміт чату)
+CHAT_LIMITED_ENDPOINTS = ('send', 'copyMessage', 'forwardMessage')
+
+# Пріоритети вихідних запитів у загальній черзі (менше число - раніше).
+# Явний пріоритет передається як rate_limit_args методу бота.
+PRIORITY_RESULTS = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_KEYBOARD = 2
+ENDPOINT_PRIORITIES = {'editMessageReplyMarkup': PRIORITY_KEYBOARD}
+
+class ChatRateLimiter(BaseRateLimiter):
+    """
+    Планувальник вихідних запитів: відро токенів на кожен чат і загальна черга з пріоритетами
+    
+    Ліміти відповідають обмеженням Telegram: близько 1 повідомлення на секунду
+    в особистому чаті (зі сплеском, якого вистачає на цілу вікторину), 20 на хвилину в групі, 30 запитів на секунду
+    загалом. Ліміт чату рахує лише надсилання повідомлень; редагування та відповіді
+    на кнопки обмежує тільки загальне відро. Запит затримується лише тоді, коли інакше
+    перевищив би ліміт; коли загальних токенів бракує, першими проходять результати,
+    а оновлення клавіатур - останніми. RetryAfter (HTTP 429) зупиняє всю чергу на
+    вказаний Telegram час, після чого запит повторюється (пауза подвоюється з кожним повтором).
+    """
+    
+    def __init__(self, chat_rate=RATE_LIMIT_CHAT_PER_SECOND, chat_burst=RATE_LIMIT_CHAT_BURST,
+                 group_rate=RATE_LIMIT_GROUP_PER_MINUTE / 60, group_burst=RATE_LIMIT_GROUP_BURST,
+                 global_rate=RATE_LIMIT_GLOBAL_PER_SECOND):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self._global = TokenBucket(global_rate, max(1.0, global_rate))
+        self._chats = {}
+        self._prune_at = 1024
+        self._queue = []  # Купа (пріоритет, номер, future) запитів, що чекають загального токена
+        self._sequence = itertools.count()
+        self._dispatcher = None
+        self._paused_until = 0.0  # До цього моменту (monotonic) Telegram просить не надсилати запити
+        self.delayed = 0  # Запитів, яким довелося чекати
+        self.retries = 0  # Повторів після RetryAfter
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+    
+    @property
+    def queue_depth(self):
+        return len(self._queue)
+    
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self._prune_at:
+                # Повні відра нічого не обмежують - прибираємо їх
+                now = time.monotonic()
+                self._chats = {key: value for key, value in self._chats.items() if not value.is_full(now)}
+                self._prune_at = max(1024, 2 * len(self._chats))
+            # Від'ємний id (або @username) - група чи канал
+            is_private = isinstance(chat_id, int) and chat_id > 0
+            if is_private:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            else:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+    
+    async def _acquire(self, priority):
+        """Чекає загального токена; повертає True, якщо запит стояв у черзі"""
+        if not self._queue and time.monotonic() >= self._paused_until and self._global.wait_time() == 0:
+            self._global.reserve()
+            return False
+        
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._sequence), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+        return True
+    
+    async def _dispatch(self):
+        """Видає загальні токени запитам із черги в порядку пріоритету"""
+        while self._queue:
+            wait = max(self._paused_until - time.monotonic(), self._global.wait_time())
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            _, _, future = heapq.heappop(self._queue)
+            # Скасований запит (обробник перервано) токен не забирає
+            if not future.done():
+                self._global.reserve()
+                future.set_result(None)
+    
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        started = time.monotonic()
+        priority = rate_limit_args if rate_limit_args is not None else ENDPOINT_PRIORITIES.get(endpoint, PRIORITY_DEFAULT)
+        delayed = False
+        
+        chat_id = data.get('chat_id')
+        if chat_id is not None and endpoint.startswith(CHAT_LIMITED_ENDPOINTS):
+            wait = self._chat_bucket(chat_id).reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                delayed = True
+        
+        for attempt in range(RATE_LIMIT_MAX_RETRIES + 1):
+            delayed = await self._acquire(priority) or delayed
+            if delayed:
+                self.delayed += 1
+                observe_histogram("hotel_bot_rate_limit_wait_seconds", endpoint, time.monotonic() - started)
+            
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == RATE_LIMIT_MAX_RETRIES:
+                    raise
+                # Telegram просить зачекати: зупиняємо всю чергу, повтори - з подвоєнням паузи
+                pause = float(e.retry_after) * 2 ** attempt
+                self.retries += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + pause)
+                logger.warning(f"Telegram flood control on {endpoint}: retry {attempt + 1}/{RATE_LIMIT_MAX_RETRIES} in {pause:.1f}s")
+                started = time.monotonic()
+
+rate_limiter = ChatRateLimiter()
+register_gauge("hotel_bot_rate_limited_requests_total", "Telegram Bot API requests delayed by the outbound rate limiter.",
+               lambda: rate_limiter.delayed, 'counter')
+register_gauge("hotel_bot_outbound_queue_depth", "Telegram Bot API requests waiting in the outbound queue.",
+               lambda: rate_limiter.queue_depth)
+register_gauge("hotel_bot_telegram_retry_after_total", "Requests retried after a Telegram RetryAfter (HTTP 429).",
+               lambda: rate_limiter.retries, 'counter')
+
+async def handle_metrics(request):
+    """Маршрут /metrics для Prometheus"""
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+# ===============================
+# ЧАСТИНА 4: СЕСІЇ КОРИСТУВАЧІВ
+# ===============================
+
+@dataclass(slots=True)
+class QuizSession:
+    """Відповіді користувача; вибрані варіанти зберігаються як біти індексів у порядку питання"""
+    language: str = 'en'
+    region_bits: int = 0
+    category: Optional[str] = None
+    style_bits: int = 0
+    purpose_bits: int = 0
+    style_message_id: Optional[int] = None
+    purpose_message_id: Optional[int] = None
+    chat_id: Optional[int] = None  # Чат розмови (ключ ConversationHandler - (chat_id, user_id))
+    state: Optional[int] = None  # Етап розмови для відновлення після перезапуску
+    last_seen: float = 0.0
+    
+    def to_answers(self):
+        """Відповіді у форматі, який очікує розрахунок балів (назви мовою користувача)"""
+        return {
+            'language': self.language,
+            'regions': selected_names(REGION_NAMES, self.language, self.region_bits),
+            'countries': None,
+            'category': self.category,
+            'styles': selected_names(STYLE_NAMES, self.language, self.style_bits),
+            'purposes': selected_names(PURPOSE_NAMES, self.language, self.purpose_bits)
+        }
+
+def selected_names(names, lang, bits):
+    """Назви варіантів, біти яких встановлені, у порядку питання"""
+    options = names[lang] if lang in names else names['en']
+    return [name for i, name in enumerate(options) if bits >> i & 1]
+
+def option_bit(names, lang, name):
+    """Біт варіанта за його назвою (0 для невідомої назви)"""
+    options = names[lang] if lang in names else names['en']
+    return 1 << options.index(name) if name in options else 0
+
+# Порядок полів у рядку сховища сесій
+SESSION_COLUMNS = (
+    'user_id', 'chat_id', 'state', 'language', 'region_bits', 'category',
+    'style_bits', 'purpose_bits', 'style_message_id', 'purpose_message_id', 'updated_at'
+)
+
+class MemorySessionBackend:
+    """Сховище сесій у пам'яті процесу (для тестів; не переживає перезапуск)"""
+    
+    def __init__(self):
+        self.rows = {}  # {user_id: рядок у порядку SESSION_COLUMNS}
+    
+    def load_active(self, since, limit):
+        """Рядки сесій, змінених після since, від найновіших"""
+        rows = sorted((row for row in self.rows.values() if row[-1] >= since), key=lambda row: row[-1], reverse=True)
+        return rows[:limit]
+    
+    def write(self, rows, deleted):
+        """Записує змінені сесії та видаляє завершені"""
+        for row in rows:
+            self.rows[row[0]] = row
+        for user_id in deleted:
+            self.rows.pop(user_id, None)
+    
+    def close(self):
+        pass
+
+class SQLiteSessionBackend:
+    """Сховище сесій у файлі SQLite"""
+    
+    def __init__(self, path):
+        # Запис виконується в потоці (asyncio.to_thread), але завжди по одному
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "user_id INTEGER PRIMARY KEY, chat_id INTEGER, state INTEGER, language TEXT, "
+            "region_bits INTEGER, category TEXT, style_bits INTEGER, purpose_bits INTEGER, "
+            "style_message_id INTEGER, purpose_message_id INTEGER, updated_at REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+        self.conn.commit()
+    
+    def load_active(self, since, limit):
+        """Рядки сесій, змінених після since, від найновіших (застарілі видаляються)"""
+        with self.conn:
+            self.conn.execute("DELETE FROM sessions WHERE updated_at < ?", (since,))
+        return self.conn.execute(
+            f"SELECT {', '.join(SESSION_COLUMNS)} FROM sessions ORDER BY updated_at DESC LIMIT ?", (limit,)
+        ).fetchall()
+    
+    def write(self, rows, deleted):
+        """Записує змінені сесії та видаляє завершені однією транзакцією"""
+        with self.conn:
+            if rows:
+                self.conn.executemany(
+                    f"INSERT OR REPLACE INTO sessions VALUES ({', '.join('?' * len(SESSION_COLUMNS))})", rows
+                )
+            if deleted:
+                self.conn.executemany("DELETE FROM sessions WHERE user_id = ?", [(user_id,) for user_id in deleted])
+    
+    def close(self):
+        self.conn.close()
+
+class SessionStore:
+    """
+    Сесії користувачів з обмеженим розміром (LRU) та видаленням після неактивності
+    
+    Зміни записуються у сховище не одразу, а пакетами (flush): кожне натискання
+    чекбокса лише позначає сесію як змінену.
+    """
+    
+    def __init__(self, max_size, idle_ttl, backend=None):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.backend = backend or MemorySessionBackend()
+        self.evicted = 0
+        self.expired = 0
+        self._sessions = OrderedDict()  # {user_id: QuizSession} від найдавнішої активності
+        self._dirty = set()  # Змінені сесії, які ще не записані у сховище
+        self._deleted = set()  # Видалені сесії, які ще не видалені зі сховища
+        self._flush_lock = asyncio.Lock()
+    
+    def _forget(self, user_id):
+        """Позначає сесію для видалення зі сховища"""
+        self._dirty.discard(user_id)
+        self._deleted.add(user_id)
+    
+    def create(self, user_id):
+        """Створює нову сесію (замінюючи попередню) і витісняє найдавніші при переповненні"""
+        self.evict_expired()
+        self._sessions.pop(user_id, None)
+        session = self._sessions[user_id] = QuizSession(last_seen=time.monotonic())
+        self.mark_dirty(user_id)
+        while len(self._sessions) > self.max_size:
+            evicted_id, _ = self._sessions.popitem(last=False)
+            self._forget(evicted_id)
+            self.evicted += 1
+        return session
+    
+    def get(self, user_id):
+        """Повертає активну сесію користувача або None, якщо її немає чи вона застаріла"""
+        session = self._sessions.get(user_id)
+        if session is None:
+            return None
+        now = time.monotonic()
+        if now - session.last_seen > self.idle_ttl:
+            del self._sessions[user_id]
+            self._forget(user_id)
+            self.expired += 1
+            return None
+        session.last_seen = now
+        self._sessions.move_to_end(user_id)
+        return session
+    
+    def peek(self, user_id):
+        """Повертає сесію без оновлення часу активності"""
+        return self._sessions.get(user_id)
+    
+    def delete(self, user_id):
+        """Видаляє сесію; повертає True, якщо вона існувала"""
+        if self._sessions.pop(user_id, None) is None:
+            return False
+        self._forget(user_id)
+        return True
+    
+    def mark_dirty(self, user_id):
+        """Позначає сесію для запису під час наступного flush"""
+        self._deleted.discard(user_id)
+        self._dirty.add(user_id)
+    
+    def evict_expired(self):
+        """Видаляє застарілі сесії (вони завжди на початку порядку LRU)"""
+        deadline = time.monotonic() - self.idle_ttl
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if session.last_seen >= deadline:
+                break
+            del self._sessions[user_id]
+            self._forget(user_id)
+            self.expired += 1
+    
+    def live_count(self):
+        """Кількість активних сесій"""
+        self.evict_expired()
+        return len(self._sessions)
+    
+    def pending_writes(self):
+        """Кількість змін, що очікують запису у сховище"""
+        return len(self._dirty) + len(self._deleted)
+    
+    def memory_usage(self):
+        """Приблизний обсяг пам'яті сесій у байтах"""
+        total = sys.getsizeof(self._sessions)
+        for user_id, session in self._sessions.items():
+            total += sys.getsizeof(user_id) + sys.getsizeof(session)
+        return total
+    
+    def load(self):
+        """Завантажує зі сховища лише активні (не застарілі) сесії; повертає їх кількість"""
+        now_wall, now = time.time(), time.monotonic()
+        rows = self.backend.load_active(now_wall - self.idle_ttl, self.max_size)
+        # Рядки йдуть від найновіших, а OrderedDict - від найдавніших
+        for row in reversed(rows):
+            user_id, chat_id, state, language, region_bits, category, style_bits, purpose_bits, \
+                style_message_id, purpose_message_id, updated_at = row
+            self._sessions[user_id] = QuizSession(
+                language, region_bits, category, style_bits, purpose_bits,
+                style_message_id, purpose_message_id, chat_id, state,
+                last_seen=now - (now_wall - updated_at)
+            )
+            self._sessions.move_to_end(user_id)
+        return len(rows)
+    
+    async def flush(self):
+        """Записує накопичені зміни у сховище (у потоці, щоб не блокувати цикл подій)"""
+        async with self._flush_lock:
+            if not self._dirty and not self._deleted:
+                return
+            # Знімок робиться в циклі подій, тому обробники не змінюють сесії під час запису
+            offset = time.time() - time.monotonic()
+            rows = []
+            for user_id in self._dirty:
+                s = self._sessions.get(user_id)
+                if s is not None:
+                    rows.append((
+                        user_id, s.chat_id, s.state, s.language, s.region_bits, s.category,
+                        s.style_bits, s.purpose_bits, s.style_message_id, s.purpose_message_id,
+                        s.last_seen + offset
+                    ))
+            deleted = list(self._deleted)
+            self._dirty.clear()
+            self._deleted.clear()
+            try:
+                await asyncio.to_thread(self.backend.write, rows, deleted)
+            except Exception as e:
+                logger.error(f"Error writing {len(rows)} sessions to storage: {e}")
+                # Повторимо під час наступного flush (новіші зміни мають пріоритет)
+                for row in rows:
+                    if row[0] not in self._deleted:
+                        self._dirty.add(row[0])
+                self._deleted.update(user_id for user_id in deleted if user_id not in self._dirty)
+
+class SessionPersistence(BasePersistence):
+    """
+    Зберігає етапи ConversationHandler разом із сесіями користувачів
+    
+    Application викликає update_conversation після завершення обробників (кожні
+    update_interval секунд), тобто коли всі зміни сесії вже внесено.
+    """
+    
+    def __init__(self, store, update_interval):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=False, callback_data=False),
+            update_interval=update_interval
+        )
+        self.store = store
+    
+    async def get_conversations(self, name):
+        return {
+            (session.chat_id, user_id): session.state
+            for user_id, session in self.store._sessions.items()
+            if session.state is not None and session.chat_id is not None
+        }
+    
+    async def update_conversation(self, name, key, new_state):
+        chat_id, user_id = key
+        session = self.store.peek(user_id)
+        if session is None:
+            return
+        if new_state is None:
+            # Розмову завершено (результати показано або /cancel)
+            self.store.delete(user_id)
+            return
+        session.chat_id = chat_id
+        session.state = new_state
+        self.store.mark_dirty(user_id)
+    
+    async def flush(self):
+        await self.store.flush()
+    
+    # Дані user_data/chat_data/bot_data бот не використовує
+    async def get_user_data(self):
+        return {}
+    
+    async def get_chat_data(self):
+        return {}
+    
+    async def get_bot_data(self):
+        return {}
+    
+    async def get_callback_data(self):
+        return None
+    
+    async def update_user_data(self, user_id, data):
+        pass
+    
+    async def update_chat_data(self, chat_id, data):
+        pass
+    
+    async def update_bot_data(self, data):
+        pass
+    
+    async def update_callback_data(self, data):
+        pass
+    
+    async def drop_chat_data(self, chat_id):
+        pass
+    
+    async def drop_user_data(self, user_id):
+        pass
+    
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+    
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+    
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+def create_session_backend():
+    """Створює сховище сесій згідно з SESSION_BACKEND ("sqlite" або "memory")"""
+    if SESSION_BACKEND == "memory":
+        return MemorySessionBackend()
+    return SQLiteSessionBackend(SESSION_DB_PATH)
+
+sessions = SessionStore(SESSION_MAX_SIZE, SESSION_IDLE_TTL)
+
+register_gauge("hotel_bot_sessions", "Live user sessions.", sessions.live_count)
+register_gauge("hotel_bot_sessions_memory_bytes", "Approximate memory used by user sessions.",
+               sessions.memory_usage)
+register_gauge("hotel_bot_sessions_pending_writes", "Session changes waiting for the next write to storage.",
+               sessions.pending_writes)
+register_gauge("hotel_bot_sessions_evicted_total", "Sessions evicted because the store was full.",
+               lambda: sessions.evicted, 'counter')
+register_gauge("hotel_bot_sessions_expired_total", "Sessions removed after the idle timeout.",
+               lambda: sessions.expired, 'counter')
 
 # ===============================
-# ЧАСТИНА 3: ФУНКЦІЇ АНАЛІЗУ CSV ТА ЗАВАНТАЖЕННЯ ДАНИХ
+# ЧАСТИНА 5: ФУНКЦІЇ АНАЛІЗУ CSV ТА ЗАВАНТАЖЕННЯ ДАНИХ
 # ===============================
 
+def hotel_counts(df):
+    """Кількість готелів у кожному рядку: hotel_count для агрегованих даних, інакше по одному"""
+    if 'hotel_count' in df.columns:
+        return df['hotel_count'].to_numpy()
+    return np.ones(len(df), dtype=np.int64)
+
 def analyze_csv_structure(df):
     """
     Аналізує структуру CSV файлу та записує інформацію в лог
     
     Args:
-        df: DataFrame з даними про готелі
+        df: DataFrame з даними про готелі (агреговані рядки враховуються з вагою hotel_count)
     """
+    counts = hotel_counts(df)
     logger.info("CSV structure analysis:")
-    logger.info(f"Number of rows: {len(df)}")
+    logger.info(f"Number of rows: {int(counts.sum())} ({len(df)} unique)")
     logger.info(f"Columns: {list(df.columns)}")
     
     # Перевірка унікальних значень
@@ -59,22 +777,310 @@ def analyze_csv_structure(df):
         logger.info(f"Segments: {df['segment'].unique()}")
     
     # Перевірка на відсутні значення
-    null_counts = df.isnull().sum()
+    null_counts = df.isnull().mul(counts, axis=0).sum()
     if null_counts.sum() > 0:
         logger.warning(f"Missing values: {null_counts[null_counts > 0]}")
     
     # Перевірка типів даних
     logger.info(f"Data types: {df.dtypes}")
 
-def load_hotel_data(csv_path):
-    """Завантаження даних програм лояльності з CSV файлу"""
+def compute_file_sha256(path):
+    """Обчислює SHA-256 файлу (для перевірки актуальності похідних файлів)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class HashingFileReader(io.RawIOBase):
+    """
+    Файл для читання, що рахує SHA-256 прочитаних байтів
+    
+    Підпис розібраних даних береться з тих самих байтів, які прочитав парсер,
+    тож зміна CSV між обчисленням хешу та читанням не лишиться непоміченою.
+    """
+    
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._digest = hashlib.sha256()
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, buffer):
+        size = self._file.readinto(buffer)
+        if size:
+            self._digest.update(memoryview(buffer)[:size])
+        return size
+    
+    def close(self):
+        self._file.close()
+        super().close()
+    
+    def hexdigest(self):
+        """SHA-256 усього файлу: непрочитаний залишок дочитується"""
+        for block in iter(lambda: self._file.read(1024 * 1024), b''):
+            self._digest.update(block)
+        return self._digest.hexdigest()
+
+# Версія формату знімка даних готелів (змінюється разом зі структурою файлів)
+SNAPSHOT_FORMAT_VERSION = 3
+
+def _snapshot_schema():
+    """Ідентифікатор формату знімка: версія та маппінги, з яких обчислено маски"""
+    mappings = repr((CATEGORY_MAPPING, STYLE_BRAND_MAPPING, PURPOSE_BRAND_MAPPING))
+    return f"{SNAPSHOT_FORMAT_VERSION}:{hashlib.sha256(mappings.encode('utf-8')).hexdigest()[:16]}"
+
+def hotel_data_snapshot_dir(csv_path):
+    """Тека знімків даних готелів для CSV файлу"""
+    return f"{csv_path}.snapshot"
+
+def write_hotel_data_snapshot(df, csv_path, signature):
+    """
+    Записує знімок даних готелів: по одному .npy на колонку та meta.json
+
+    Текстові колонки зберігаються як категоріальні коди (значення - у meta.json),
+    числові - як є. Знімок збирається в тимчасовій теці й з'являється одним
+    перейменуванням; знімки інших версій CSV видаляються.
+
+    Args:
+        df: DataFrame з масками та колонками region_lower/country_lower
+        csv_path: шлях до CSV файлу
+        signature: SHA-256 CSV файлу
+    """
+    root = hotel_data_snapshot_dir(csv_path)
+    snapshot_dir = os.path.join(root, signature)
+    tmp_dir = f"{snapshot_dir}.tmp-{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    try:
+        columns = []
+        for i, column in enumerate(df.columns):
+            values = df[column]
+            file_name = f"{i}.npy"
+            if isinstance(values.dtype, np.dtype) and values.dtype.kind in 'biuf':
+                np.save(os.path.join(tmp_dir, file_name), values.to_numpy())
+                columns.append({'name': column, 'kind': 'numeric', 'file': file_name})
+                continue
+
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                categorical = values.array
+            else:
+                codes, categories = pd.factorize(values, sort=True)
+                categorical = pd.Categorical.from_codes(codes, categories=categories)
+            # Коди у тому ж типі, що обирає pandas, - тоді завантаження їх не копіює
+            np.save(os.path.join(tmp_dir, file_name), categorical.codes)
+            columns.append({
+                'name': column,
+                'kind': 'categorical',
+                'file': file_name,
+                'categories': categorical.categories.tolist()
+            })
+
+        meta = {'schema': _snapshot_schema(), 'signature': signature, 'rows': len(df), 'columns': columns}
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+        try:
+            os.rename(tmp_dir, snapshot_dir)
+        except OSError:
+            # Знімок цієї версії вже записав інший процес
+            if not os.path.exists(os.path.join(snapshot_dir, 'meta.json')):
+                raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    for name in os.listdir(root):
+        if name != signature and '.tmp-' not in name:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    logger.info(f"Hotel data snapshot written: {snapshot_dir}")
+
+def load_hotel_data_snapshot(csv_path, signature):
+    """
+    Завантажує знімок даних готелів, відображаючи файли колонок у пам'ять (mmap)
+
+    Returns:
+        DataFrame або None, якщо знімка для цього CSV немає або він застарів
+    """
+    snapshot_dir = os.path.join(hotel_data_snapshot_dir(csv_path), signature)
+    try:
+        with open(os.path.join(snapshot_dir, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('schema') != _snapshot_schema() or meta.get('signature') != signature:
+            logger.info(f"Hotel data snapshot {snapshot_dir} has another format, rebuilding from CSV")
+            return None
+
+        # Порожній масив неможливо відобразити в пам'ять
+        mmap_mode = 'r' if meta['rows'] else None
+        columns = {}
+        for column in meta['columns']:
+            values = np.load(os.path.join(snapshot_dir, column['file']), mmap_mode=mmap_mode)
+            if column['kind'] == 'categorical':
+                values = pd.Categorical.from_codes(values, categories=pd.Index(column['categories']))
+            columns[column['name']] = values
+        return pd.DataFrame(columns, copy=False)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Hotel data snapshot {snapshot_dir} is unreadable, rebuilding from CSV: {e}")
+        return None
+
+# Колонки, без яких бот не може працювати
+REQUIRED_COLUMNS = ['loyalty_program', 'region', 'country', 'Hotel Brand', 'segment']
+
+# Текстові колонки CSV (разом з альтернативними назвами): значень небагато, тож вони категоріальні
+CATEGORICAL_CSV_COLUMNS = ['loyalty_program', 'region', 'country', 'Hotel Brand', 'brand', 'segment', 'category']
+
+# Колонки з кількістю готелів (разом з альтернативними назвами)
+COUNT_CSV_COLUMNS = ['Total hotels of Corporation / Loyalty Program in this region',
+                     'Total hotels of Corporation / Loyalty Program in this country',
+                     'region_hotels', 'country_hotels']
+
+def _downcast_count_column(values):
+    """
+    Зменшує числовий тип колонки з кількістю готелів без зміни значень
+    
+    Цілі числа - до найменшого цілого типу; цілі значення з пропусками (NaN) - до float32.
+    """
+    if values.dtype.kind in 'iu':
+        return pd.to_numeric(values, downcast='integer')
+    if values.dtype.kind != 'f':
+        return values
+    present = values.dropna().to_numpy()
+    if not (np.all(present == np.round(present)) and np.all(np.abs(present) < 2 ** 24)):
+        return values
+    if len(present) == len(values):
+        return pd.to_numeric(values.astype('int64'), downcast='integer')
+    return values.astype('float32')
+
+def _memory_as_plain_columns(df):
+    """Оцінка пам'яті DataFrame, якби категоріальні колонки зберігалися як рядки Python, а числа - як int64/float64"""
+    total = df.index.memory_usage()
+    for column in df.columns:
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # Вказівник на об'єкт у кожному рядку + сам об'єкт (код -1 - NaN, останній елемент)
+            sizes = np.array([sys.getsizeof(value) for value in values.cat.categories] + [sys.getsizeof(np.nan)])
+            total += 8 * len(values) + int(sizes[values.cat.codes.to_numpy()].sum())
+        elif isinstance(values.dtype, np.dtype) and values.dtype.kind in 'iuf':
+            total += 8 * len(values)
+        else:
+            total += values.memory_usage(index=False, deep=True)
+    return total
+
+class HotelDataError(Exception):
+    """Дані готелів не вдалося завантажити або вони непридатні"""
+
+def validate_hotel_data(df):
+    """
+    Перевіряє завантажені дані готелів
+    
+    Raises:
+        HotelDataError: якщо дані не завантажено або бракує необхідних колонок
+    """
+    if df is None:
+        raise HotelDataError("Не вдалося завантажити дані")
+    missing_required = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+    if missing_required:
+        raise HotelDataError(f"Відсутні критично важливі колонки: {missing_required}")
+
+def _aggregate_hotel_rows(df):
+    """Об'єднує однакові рядки в один, підсумовуючи hotel_count (групи - в порядку першої появи)"""
+    keys = [column for column in df.columns if column != 'hotel_count']
+    if not keys:
+        raise HotelDataError("CSV не містить жодної з потрібних колонок")
+    grouped = df.groupby(keys, sort=False, dropna=False, observed=True)
+    counts = grouped['hotel_count'].sum() if 'hotel_count' in df.columns else grouped.size()
+    return counts.reset_index(name='hotel_count')
+
+def _merge_aggregated(partials):
+    """Агрегує кілька агрегованих частин в одну"""
+    if len(partials) == 1:
+        return partials[0]
+    # Спільні (відсортовані, як у read_csv) категорії для всіх частин - тоді
+    # об'єднання лишається категоріальним і групується за кодами
+    for column in partials[0].columns:
+        if isinstance(partials[0][column].dtype, pd.CategoricalDtype):
+            categories = pd.Index(sorted(set().union(*(partial[column].cat.categories for partial in partials))))
+            for partial in partials:
+                partial[column] = partial[column].cat.set_categories(categories)
+    return _aggregate_hotel_rows(pd.concat(partials, ignore_index=True))
+
+def read_hotel_csv_aggregated(csv_path):
+    """
+    Читає CSV частинами по HOTEL_DATA_CHUNK_SIZE рядків і агрегує їх
+    
+    Однакові рядки (програма, регіон, країна, бренд, сегмент, кількості) стають
+    одним рядком з колонкою hotel_count, тож сирі рядки в пам'яті є лише в межах
+    однієї частини. Групи йдуть у порядку першої появи в CSV, тому перший рядок
+    кожної програми той самий, що й у файлі.
+    
+    Returns:
+        (агрегований DataFrame, кількість рядків у CSV, SHA-256 прочитаних байтів)
+    """
+    # Лише потрібні колонки; текстові одразу категоріальні, без проміжних рядків Python
+    read_options = {
+        'usecols': lambda column: column in CATEGORICAL_CSV_COLUMNS or column in COUNT_CSV_COLUMNS,
+        'dtype': {column: 'category' for column in CATEGORICAL_CSV_COLUMNS}
+    }
+    with HashingFileReader(csv_path) as raw, io.BufferedReader(raw) as source:
+        if HOTEL_DATA_CHUNK_SIZE > 0:
+            chunks = pd.read_csv(source, chunksize=HOTEL_DATA_CHUNK_SIZE, **read_options)
+        else:
+            chunks = [pd.read_csv(source, **read_options)]
+        
+        aggregated = None
+        pending = []
+        pending_rows = 0
+        source_rows = 0
+        for chunk in chunks:
+            source_rows += len(chunk)
+            partial = _aggregate_hotel_rows(chunk)
+            pending.append(partial)
+            pending_rows += len(partial)
+            # Зливаємо частини, щойно їх набралося не менше, ніж уже агрегованих рядків:
+            # пам'ять обмежена кількістю унікальних груп, а злиття не повторюються на кожній частині
+            if aggregated is None or pending_rows >= len(aggregated):
+                aggregated = _merge_aggregated(pending if aggregated is None else [aggregated] + pending)
+                pending = []
+                pending_rows = 0
+        
+        if pending:
+            aggregated = _merge_aggregated([aggregated] + pending)
+        return aggregated, source_rows, raw.hexdigest()
+
+def load_hotel_data(csv_path, signature=None, return_signature=False):
+    """
+    Завантаження даних програм лояльності з CSV файлу
+    
+    Якщо поруч із CSV є знімок тієї ж версії файлу, дані читаються з нього
+    без розбору CSV; інакше CSV читається частинами (read_hotel_csv_aggregated),
+    а знімок записується для наступного старту. Якщо прочитані байти не відповідають
+    signature (CSV змінився після обчислення хешу), знімок не записується.
+    
+    Args:
+        csv_path: шлях до CSV файлу
+        signature: SHA-256 CSV файлу, якщо вже обчислено
+        return_signature: повернути (DataFrame, SHA-256 даних, що фактично завантажені)
+    """
+    def result(df, loaded_signature):
+        return (df, loaded_signature) if return_signature else df
+    
     try:
         # Перевірка існування файлу
         if not os.path.exists(csv_path):
             logger.error(f"File not found: {csv_path}")
-            return None
+            return result(None, signature)
+        
+        if HOTEL_DATA_SNAPSHOT:
+            if signature is None:
+                signature = compute_file_sha256(csv_path)
+            df = load_hotel_data_snapshot(csv_path, signature)
+            if df is not None:
+                logger.info(f"Loaded hotel data snapshot for {csv_path}: {len(df)} rows")
+                return result(df, signature)
             
-        df = pd.read_csv(csv_path)
+        df, source_rows, loaded_signature = read_hotel_csv_aggregated(csv_path)
+        logger.info(f"Aggregated {source_rows} CSV rows into {len(df)} rows")
         
         # Аналіз структури CSV
         analyze_csv_structure(df)
@@ -112,6 +1118,15 @@ def load_hotel_data(csv_path):
             df = df.rename(columns=rename_mapping)
             logger.info(f"Renamed columns: {rename_mapping}")
         
+        # Кількості готелів - у найменшому числовому типі
+        memory_before = _memory_as_plain_columns(df)
+        for col in df.columns:
+            if col in COUNT_CSV_COLUMNS:
+                df[col] = _downcast_count_column(df[col])
+        memory_after = df.memory_usage(deep=True).sum()
+        logger.info(f"Hotel data memory: {memory_before / 1024:.0f} KiB as plain columns, "
+                    f"{memory_after / 1024:.0f} KiB after compaction")
+        
         # Перевірка чи існують необхідні колонки після перейменування
         missing_columns = [col for col in expected_columns if col not in df.columns]
         if missing_columns:
@@ -122,33 +1137,447 @@ def load_hotel_data(csv_path):
                 df[col] = ''
                 logger.warning(f"Created empty column: {col}")
         
-        return df
+        # Бітові маски категорій, стилів і цілей та назви регіонів/країн
+        # у нижньому регістрі для кожного готелю (один раз на набір даних)
+        df = add_mask_columns(df)
+        df = add_location_columns(df)
+        
+        if HOTEL_DATA_SNAPSHOT and loaded_signature != signature:
+            # Знімок зі старим підписом містив би нові дані
+            logger.warning(f"{csv_path} changed after it was hashed. Hotel data snapshot is not written.")
+        elif HOTEL_DATA_SNAPSHOT:
+            try:
+                write_hotel_data_snapshot(df, csv_path, signature)
+                # Дані зі знімка - у тому ж вигляді, що й після наступного старту
+                snapshot = load_hotel_data_snapshot(csv_path, signature)
+                if snapshot is not None:
+                    df = snapshot
+            except (OSError, TypeError, ValueError) as e:
+                logger.warning(f"Could not write hotel data snapshot: {e}")
+        
+        return result(df, loaded_signature)
     except Exception as e:
         logger.error(f"Error loading CSV: {e}")
-        return None
+        return result(None, signature)
+
+def _measure_hotel_data_load(csv_path, chunk_size):
+    """
+    Читає CSV у свіжому процесі (для benchmark_hotel_data_load)
+    
+    Returns:
+        (секунди, приріст пікового RSS у МБ, рядків у CSV, рядків після агрегації)
+    """
+    import resource  # Лише Unix, потрібен тільки для вимірювання
+    global HOTEL_DATA_CHUNK_SIZE
+    HOTEL_DATA_CHUNK_SIZE = chunk_size
+    logging.getLogger().setLevel(logging.WARNING)
+    
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    df, source_rows, _ = read_hotel_csv_aggregated(csv_path)
+    elapsed = time.perf_counter() - started
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return elapsed, (rss_peak - rss_before) / 1024, source_rows, len(df)
+
+def benchmark_hotel_data_load(csv_path, chunk_sizes):
+    """
+    Порівнює час і пікову пам'ять читання CSV з різним розміром частин
+    
+    Кожне вимірювання - в окремому процесі, бо піковий RSS процесу лише зростає.
+    """
+    for chunk_size in chunk_sizes:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            elapsed, peak_mb, source_rows, rows = executor.submit(
+                _measure_hotel_data_load, csv_path, chunk_size
+            ).result()
+        label = "whole file" if chunk_size <= 0 else f"chunks of {chunk_size} rows"
+        logger.info(f"{label}: {elapsed:.2f}s, peak RSS +{peak_mb:.1f} MB, "
+                    f"{source_rows} CSV rows -> {rows} aggregated rows")
+
+# Програми та країни синтетичного CSV для бенчмарків
+SYNTHETIC_PROGRAMS = [
+    "Marriott Bonvoy", "Hilton Honors", "IHG One Rewards", "World of Hyatt",
+    "Wyndham Rewards", "Choice Privileges", "Accor Live Limitless"
+]
+SYNTHETIC_COUNTRIES = [
+    "France", "Germany", "Italy", "Spain", "USA", "Canada", "Mexico", "Japan",
+    "China", "Thailand", "UAE", "Qatar", "Kenya", "Egypt", "Brazil", "Peru",
+    "Jamaica", "Bahamas", "Australia", "New Zealand"
+]
+
+def write_synthetic_hotel_csv(path, rows, seed=0):
+    """
+    Записує синтетичний CSV з rows готелями у форматі hotel_data.csv
+    
+    Регіони - англійські назви питання 1/4 та кілька комбінованих ("Europe, Asia"),
+    бренди та сегменти - з маппінгів стилю, мети та категорії.
+    """
+    rng = np.random.default_rng(seed)
+    regions = REGION_NAMES['en'] + ["Europe, Asia", "North America, Caribbean"]
+    brands = sorted({brand for brands in STYLE_BRAND_MAPPING.values() for brand in brands}
+                    | {brand for brands in PURPOSE_BRAND_MAPPING.values() for brand in brands})
+    segments = [segment for segments in CATEGORY_MAPPING.values() for segment in segments]
+    
+    def pick(values):
+        return np.asarray(values, dtype=object)[rng.integers(len(values), size=rows)]
+    
+    pd.DataFrame({
+        'loyalty_program': pick(SYNTHETIC_PROGRAMS),
+        'region': pick(regions),
+        'country': pick(SYNTHETIC_COUNTRIES),
+        'Hotel Brand': pick(brands),
+        'segment': pick(segments),
+        REGION_TOTAL_COLUMN: rng.integers(1, 5000, size=rows),
+        COUNTRY_TOTAL_COLUMN: rng.integers(1, 1000, size=rows)
+    }).to_csv(path, index=False)
+
+def _filter_by_location_per_row(df, regions=None, countries=None):
+    """Колишній filter_hotels_by_region: копія таблиці та str.lower() для кожного рядка (для порівняння)"""
+    filtered_df = df.copy()
+    if regions:
+        filtered_df = filtered_df[filtered_df['region'].apply(
+            lambda x: any(region.lower() in str(x).lower() for region in regions))]
+    if countries:
+        filtered_df = filtered_df[filtered_df['country'].apply(
+            lambda x: any(country.lower() in str(x).lower() for country in countries))]
+    return filtered_df
+
+def benchmark_region_filter(rows=500000, repeats=5):
+    """
+    Порівнює фільтр за регіоном/країною по рядках і select_count_table_rows
+    на синтетичному CSV з rows готелями (мінімальний час з repeats запусків)
+    """
+    import tempfile  # Потрібен лише для бенчмарку
+    selections = [
+        (["Europe"], None),
+        (["Europe", "Asia", "Oceania"], None),
+        (["Europe"], ["france"]),
+        (["North America"], ["Canada", "Mexico"])
+    ]
+    
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, "hotels.csv")
+        write_synthetic_hotel_csv(csv_path, rows)
+        # До векторизації фільтр працював з рядковими колонками, після - з категоріальними
+        raw = pd.read_csv(csv_path)
+        df = pd.read_csv(csv_path, dtype={column: 'category' for column in ('region', 'country')})
+    df = add_location_columns(df)
+    
+    def best_time(function):
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            result = function()
+            timings.append(time.perf_counter() - started)
+        return min(timings), result
+    
+    for regions, countries in selections:
+        per_row, expected = best_time(lambda: _filter_by_location_per_row(raw, regions, countries))
+        vectorized, selected = best_time(lambda: select_count_table_rows(df, regions, countries))
+        same = np.array_equal(np.flatnonzero(selected), raw.index.get_indexer(expected.index))
+        logger.info(f"regions={regions} countries={countries}: {len(expected)} of {rows} rows, "
+                    f"per row {per_row * 1000:.1f} ms -> vectorized {vectorized * 1000:.1f} ms "
+                    f"({'same rows' if same else 'ROWS DIFFER'})")
 
 # ===============================
-# ЧАСТИНА 4: ОСНОВНІ TELEGRAM ОБРОБНИКИ
+# ЧАСТИНА 6: ОСНОВНІ TELEGRAM ОБРОБНИКИ
 # ===============================
 
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обробляє оновлення різних користувачів паралельно, а одного користувача в чаті - по черзі
+    
+    ConversationHandler змінює етап розмови лише після завершення обробника, тому
+    паралельні оновлення того ж користувача (подвійне натискання "Готово") обробились би
+    зі старим етапом. Ключ - (chat_id, user_id), як у ConversationHandler.
+    """
+    
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}  # {(chat_id, user_id): [asyncio.Lock, кількість оновлень у роботі та в черзі]}
+    
+    @staticmethod
+    def _update_key(update):
+        if not isinstance(update, Update):
+            return None
+        chat, user = update.effective_chat, update.effective_user
+        if chat is None and user is None:
+            return None
+        return (chat.id if chat else None, user.id if user else None)
+    
+    async def do_process_update(self, update, coroutine):
+        key = self._update_key(update)
+        if key is None:
+            await coroutine
+            return
+        
+        # asyncio.Lock пропускає очікувачів у порядку надходження - порядок оновлень зберігається
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+    
+    async def initialize(self):
+        """Нічого не робить"""
+    
+    async def shutdown(self):
+        """Нічого не робить"""
+
+class KeyboardEditDebouncer:
+    """
+    Об'єднує часті оновлення клавіатури одного повідомлення в одне edit_message_reply_markup
+    
+    Клавіатура будується в момент надсилання, тож враховує всі натискання за вікно
+    затримки. Оновлення, що не змінює клавіатуру, не надсилається.
+    """
+    
+    def __init__(self, delay, max_tracked):
+        self.delay = delay
+        self.max_tracked = max_tracked
+        self.sent_edits = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self._pending = {}  # {(chat_id, message_id): (bot, функція побудови клавіатури)}
+        self._tasks = {}  # {(chat_id, message_id): asyncio.Task}
+        self._in_flight = set()  # Повідомлення, для яких зараз виконується запит до Telegram
+        self._shown = OrderedDict()  # {(chat_id, message_id): клавіатура, яку бачить користувач}
+    
+    def remember(self, chat_id, message_id, markup):
+        """Запам'ятовує клавіатуру, надіслану разом із повідомленням"""
+        key = (chat_id, message_id)
+        self._shown[key] = markup
+        self._shown.move_to_end(key)
+        while len(self._shown) > self.max_tracked:
+            self._shown.popitem(last=False)
+    
+    def schedule(self, bot, chat_id, message_id, build_markup):
+        """Планує оновлення клавіатури (повторні виклики у вікні затримки об'єднуються)"""
+        key = (chat_id, message_id)
+        if key in self._pending:
+            self.coalesced += 1
+        self._pending[key] = (bot, build_markup)
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._run(key))
+    
+    async def cancel(self, chat_id, message_id):
+        """Скасовує заплановане оновлення (перед тим, як прибрати клавіатуру)"""
+        key = (chat_id, message_id)
+        self._pending.pop(key, None)
+        self._shown.pop(key, None)
+        task = self._tasks.get(key)
+        if task is None:
+            return
+        if key in self._in_flight:
+            # Чекаємо завершення запиту, щоб він не повернув клавіатуру після нашого редагування
+            await asyncio.shield(task)
+        else:
+            # Задача могла ще не стартувати, тоді її finally не виконається
+            del self._tasks[key]
+            task.cancel()
+    
+    async def _run(self, key):
+        try:
+            while key in self._pending:
+                await asyncio.sleep(self.delay)
+                bot, build_markup = self._pending.pop(key)
+                markup = build_markup()
+                if self._shown.get(key) == markup:
+                    self.skipped += 1
+                    continue
+                self._in_flight.add(key)
+                try:
+                    await bot.edit_message_reply_markup(chat_id=key[0], message_id=key[1], reply_markup=markup)
+                    self.sent_edits += 1
+                    self.remember(key[0], key[1], markup)
+                except BadRequest as e:
+                    if "not modified" in str(e):
+                        self.remember(key[0], key[1], markup)
+                    else:
+                        logger.error(f"Error updating keyboard: {e}")
+                except Exception as e:
+                    logger.error(f"Error updating keyboard: {e}")
+                finally:
+                    self._in_flight.discard(key)
+        finally:
+            if self._tasks.get(key) is asyncio.current_task():
+                del self._tasks[key]
+
+keyboard_edits = KeyboardEditDebouncer(KEYBOARD_EDIT_DELAY, SESSION_MAX_SIZE)
+
+register_gauge("hotel_bot_keyboard_edits_total", "Keyboard edits sent to Telegram.",
+               lambda: keyboard_edits.sent_edits, 'counter')
+register_gauge("hotel_bot_keyboard_edits_coalesced_total", "Checkbox taps merged into a pending keyboard edit.",
+               lambda: keyboard_edits.coalesced, 'counter')
+register_gauge("hotel_bot_keyboard_edits_skipped_total", "Keyboard edits dropped because the keyboard did not change.",
+               lambda: keyboard_edits.skipped, 'counter')
+
+# Готові клавіатури {(питання, мова): JSON-розмітка для кожної маски вибору}.
+# Telegram приймає reply_markup як JSON-рядок, а PTB передає рядки без змін,
+# тому при натисканні чекбокса клавіатура не будується і не серіалізується.
+prebuilt_keyboards = {}
+
+def checkbox_options(question, lang):
+    """Назви варіантів питання з чекбоксами мовою користувача"""
+    names = {'region': REGION_NAMES, 'style': STYLE_NAMES, 'purpose': PURPOSE_NAMES}[question]
+    return names[lang] if lang in names else names['en']
+
+def _build_keyboard_variants(question, lang):
+    """Серіалізовані клавіатури питання для всіх масок вибору"""
+    builder = {
+        'region': build_region_keyboard,
+        'style': build_style_keyboard,
+        'purpose': build_purpose_keyboard
+    }[question]
+    return tuple(builder(lang, bits).to_json() for bits in range(1 << len(checkbox_options(question, lang))))
+
+def prebuild_keyboards():
+    """Будує клавіатури всіх питань для всіх мов і комбінацій вибору (під час запуску)"""
+    started = time.perf_counter()
+    for question in ('region', 'style', 'purpose'):
+        for lang in REGION_NAMES:
+            prebuilt_keyboards[(question, lang)] = _build_keyboard_variants(question, lang)
+    count = sum(len(variants) for variants in prebuilt_keyboards.values())
+    logger.info(f"Prebuilt {count} keyboards in {time.perf_counter() - started:.3f}s")
+
+def keyboard_markup(question, lang, bits):
+    """Готова клавіатура (JSON-рядок) для питання, мови та маски вибору"""
+    if lang not in REGION_NAMES:
+        lang = 'en'
+    variants = prebuilt_keyboards.get((question, lang))
+    if variants is None:
+        variants = prebuilt_keyboards[(question, lang)] = _build_keyboard_variants(question, lang)
+    return variants[bits]
+
+def benchmark_keyboards(toggles=20000, seed=0):
+    """
+    Процесорний час на одне натискання чекбокса: побудова та серіалізація
+    InlineKeyboardMarkup проти готової клавіатури з prebuilt_keyboards
+    """
+    import random  # Потрібен лише для бенчмарку
+    started = time.perf_counter()
+    prebuild_keyboards()
+    prebuild_seconds = time.perf_counter() - started
+    size = sum(len(markup.encode('utf-8')) for variants in prebuilt_keyboards.values() for markup in variants)
+    logger.info(f"Prebuilding: {prebuild_seconds:.3f}s, {size / 1024:.0f} KiB of JSON")
+    
+    rng = random.Random(seed)
+    builders = {'region': build_region_keyboard, 'style': build_style_keyboard, 'purpose': build_purpose_keyboard}
+    for question, builder in builders.items():
+        for lang in REGION_NAMES:
+            masks = [rng.randrange(1 << len(checkbox_options(question, lang))) for _ in range(toggles)]
+            # PTB серіалізує InlineKeyboardMarkup у to_json() перед кожним запитом
+            started = time.process_time()
+            rebuilt = [builder(lang, bits).to_json() for bits in masks]
+            rebuild_seconds = time.process_time() - started
+            started = time.process_time()
+            looked_up = [keyboard_markup(question, lang, bits) for bits in masks]
+            lookup_seconds = time.process_time() - started
+            logger.info(f"{question}/{lang}: rebuild {rebuild_seconds / toggles * 1e6:.1f} us/toggle -> "
+                        f"prebuilt {lookup_seconds / toggles * 1e6:.2f} us/toggle "
+                        f"({'same JSON' if rebuilt == looked_up else 'JSON DIFFERS'})")
+
+# Питання з чекбоксами за префіксом callback_data: (питання, поле сесії, максимум вибраних, етап)
+CHECKBOX_QUESTIONS = {
+    'r': ('region', 'region_bits', None, WAITING_REGION_SUBMIT),
+    's': ('style', 'style_bits', 3, WAITING_STYLE_SUBMIT),
+    'p': ('purpose', 'purpose_bits', 2, WAITING_PURPOSE_SUBMIT)
+}
+
+# Попередження про перевищення максимуму вибраних варіантів
+CHECKBOX_LIMIT_ALERTS = {
+    's': {
+        'uk': "Ви вже обрали максимальну кількість стилів (3)",
+        'en': "You have already selected the maximum number of styles (3)"
+    },
+    'p': {
+        'uk': "Ви вже обрали максимальну кількість цілей (2)",
+        'en': "You have already selected the maximum number of purposes (2)"
+    }
+}
+
+@timed_handler
+async def choice_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """
+    Єдиний обробник кнопок опитування
+    
+    callback_data має вигляд "<префікс>:<індекс>" або "<префікс>:ok" (l - мова, r - регіон,
+    c - категорія, s - стиль, p - мета). Індекс - номер варіанта в порядку питання, тому
+    дані не залежать від мови і вміщуються в обмеження Telegram у 64 байти.
+    """
+    query = update.callback_query
+    prefix, _, value = query.data.partition(':')
+    
+    if prefix == 'l':
+        return await language_choice(update, context)
+    if prefix == 'c':
+        return await category_choice(update, context)
+    if value == 'ok':
+        if prefix == 'r':
+            return await region_choice(update, context)
+        if prefix == 's':
+            return await style_choice(update, context)
+        return await purpose_choice(update, context)
+    return await toggle_choice(update, context, prefix, value)
+
+async def toggle_choice(update: Update, context: ContextTypes.DEFAULT_TYPE, prefix, value) -> int:
+    """Перемикає чекбокс регіону, стилю або мети як біт у сесії"""
+    query = update.callback_query
+    question, field, limit, state = CHECKBOX_QUESTIONS[prefix]
+    
+    session = sessions.get(query.from_user.id)
+    if session is None:
+        await query.answer()
+        return await session_expired(update, context)
+    
+    lang = session.language
+    if not value.isdigit() or int(value) >= len(checkbox_options(question, lang)):
+        await query.answer()
+        return state
+    
+    bit = 1 << int(value)
+    
+    # Перевірка ліміту й перемикання без await між ними: паралельні натискання
+    # того ж користувача не перезаписують біти одне одного
+    bits = getattr(session, field)
+    if limit and not bits & bit and bits.bit_count() >= limit:
+        alerts = CHECKBOX_LIMIT_ALERTS[prefix]
+        await query.answer(alerts.get(lang, alerts['en']), show_alert=True)
+        return state
+    setattr(session, field, bits ^ bit)
+    
+    await query.answer()
+    
+    # Оновлюємо лише клавіатуру; швидкі натискання об'єднуються в одне редагування
+    keyboard_edits.schedule(
+        context.bot, query.message.chat_id, query.message.message_id,
+        lambda: keyboard_markup(question, session.language, getattr(session, field))
+    )
+    return state
+
+async def stale_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Відповідає на натискання кнопок попередніх питань, не змінюючи етап розмови"""
+    await update.callback_query.answer()
+
 # Функція старту бота
+@timed_handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.effective_user.id
     
     # Завжди очищати дані користувача при використанні команди /start
-    if user_id in user_data_global:
-        del user_data_global[user_id]
-    
-    # Ініціалізація нових даних
-    user_data_global[user_id] = {}
+    sessions.create(user_id)
     
     # Логування початку нової розмови
     logger.info(f"User {user_id} started a new conversation. Data cleared.")
     
     # Клавіатура для вибору мови за допомогою InlineKeyboardMarkup
     keyboard = [
-        [InlineKeyboardButton("Українська (Ukrainian)", callback_data='lang_uk')],
-        [InlineKeyboardButton("English (Англійська)", callback_data='lang_en')]
+        [InlineKeyboardButton("Українська (Ukrainian)", callback_data='l:uk')],
+        [InlineKeyboardButton("English (Англійська)", callback_data='l:en')]
     ]
     
     await update.message.reply_text(
@@ -160,6 +1589,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return LANGUAGE
 
 # Функція обробки вибору мови
+@timed_handler
 async def language_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обробляє вибір мови користувачем через InlineKeyboard"""
     query = update.callback_query
@@ -168,41 +1598,41 @@ async def language_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     user_id = query.from_user.id
     callback_data = query.data
     
-    if callback_data == 'lang_uk':
-        user_data_global[user_id]['language'] = 'uk'
+    session = sessions.get(user_id)
+    if session is None:
+        return await session_expired(update, context)
+    
+    if callback_data == 'l:uk':
+        session.language = 'uk'
         await query.edit_message_text(
             "Дякую! Я продовжу спілкування українською мовою."
         )
-        # Коротка пауза перед наступним питанням
-        await asyncio.sleep(0.3)
         return await ask_region(update, context)
     
-    elif callback_data == 'lang_en':
-        user_data_global[user_id]['language'] = 'en'
+    elif callback_data == 'l:en':
+        session.language = 'en'
         await query.edit_message_text(
             "Thank you! I will continue our conversation in English."
         )
-        # Коротка пауза перед наступним питанням
-        await asyncio.sleep(0.3)
         return await ask_region(update, context)
     
     else:
-        user_data_global[user_id]['language'] = 'en'  # За замовчуванням англійська
+        session.language = 'en'  # За замовчуванням англійська
         await query.edit_message_text(
             "I'll continue in English. If you need another language, please let me know."
         )
-        # Коротка пауза перед наступним питанням
-        await asyncio.sleep(0.3)
         return await ask_region(update, context)
 
 # Функція скасування
+@timed_handler
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Скасовує розмову з командою /cancel"""
     user = update.message.from_user
     user_id = user.id
     logger.info(f"User {user_id} canceled the conversation.")
     
-    lang = user_data_global.get(user_id, {}).get('language', 'en')
+    session = sessions.get(user_id)
+    lang = session.language if session else 'en'
     
     # Повідомлення про завершення розмови
     if lang == 'uk':
@@ -215,8 +1645,7 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         )
     
     # Видаляємо дані користувача
-    if user_id in user_data_global:
-        del user_data_global[user_id]
+    if sessions.delete(user_id):
         logger.info(f"User data {user_id} successfully deleted")
     
     # Очищаємо контекст, якщо він доступний
@@ -225,11 +1654,45 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     
     return ConversationHandler.END
 
-# ===============================
-# ЧАСТИНА 5: ОБРОБНИКИ РЕГІОНІВ
-# ===============================
+async def session_expired(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Повідомляє, що сесія користувача застаріла або витіснена, і завершує розмову"""
+    logger.info(f"Session of user {update.effective_user.id} not found or expired.")
+    await context.bot.send_message(
+        chat_id=update.effective_chat.id,
+        text="Your session has expired. To start again, send the /start command.\n"
+        "(Ваша сесія завершилась. Щоб почати знову, надішліть команду /start.)"
+    )
+    return ConversationHandler.END
+
+# ===============================
+# ЧАСТИНА 7: ОБРОБНИКИ РЕГІОНІВ
+# ===============================
+
+def build_region_keyboard(lang, region_bits):
+    """Клавіатура питання 1/4: регіони з чекбоксами по 2 в ряду та кнопка підтвердження"""
+    regions = REGION_NAMES[lang] if lang in REGION_NAMES else REGION_NAMES['en']
+    keyboard = []
+    
+    # Групуємо регіони по 2 в ряду з номерами
+    for i in range(0, len(regions), 2):
+        row = []
+        for j in range(2):
+            if i + j < len(regions):
+                region = regions[i + j]
+                region_index = i + j + 1
+                checkbox = "✅ " if region_bits >> (i + j) & 1 else "☐ "
+                row.append(InlineKeyboardButton(
+                    f"{checkbox}{region_index}. {region}", 
+                    callback_data=f"r:{i + j}"
+                ))
+        keyboard.append(row)
+    
+    # Додаємо кнопку "Відповісти" внизу
+    keyboard.append([InlineKeyboardButton(SUBMIT_TEXT.get(lang, SUBMIT_TEXT['en']), callback_data="r:ok")])
+    return InlineKeyboardMarkup(keyboard)
 
 # Функції вибору регіону
+@timed_handler
 async def ask_region(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Питання про регіони подорожі з чекбоксами"""
     # Визначаємо, чи це відповідь на callback_query або новий запит
@@ -243,20 +1706,13 @@ async def ask_region(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         chat_id = update.message.chat_id
         message_id = None
     
-    lang = user_data_global[user_id]['language']
+    session = sessions.get(user_id)
+    if session is None:
+        return await session_expired(update, context)
     
-    # Ініціалізуємо вибрані регіони, якщо їх ще не обрано
-    if 'selected_regions' not in user_data_global[user_id]:
-        user_data_global[user_id]['selected_regions'] = []
+    lang = session.language
     
-    # Створюємо InlineKeyboard з чекбоксами
     if lang == 'uk':
-        regions = [
-            "Європа", "Північна Америка", "Азія",
-            "Близький Схід", "Африка", "Південна Америка",
-            "Карибський басейн", "Океанія"
-        ]
-        
         regions_description = (
             "Питання 1/4:\n"
             "У яких регіонах світу ви плануєте подорожувати?\n"
@@ -272,14 +1728,7 @@ async def ask_region(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         )
         
         title_text = regions_description
-        submit_text = "Відповісти"
     else:
-        regions = [
-            "Europe", "North America", "Asia",
-            "Middle East", "Africa", "South America",
-            "Caribbean", "Oceania"
-        ]
-        
         regions_description = (
             "Question 1/4:\n"
             "In which regions of the world are you planning to travel?\n"
@@ -295,28 +1744,9 @@ async def ask_region(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         )
         
         title_text = regions_description
-        submit_text = "Submit"
-    
-    # Створюємо клавіатуру з чекбоксами для регіонів
-    keyboard = []
-    selected_regions = user_data_global[user_id]['selected_regions']
-    
-    # Групуємо регіони по 2 в ряду з номерами
-    for i in range(0, len(regions), 2):
-        row = []
-        for j in range(2):
-            if i + j < len(regions):
-                region = regions[i + j]
-                region_index = i + j + 1
-                checkbox = "✅ " if region in selected_regions else "☐ "
-                row.append(InlineKeyboardButton(
-                    f"{checkbox}{region_index}. {region}", 
-                    callback_data=f"region_{region}"
-                ))
-        keyboard.append(row)
     
-    # Додаємо кнопку "Відповісти" внизу
-    keyboard.append([InlineKeyboardButton(submit_text, callback_data="region_submit")])
+    # Готова клавіатура з чекбоксами для регіонів
+    reply_markup = keyboard_markup('region', lang, session.region_bits)
     
     # Використовуємо edit_message_text, якщо це оновлення існуючого повідомлення
     if message_id:
@@ -325,85 +1755,75 @@ async def ask_region(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
                 chat_id=chat_id,
                 message_id=message_id,
                 text=title_text,
-                reply_markup=InlineKeyboardMarkup(keyboard)
+                reply_markup=reply_markup
             )
         except Exception as e:
             logger.error(f"Error updating message: {e}")
-            await context.bot.send_message(
+            message = await context.bot.send_message(
                 chat_id=chat_id,
                 text=title_text,
-                reply_markup=InlineKeyboardMarkup(keyboard)
+                reply_markup=reply_markup
             )
+            message_id = message.message_id
     else:
-        await context.bot.send_message(
+        message = await context.bot.send_message(
             chat_id=chat_id,
             text=title_text,
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            reply_markup=reply_markup
         )
+        message_id = message.message_id
     
+    keyboard_edits.remember(chat_id, message_id, reply_markup)
     return WAITING_REGION_SUBMIT
 
+@timed_handler
 async def region_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Обробляє вибір регіону через чекбокси"""
+    """Підтверджує вибір регіонів (кнопка "Відповісти")"""
     query = update.callback_query
-    await query.answer()
-    
     user_id = query.from_user.id
-    callback_data = query.data
     
-    # Якщо користувач натиснув "Відповісти"
-    if callback_data == "region_submit":
-        selected_regions = user_data_global[user_id]['selected_regions']
-        lang = user_data_global[user_id]['language']
-        
-        # Перевіряємо, чи вибрано хоча б один регіон
-        if not selected_regions:
-            if lang == 'uk':
-                await query.answer("Будь ласка, виберіть хоча б один регіон", show_alert=True)
-            else:
-                await query.answer("Please select at least one region", show_alert=True)
-            return WAITING_REGION_SUBMIT
-        
-        # Зберігаємо вибрані регіони
-        user_data_global[user_id]['regions'] = selected_regions
-        user_data_global[user_id]['countries'] = None
-        
-        # Оновлюємо повідомлення, видаляючи клавіатуру
-        await query.edit_message_text(text=query.message.text)
-        
-        # Надсилаємо нове повідомлення з підтвердженням
+    session = sessions.get(user_id)
+    if session is None:
+        await query.answer()
+        return await session_expired(update, context)
+    
+    lang = session.language
+    
+    # Перевіряємо, чи вибрано хоча б один регіон
+    if not session.region_bits:
         if lang == 'uk':
-            await context.bot.send_message(
-                chat_id=query.message.chat_id,
-                text=f"Дякую! Ви обрали наступні регіони: {', '.join(selected_regions)}."
-            )
+            await query.answer("Будь ласка, виберіть хоча б один регіон", show_alert=True)
         else:
-            await context.bot.send_message(
-                chat_id=query.message.chat_id,
-                text=f"Thank you! You have chosen the following regions: {', '.join(selected_regions)}."
-            )
-        
-        await asyncio.sleep(0.3)
-        return await ask_category(update, context)
+            await query.answer("Please select at least one region", show_alert=True)
+        return WAITING_REGION_SUBMIT
     
-    # Якщо це вибір регіону
+    await query.answer()
+    selected_regions = selected_names(REGION_NAMES, lang, session.region_bits)
+    
+    # Оновлюємо повідомлення, видаляючи клавіатуру (відкладене оновлення кнопок вже не потрібне)
+    await keyboard_edits.cancel(query.message.chat_id, query.message.message_id)
+    await query.edit_message_text(text=query.message.text)
+    
+    # Надсилаємо нове повідомлення з підтвердженням
+    if lang == 'uk':
+        await context.bot.send_message(
+            chat_id=query.message.chat_id,
+            text=f"Дякую! Ви обрали наступні регіони: {', '.join(selected_regions)}."
+        )
     else:
-        region = callback_data.replace("region_", "")
-        
-        # Перемикаємо стан вибору регіону
-        if region in user_data_global[user_id]['selected_regions']:
-            user_data_global[user_id]['selected_regions'].remove(region)
-        else:
-            user_data_global[user_id]['selected_regions'].append(region)
-        
-        # Оновлюємо клавіатуру
-        return await ask_region(update, context)
+        await context.bot.send_message(
+            chat_id=query.message.chat_id,
+            text=f"Thank you! You have chosen the following regions: {', '.join(selected_regions)}."
+        )
+    
+    return await ask_category(update, context)
 
 # ===============================
-# ЧАСТИНА 6: ОБРОБНИКИ КАТЕГОРІЙ
+# ЧАСТИНА 8: ОБРОБНИКИ КАТЕГОРІЙ
 # ===============================
 
 # Функції категорії
+@timed_handler
 async def ask_category(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Питання про категорію готелю"""
     # Визначаємо, чи це відповідь на callback_query
@@ -415,14 +1835,18 @@ async def ask_category(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         user_id = update.message.from_user.id
         chat_id = update.message.chat_id
     
-    lang = user_data_global[user_id]['language']
+    session = sessions.get(user_id)
+    if session is None:
+        return await session_expired(update, context)
+    
+    lang = session.language
     
     # Створюємо InlineKeyboard для вибору категорії
     if lang == 'uk':
         keyboard = [
-            [InlineKeyboardButton("1. Luxury (преміум-клас)", callback_data='category_Luxury')],
-            [InlineKeyboardButton("2. Comfort (середній клас)", callback_data='category_Comfort')],
-            [InlineKeyboardButton("3. Standard (економ-клас)", callback_data='category_Standard')]
+            [InlineKeyboardButton("1. Luxury (преміум-клас)", callback_data='c:0')],
+            [InlineKeyboardButton("2. Comfort (середній клас)", callback_data='c:1')],
+            [InlineKeyboardButton("3. Standard (економ-клас)", callback_data='c:2')]
         ]
         
         await context.bot.send_message(
@@ -438,9 +1862,9 @@ async def ask_category(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         )
     else:
         keyboard = [
-            [InlineKeyboardButton("1. Luxury (premium class)", callback_data='category_Luxury')],
-            [InlineKeyboardButton("2. Comfort (middle class)", callback_data='category_Comfort')],
-            [InlineKeyboardButton("3. Standard (economy class)", callback_data='category_Standard')]
+            [InlineKeyboardButton("1. Luxury (premium class)", callback_data='c:0')],
+            [InlineKeyboardButton("2. Comfort (middle class)", callback_data='c:1')],
+            [InlineKeyboardButton("3. Standard (economy class)", callback_data='c:2')]
         ]
         
         await context.bot.send_message(
@@ -457,16 +1881,25 @@ async def ask_category(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     
     return CATEGORY
 
+@timed_handler
 async def category_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
 
     user_id = query.from_user.id
     callback_data = query.data
-    lang = user_data_global[user_id]['language']
+    session = sessions.get(user_id)
+    if session is None:
+        return await session_expired(update, context)
+    lang = session.language
 
-    category = callback_data.replace("category_", "")
-    user_data_global[user_id]['category'] = category
+    # Категорії у порядку кнопок: Luxury, Comfort, Standard
+    index = callback_data.partition(":")[2]
+    categories = list(CATEGORY_MAPPING)
+    if not index.isdigit() or int(index) >= len(categories):
+        return CATEGORY
+    category = categories[int(index)]
+    session.category = category
 
     # Видаляємо клавіатуру з попереднього повідомлення
     await query.edit_message_text(
@@ -486,14 +1919,30 @@ async def category_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             text=f"Thank you! You have chosen the category: {category}."
         )
 
-    await asyncio.sleep(0.3)
-
     return await ask_style(update, context)
 
 # ===============================
-# ЧАСТИНА 7: ОБРОБНИКИ СТИЛЮ
+# ЧАСТИНА 9: ОБРОБНИКИ СТИЛЮ
 # ===============================
 
+def build_style_keyboard(lang, style_bits):
+    """Клавіатура питання 3/4: стилі з чекбоксами та кнопка підтвердження"""
+    styles = STYLE_NAMES[lang] if lang in STYLE_NAMES else STYLE_NAMES['en']
+    keyboard = []
+    
+    # Додаємо стилі з номерами
+    for i, style in enumerate(styles):
+        checkbox = "✅ " if style_bits >> i & 1 else "☐ "
+        keyboard.append([InlineKeyboardButton(
+            f"{checkbox}{i+1}. {style}", 
+            callback_data=f"s:{i}"
+        )])
+    
+    # Додаємо кнопку "Відповісти" внизу
+    keyboard.append([InlineKeyboardButton(SUBMIT_TEXT.get(lang, SUBMIT_TEXT['en']), callback_data="s:ok")])
+    return InlineKeyboardMarkup(keyboard)
+
+@timed_handler
 async def ask_style(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Питання про стиль готелю з чекбоксами та детальними описами"""
     
@@ -505,23 +1954,13 @@ async def ask_style(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         user_id = update.message.from_user.id
         chat_id = update.message.chat_id
     
-    lang = user_data_global[user_id]['language']
+    session = sessions.get(user_id)
+    if session is None:
+        return await session_expired(update, context)
     
-    # Ініціалізуємо вибрані стилі, якщо їх ще не обрано
-    if 'selected_styles' not in user_data_global[user_id]:
-        user_data_global[user_id]['selected_styles'] = []
+    lang = session.language
     
-    # Створюємо InlineKeyboard з чекбоксами для стилів
     if lang == 'uk':
-        styles = [
-            "Розкішний і вишуканий", 
-            "Бутік і унікальний", 
-            "Класичний і традиційний", 
-            "Сучасний і дизайнерський",
-            "Затишний і сімейний", 
-            "Практичний і економічний"
-        ]
-        
         styles_description = (
             "Питання 3/4:\n"
             "Який стиль готелю ви зазвичай обираєте?\n"
@@ -535,17 +1974,7 @@ async def ask_style(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         )
         
         title_text = styles_description
-        submit_text = "Відповісти"
     else:
-        styles = [
-            "Luxurious and refined", 
-            "Boutique and unique",
-            "Classic and traditional", 
-            "Modern and designer",
-            "Cozy and family-friendly", 
-            "Practical and economical"
-        ]
-        
         styles_description = (
             "Question 3/4:\n"
             "What hotel style do you usually choose?\n"
@@ -559,157 +1988,142 @@ async def ask_style(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         )
         
         title_text = styles_description
-        submit_text = "Submit"
-    
-    # Створюємо клавіатуру з чекбоксами для стилів
-    keyboard = []
-    selected_styles = user_data_global[user_id]['selected_styles']
-    
-    # Додаємо стилі з номерами
-    for i, style in enumerate(styles):
-        checkbox = "✅ " if style in selected_styles else "☐ "
-        keyboard.append([InlineKeyboardButton(
-            f"{checkbox}{i+1}. {style}", 
-            callback_data=f"style_{style}"
-        )])
     
-    # Додаємо кнопку "Відповісти" внизу
-    keyboard.append([InlineKeyboardButton(submit_text, callback_data="style_submit")])
+    # Готова клавіатура з чекбоксами для стилів
+    reply_markup = keyboard_markup('style', lang, session.style_bits)
     
     # Перевіряємо, чи це оновлення існуючого повідомлення зі стилями
-    if 'style_message_id' in user_data_global[user_id]:
+    if session.style_message_id is not None:
         try:
             # Оновлюємо існуюче повідомлення зі стилями
             await context.bot.edit_message_text(
                 chat_id=chat_id,
-                message_id=user_data_global[user_id]['style_message_id'],
+                message_id=session.style_message_id,
                 text=title_text,
-                reply_markup=InlineKeyboardMarkup(keyboard),
+                reply_markup=reply_markup,
                 parse_mode="Markdown"
             )
+            keyboard_edits.remember(chat_id, session.style_message_id, reply_markup)
             return WAITING_STYLE_SUBMIT
         except Exception as e:
             logger.error(f"Error updating style message: {e}")
             # Видаляємо недійсний ID повідомлення
-            del user_data_global[user_id]['style_message_id']
+            session.style_message_id = None
     
     # Надсилаємо НОВЕ повідомлення для питання 3/4
     try:
         message = await context.bot.send_message(
             chat_id=chat_id,
             text=title_text,
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            reply_markup=reply_markup,
             parse_mode="Markdown"
         )
         # Зберігаємо ID повідомлення для майбутніх оновлень
-        user_data_global[user_id]['style_message_id'] = message.message_id
+        session.style_message_id = message.message_id
     except Exception as e:
         logger.error(f"Error sending style message: {e}")
         # Відправляємо без Markdown, якщо є проблеми з форматуванням
         message = await context.bot.send_message(
             chat_id=chat_id,
             text=title_text,
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            reply_markup=reply_markup
         )
-        user_data_global[user_id]['style_message_id'] = message.message_id
+        session.style_message_id = message.message_id
     
+    keyboard_edits.remember(chat_id, session.style_message_id, reply_markup)
     return WAITING_STYLE_SUBMIT
 
+@timed_handler
 async def style_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Обробляє вибір стилю через чекбокси"""
+    """Підтверджує вибір стилів (кнопка "Відповісти")"""
     query = update.callback_query
-    await query.answer()
-    
     user_id = query.from_user.id
-    callback_data = query.data
     
-    # Якщо користувач натиснув "Відповісти"
-    if callback_data == "style_submit":
-        selected_styles = user_data_global[user_id]['selected_styles']
-        lang = user_data_global[user_id]['language']
-        
-        # Перевіряємо, чи вибрано хоча б один стиль
-        if not selected_styles:
-            if lang == 'uk':
-                await query.answer("Будь ласка, виберіть хоча б один стиль", show_alert=True)
-            else:
-                await query.answer("Please select at least one style", show_alert=True)
-            return WAITING_STYLE_SUBMIT
-        
-        # Обмеження до трьох варіантів
-        if len(selected_styles) > 3:
-            original_count = len(selected_styles)
-            user_data_global[user_id]['selected_styles'] = selected_styles[:3]
-            
-            if lang == 'uk':
-                await query.answer(
-                    f"Ви обрали {original_count} стилів, але дозволено максимум 3. "
-                    f"Враховано тільки перші три стилі.", 
-                    show_alert=True
-                )
-            else:
-                await query.answer(
-                    f"You selected {original_count} styles, but a maximum of 3 is allowed. "
-                    f"Only the first three have been considered.", 
-                    show_alert=True
-                )
-            # Оновлюємо вибір та клавіатуру
-            return await ask_style(update, context)
-        
-        # Зберігаємо вибрані стилі
-        user_data_global[user_id]['styles'] = selected_styles
-        
-        # Видаляємо клавіатуру, але зберігаємо текст питання 3/4
-        try:
-            await query.edit_message_text(text=query.message.text, reply_markup=None, parse_mode="Markdown")
-        except:
-            await query.edit_message_text(text=query.message.text, reply_markup=None)
+    session = sessions.get(user_id)
+    if session is None:
+        await query.answer()
+        return await session_expired(update, context)
+    
+    selected_styles = selected_names(STYLE_NAMES, session.language, session.style_bits)
+    lang = session.language
+    
+    # Перевіряємо, чи вибрано хоча б один стиль
+    if not selected_styles:
+        if lang == 'uk':
+            await query.answer("Будь ласка, виберіть хоча б один стиль", show_alert=True)
+        else:
+            await query.answer("Please select at least one style", show_alert=True)
+        return WAITING_STYLE_SUBMIT
+    
+    # Обмеження до трьох варіантів
+    if len(selected_styles) > 3:
+        original_count = len(selected_styles)
+        for extra in selected_styles[3:]:
+            session.style_bits &= ~option_bit(STYLE_NAMES, lang, extra)
         
-        # Надсилаємо НОВЕ повідомлення з підтвердженням вибору
         if lang == 'uk':
-            await context.bot.send_message(
-                chat_id=query.message.chat_id,
-                text=f"Дякую! Ви обрали наступні стилі: {', '.join(selected_styles)}."
+            await query.answer(
+                f"Ви обрали {original_count} стилів, але дозволено максимум 3. "
+                f"Враховано тільки перші три стилі.", 
+                show_alert=True
             )
         else:
-            await context.bot.send_message(
-                chat_id=query.message.chat_id,
-                text=f"Thank you! You have chosen the following styles: {', '.join(selected_styles)}."
+            await query.answer(
+                f"You selected {original_count} styles, but a maximum of 3 is allowed. "
+                f"Only the first three have been considered.", 
+                show_alert=True
             )
-        
-        # Очищуємо ID повідомлення зі стилем
-        if 'style_message_id' in user_data_global[user_id]:
-            del user_data_global[user_id]['style_message_id']
-        
-        await asyncio.sleep(0.3)
-        return await ask_purpose(update, context)
+        # Оновлюємо вибір та клавіатуру
+        return await ask_style(update, context)
+    
+    await query.answer()
+    
+    # Видаляємо клавіатуру, але зберігаємо текст питання 3/4
+    await keyboard_edits.cancel(query.message.chat_id, query.message.message_id)
+    try:
+        await query.edit_message_text(text=query.message.text, reply_markup=None, parse_mode="Markdown")
+    except:
+        await query.edit_message_text(text=query.message.text, reply_markup=None)
     
-    # Якщо це вибір або скасування вибору стилю
+    # Надсилаємо НОВЕ повідомлення з підтвердженням вибору
+    if lang == 'uk':
+        await context.bot.send_message(
+            chat_id=query.message.chat_id,
+            text=f"Дякую! Ви обрали наступні стилі: {', '.join(selected_styles)}."
+        )
     else:
-        style = callback_data.replace("style_", "")
-        
-        # Перевіряємо, чи не перевищено максимальну кількість стилів (3)
-        if style not in user_data_global[user_id]['selected_styles'] and len(user_data_global[user_id]['selected_styles']) >= 3:
-            lang = user_data_global[user_id]['language']
-            if lang == 'uk':
-                await query.answer("Ви вже обрали максимальну кількість стилів (3)", show_alert=True)
-            else:
-                await query.answer("You have already selected the maximum number of styles (3)", show_alert=True)
-            return WAITING_STYLE_SUBMIT
-        
-        # Перемикаємо стан вибору стилю
-        if style in user_data_global[user_id]['selected_styles']:
-            user_data_global[user_id]['selected_styles'].remove(style)
-        else:
-            user_data_global[user_id]['selected_styles'].append(style)
-        
-        # Оновлюємо клавіатуру з новим вибором
-        return await ask_style(update, context)
+        await context.bot.send_message(
+            chat_id=query.message.chat_id,
+            text=f"Thank you! You have chosen the following styles: {', '.join(selected_styles)}."
+        )
+    
+    # Очищуємо ID повідомлення зі стилем
+    session.style_message_id = None
+    
+    return await ask_purpose(update, context)
 
 # ===============================
-# ЧАСТИНА 8: ОБРОБНИКИ МЕТИ ПОДОРОЖІ
+# ЧАСТИНА 10: ОБРОБНИКИ МЕТИ ПОДОРОЖІ
 # ===============================
 
+def build_purpose_keyboard(lang, purpose_bits):
+    """Клавіатура питання 4/4: цілі з чекбоксами та кнопка підтвердження"""
+    purposes = PURPOSE_NAMES[lang] if lang in PURPOSE_NAMES else PURPOSE_NAMES['en']
+    keyboard = []
+    
+    # Додаємо цілі з номерами
+    for i, purpose in enumerate(purposes):
+        checkbox = "✅ " if purpose_bits >> i & 1 else "☐ "
+        keyboard.append([InlineKeyboardButton(
+            f"{checkbox}{i+1}. {purpose}", 
+            callback_data=f"p:{i}"
+        )])
+    
+    # Додаємо кнопку "Відповісти" внизу
+    keyboard.append([InlineKeyboardButton(SUBMIT_TEXT.get(lang, SUBMIT_TEXT['en']), callback_data="p:ok")])
+    return InlineKeyboardMarkup(keyboard)
+
+@timed_handler
 async def ask_purpose(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Питання про мету подорожі з чекбоксами та детальними описами"""
     
@@ -721,21 +2135,13 @@ async def ask_purpose(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
         user_id = update.message.from_user.id
         chat_id = update.message.chat_id
     
-    lang = user_data_global[user_id]['language']
+    session = sessions.get(user_id)
+    if session is None:
+        return await session_expired(update, context)
     
-    # Ініціалізуємо вибрані цілі, якщо їх ще не обрано
-    if 'selected_purposes' not in user_data_global[user_id]:
-        user_data_global[user_id]['selected_purposes'] = []
+    lang = session.language
     
-    # Створюємо InlineKeyboard з чекбоксами для цілей
     if lang == 'uk':
-        purposes = [
-            "Бізнес-подорожі / відрядження",
-            "Відпустка / релакс",
-            "Сімейний відпочинок",
-            "Довготривале проживання"
-        ]
-        
         purpose_description = (
             "Питання 4/4:\n"
             "З якою метою ви зазвичай зупиняєтесь у готелі?\n"
@@ -747,15 +2153,7 @@ async def ask_purpose(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
         )
         
         title_text = purpose_description
-        submit_text = "Відповісти"
     else:
-        purposes = [
-            "Business travel",
-            "Vacation / relaxation",
-            "Family vacation",
-            "Long-term stay"
-        ]
-        
         purpose_description = (
             "Question 4/4:\n"
             "For what purpose do you usually stay at a hotel?\n"
@@ -767,408 +2165,349 @@ async def ask_purpose(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
         )
         
         title_text = purpose_description
-        submit_text = "Submit"
-    
-    # Створюємо клавіатуру з чекбоксами для цілей з номерами
-    keyboard = []
-    selected_purposes = user_data_global[user_id]['selected_purposes']
-    
-    # Додаємо цілі з номерами
-    for i, purpose in enumerate(purposes):
-        checkbox = "✅ " if purpose in selected_purposes else "☐ "
-        keyboard.append([InlineKeyboardButton(
-            f"{checkbox}{i+1}. {purpose}", 
-            callback_data=f"purpose_{purpose}"
-        )])
     
-    # Додаємо кнопку "Відповісти" внизу
-    keyboard.append([InlineKeyboardButton(submit_text, callback_data="purpose_submit")])
+    # Готова клавіатура з чекбоксами для цілей
+    reply_markup = keyboard_markup('purpose', lang, session.purpose_bits)
     
     # Перевіряємо, чи це оновлення існуючого повідомлення з метою
-    if 'purpose_message_id' in user_data_global[user_id]:
+    if session.purpose_message_id is not None:
         try:
             # Оновлюємо існуюче повідомлення з метою
             await context.bot.edit_message_text(
                 chat_id=chat_id,
-                message_id=user_data_global[user_id]['purpose_message_id'],
+                message_id=session.purpose_message_id,
                 text=title_text,
-                reply_markup=InlineKeyboardMarkup(keyboard),
+                reply_markup=reply_markup,
                 parse_mode="Markdown"
             )
+            keyboard_edits.remember(chat_id, session.purpose_message_id, reply_markup)
             return WAITING_PURPOSE_SUBMIT
         except Exception as e:
             logger.error(f"Error updating purpose message: {e}")
             # Видаляємо недійсний ID повідомлення
-            del user_data_global[user_id]['purpose_message_id']
+            session.purpose_message_id = None
     
     # Надсилаємо НОВЕ повідомлення для питання 4/4
     try:
         message = await context.bot.send_message(
             chat_id=chat_id,
             text=title_text,
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            reply_markup=reply_markup,
             parse_mode="Markdown"
         )
         # Зберігаємо ID повідомлення для майбутніх оновлень
-        user_data_global[user_id]['purpose_message_id'] = message.message_id
+        session.purpose_message_id = message.message_id
     except Exception as e:
         logger.error(f"Error sending purpose message: {e}")
         # Відправляємо без Markdown, якщо є проблеми з форматуванням
         message = await context.bot.send_message(
             chat_id=chat_id,
             text=title_text,
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            reply_markup=reply_markup
         )
-        user_data_global[user_id]['purpose_message_id'] = message.message_id
+        session.purpose_message_id = message.message_id
     
+    keyboard_edits.remember(chat_id, session.purpose_message_id, reply_markup)
     return WAITING_PURPOSE_SUBMIT
 
+@timed_handler
 async def purpose_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Обробляє вибір мети через чекбокси"""
+    """Підтверджує вибір мети подорожі (кнопка "Відповісти")"""
     query = update.callback_query
-    await query.answer()
-    
     user_id = query.from_user.id
-    callback_data = query.data
     
-    # Якщо користувач натиснув "Відповісти"
-    if callback_data == "purpose_submit":
-        selected_purposes = user_data_global[user_id]['selected_purposes']
-        lang = user_data_global[user_id]['language']
-        
-        # Перевіряємо, чи вибрано хоча б одну мету
-        if not selected_purposes:
-            if lang == 'uk':
-                await query.answer("Будь ласка, виберіть хоча б одну мету", show_alert=True)
-            else:
-                await query.answer("Please select at least one purpose", show_alert=True)
-            return WAITING_PURPOSE_SUBMIT
-        
-        # Обмеження до двох варіантів
-        if len(selected_purposes) > 2:
-            original_count = len(selected_purposes)
-            user_data_global[user_id]['selected_purposes'] = selected_purposes[:2]
-            
-            if lang == 'uk':
-                await query.answer(
-                    f"Ви обрали {original_count} цілей, але дозволено максимум 2. "
-                    f"Враховано тільки перші дві цілі.", 
-                    show_alert=True
-                )
-            else:
-                await query.answer(
-                    f"You selected {original_count} purposes, but a maximum of 2 is allowed. "
-                    f"Only the first two have been considered.", 
-                    show_alert=True
-                )
-            # Оновлюємо вибір та клавіатуру
-            return await ask_purpose(update, context)
-        
-        # Зберігаємо вибрані цілі
-        user_data_global[user_id]['purposes'] = selected_purposes
-        
-        # Видаляємо клавіатуру, але зберігаємо текст питання 4/4
-        try:
-            await query.edit_message_text(text=query.message.text, reply_markup=None, parse_mode="Markdown")
-        except:
-            await query.edit_message_text(text=query.message.text, reply_markup=None)
+    session = sessions.get(user_id)
+    if session is None:
+        await query.answer()
+        return await session_expired(update, context)
+    
+    selected_purposes = selected_names(PURPOSE_NAMES, session.language, session.purpose_bits)
+    lang = session.language
+    
+    # Перевіряємо, чи вибрано хоча б одну мету
+    if not selected_purposes:
+        if lang == 'uk':
+            await query.answer("Будь ласка, виберіть хоча б одну мету", show_alert=True)
+        else:
+            await query.answer("Please select at least one purpose", show_alert=True)
+        return WAITING_PURPOSE_SUBMIT
+    
+    # Обмеження до двох варіантів
+    if len(selected_purposes) > 2:
+        original_count = len(selected_purposes)
+        for extra in selected_purposes[2:]:
+            session.purpose_bits &= ~option_bit(PURPOSE_NAMES, lang, extra)
         
-        # Надсилаємо НОВЕ повідомлення з підтвердженням вибору
         if lang == 'uk':
-            await context.bot.send_message(
-                chat_id=query.message.chat_id,
-                text=f"Дякую! Ви обрали наступні мети: {', '.join(selected_purposes)}.\n"
-                "Зачекайте, будь ласка, поки я проаналізую ваші відповіді та підберу найкращі програми лояльності для вас."
+            await query.answer(
+                f"Ви обрали {original_count} цілей, але дозволено максимум 2. "
+                f"Враховано тільки перші дві цілі.", 
+                show_alert=True
             )
         else:
-            await context.bot.send_message(
-                chat_id=query.message.chat_id,
-                text=f"Thank you! You have chosen the following purposes: {', '.join(selected_purposes)}.\n"
-                "Please wait while I analyze your answers and select the best loyalty programs for you."
+            await query.answer(
+                f"You selected {original_count} purposes, but a maximum of 2 is allowed. "
+                f"Only the first two have been considered.", 
+                show_alert=True
             )
-        
-        # Очищуємо ID повідомлення з метою
-        if 'purpose_message_id' in user_data_global[user_id]:
-            del user_data_global[user_id]['purpose_message_id']
-        
-        # Розрахунок і відображення результатів
-        return await calculate_and_show_results(update, context)
+        # Оновлюємо вибір та клавіатуру
+        return await ask_purpose(update, context)
+    
+    await query.answer()
+    
+    # Видаляємо клавіатуру, але зберігаємо текст питання 4/4
+    await keyboard_edits.cancel(query.message.chat_id, query.message.message_id)
+    try:
+        await query.edit_message_text(text=query.message.text, reply_markup=None, parse_mode="Markdown")
+    except:
+        await query.edit_message_text(text=query.message.text, reply_markup=None)
     
-    # Якщо це вибір або скасування вибору мети
+    # Надсилаємо НОВЕ повідомлення з підтвердженням вибору
+    if lang == 'uk':
+        await context.bot.send_message(
+            chat_id=query.message.chat_id,
+            text=f"Дякую! Ви обрали наступні мети: {', '.join(selected_purposes)}.\n"
+            "Зачекайте, будь ласка, поки я проаналізую ваші відповіді та підберу найкращі програми лояльності для вас."
+        )
     else:
-        purpose = callback_data.replace("purpose_", "")
-        
-        # Перевіряємо, чи не перевищено максимальну кількість цілей (2)
-        if purpose not in user_data_global[user_id]['selected_purposes'] and len(user_data_global[user_id]['selected_purposes']) >= 2:
-            lang = user_data_global[user_id]['language']
-            if lang == 'uk':
-                await query.answer("Ви вже обрали максимальну кількість цілей (2)", show_alert=True)
-            else:
-                await query.answer("You have already selected the maximum number of purposes (2)", show_alert=True)
-            return WAITING_PURPOSE_SUBMIT
-        
-        # Перемикаємо стан вибору мети
-        if purpose in user_data_global[user_id]['selected_purposes']:
-            user_data_global[user_id]['selected_purposes'].remove(purpose)
-        else:
-            user_data_global[user_id]['selected_purposes'].append(purpose)
-        
-        # Оновлюємо клавіатуру з новим вибором
-        return await ask_purpose(update, context)
+        await context.bot.send_message(
+            chat_id=query.message.chat_id,
+            text=f"Thank you! You have chosen the following purposes: {', '.join(selected_purposes)}.\n"
+            "Please wait while I analyze your answers and select the best loyalty programs for you."
+        )
+    
+    # Очищуємо ID повідомлення з метою
+    session.purpose_message_id = None
+    
+    # Розрахунок і відображення результатів
+    return await calculate_and_show_results(update, context)
 
 # ===============================
-# ЧАСТИНА 9: ФУНКЦІЇ MAPPING ГОТЕЛІВ ЗІ СТИЛЯМИ ТА МЕТОЮ
+# ЧАСТИНА 11: ФУНКЦІЇ MAPPING ГОТЕЛІВ ЗІ СТИЛЯМИ ТА МЕТОЮ
 # ===============================
 
-def map_hotel_style(hotel_brand):
+# Повний словник стилів і брендів (порядок ключів задає номери бітів у style_mask)
+STYLE_BRAND_MAPPING = {
+    "Розкішний і вишуканий": [
+        "JW Marriott", "The Ritz-Carlton", "Conrad Hotels & Resorts", 
+        "Waldorf Astoria Hotels & Resorts", "InterContinental Hotels & Resorts", 
+        "Wyndham Grand", "Registry Collection Hotels", "Fairmont Hotels", 
+        "Raffles Hotels & Resorts", "Park Hyatt Hotels", "Alila Hotels", 
+        "Hyatt Regency", "Grand Hyatt", "Ascend Hotel Collection"
+    ],
+    
+    "Бутік і унікальний": [
+        "Kimpton Hotels & Restaurants", "Registry Collection Hotels", 
+        "Mercure Hotels", "ibis Styles", "Park Hyatt Hotels", 
+        "Alila Hotels", "Ascend Hotel Collection"
+    ],
+    
+    "Класичний і традиційний": [
+        "The Ritz-Carlton", "Marriott Hotels", "Sheraton", 
+        "Waldorf Astoria Hotels & Resorts", "Hilton Hotels & Resorts", 
+        "InterContinental Hotels & Resorts", "Holiday Inn Hotels & Resorts", 
+        "Wyndham", "Fairmont Hotels", "Raffles Hotels & Resorts", 
+        "Ascend Hotel Collection"
+    ],
+    
+    "Сучасний і дизайнерський": [
+        "Conrad Hotels & Resorts", "Kimpton Hotels & Restaurants", 
+        "Crowne Plaza", "Wyndham Grand", "Novotel Hotels", 
+        "Ibis Hotels", "ibis Styles", "Cambria Hotels", 
+        "Park Hyatt Hotels", "Grand Hyatt", "Hyatt Place"
+    ],
+    
+    "Затишний і сімейний": [
+        "Fairfield Inn & Suites", "DoubleTree by Hilton", 
+        "Hampton by Hilton", "Holiday Inn Hotels & Resorts", 
+        "Candlewood Suites", "Wyndham", "Days Inn by Wyndham", 
+        "Mercure Hotels", "Novotel Hotels", "Quality Inn Hotels", 
+        "Comfort Inn Hotels", "Hyatt House"
+    ],
+    
+    "Практичний і економічний": [
+        "Fairfield Inn & Suites", "Courtyard by Marriott", 
+        "Hampton by Hilton", "Hilton Garden Inn", 
+        "Holiday Inn Hotels & Resorts", "Holiday Inn Express", 
+        "Candlewood Suites", "Wingate by Wyndham", 
+        "Super 8 by Wyndham", "Days Inn by Wyndham", 
+        "Ibis Hotels", "ibis Styles", "Quality Inn Hotels", 
+        "Comfort Inn Hotels", "Econo Lodge Hotels", 
+        "Rodeway Inn Hotels", "Hyatt Place", "Hyatt House"
+    ]
+}
+
+# Англійські назви стилів
+STYLE_NAMES_EN = {
+    "Luxurious and refined": "Розкішний і вишуканий",
+    "Boutique and unique": "Бутік і унікальний",
+    "Classic and traditional": "Класичний і традиційний",
+    "Modern and designer": "Сучасний і дизайнерський",
+    "Cozy and family-friendly": "Затишний і сімейний",
+    "Practical and economical": "Практичний і економічний"
+}
+
+# Повний словник цілей і брендів (порядок ключів задає номери бітів у purpose_mask)
+PURPOSE_BRAND_MAPPING = {
+    "Бізнес-подорожі / відрядження": ["Marriott Hotels", "InterContinental Hotels & Resorts", "Crowne Plaza", 
+                                  "Hyatt Regency", "Grand Hyatt", "Courtyard by Marriott", "Hilton Garden Inn", 
+                                  "Sheraton", "DoubleTree by Hilton", "Novotel Hotels", "Cambria Hotels", 
+                                  "Fairfield Inn & Suites", "Holiday Inn Express", "Wingate by Wyndham", 
+                                  "Quality Inn Hotels", "ibis Hotels", "Econo Lodge Hotels", "Hyatt Place", "Rodeway Inn Hotels"],
+    
+    "Відпустка / релакс": ["The Ritz-Carlton", "JW Marriott", "Waldorf Astoria Hotels & Resorts", 
+                         "Conrad Hotels & Resorts", "Park Hyatt Hotels", "Fairmont Hotels", 
+                         "Raffles Hotels & Resorts", "InterContinental Hotels & Resorts", 
+                         "Kimpton Hotels & Restaurants", "Alila Hotels", "Registry Collection Hotels", 
+                         "Ascend Hotel Collection", "Hilton Hotels & Resorts", "Wyndham Grand", "Grand Hyatt"],
+    
+    "Сімейний відпочинок": ["JW Marriott", "Hyatt Regency", "Sheraton", "Holiday Inn Hotels & Resorts", 
+                          "DoubleTree by Hilton", "Wyndham", "Mercure Hotels", "Novotel Hotels", 
+                          "Comfort Inn Hotels", "Hampton by Hilton", "Holiday Inn Express", 
+                          "Days Inn by Wyndham", "Super 8 by Wyndham", "Hilton Hotels & Resorts", "Wyndham Grand", "Marriott Hotels", 
+                          "Courtyard by Marriott", "Crowne Plaza", "The Ritz-Carlton"],
+    
+    "Довготривале проживання": ["Hyatt House", "Candlewood Suites", "ibis Styles"]
+}
+
+# Англійські назви цілей
+PURPOSE_NAMES_EN = {
+    "Business travel": "Бізнес-подорожі / відрядження",
+    "Vacation / relaxation": "Відпустка / релакс",
+    "Family vacation": "Сімейний відпочинок",
+    "Long-term stay": "Довготривале проживання"
+}
+
+# Назви стилів і цілей у порядку питань 3/4 та 4/4
+STYLE_NAMES = {'uk': list(STYLE_BRAND_MAPPING), 'en': list(STYLE_NAMES_EN)}
+PURPOSE_NAMES = {'uk': list(PURPOSE_BRAND_MAPPING), 'en': list(PURPOSE_NAMES_EN)}
+
+# Категорії готелів та відповідні значення колонки 'segment'
+CATEGORY_MAPPING = {
+    "Luxury": ["Luxury"],
+    "Comfort": ["Comfort"],
+    "Standard": ["Standard", "Standart"],
+}
+
+CATEGORY_BITS = {category: 1 << i for i, category in enumerate(CATEGORY_MAPPING)}
+
+# Біт для кожної назви стилю/мети (українська та англійська назви мають спільний біт)
+STYLE_BITS = {style: 1 << i for i, style in enumerate(STYLE_BRAND_MAPPING)}
+STYLE_BITS.update({en: STYLE_BITS[uk] for en, uk in STYLE_NAMES_EN.items()})
+
+PURPOSE_BITS = {purpose: 1 << i for i, purpose in enumerate(PURPOSE_BRAND_MAPPING)}
+PURPOSE_BITS.update({en: PURPOSE_BITS[uk] for en, uk in PURPOSE_NAMES_EN.items()})
+
+def _selection_bits(selected, name_bits):
     """
-    Зіставляє бренд готелю зі стилями
-    
-    Args:
-        hotel_brand: бренд готелю (один рядок, не список)
-    
-    Returns:
-        Словник стилів із відповідними значеннями True/False
-    """
-    # Переконуємося, що hotel_brand є рядком
-    if not isinstance(hotel_brand, str):
-        hotel_brand = str(hotel_brand)
-    
-    hotel_brand = hotel_brand.lower()
-    
-    # Оновлений повний словник стилів і брендів
-    style_mapping = {
-        "Розкішний і вишуканий": [
-            "JW Marriott", "The Ritz-Carlton", "Conrad Hotels & Resorts", 
-            "Waldorf Astoria Hotels & Resorts", "InterContinental Hotels & Resorts", 
-            "Wyndham Grand", "Registry Collection Hotels", "Fairmont Hotels", 
-            "Raffles Hotels & Resorts", "Park Hyatt Hotels", "Alila Hotels", 
-            "Hyatt Regency", "Grand Hyatt", "Ascend Hotel Collection"
-        ],
-        
-        "Бутік і унікальний": [
-            "Kimpton Hotels & Restaurants", "Registry Collection Hotels", 
-            "Mercure Hotels", "ibis Styles", "Park Hyatt Hotels", 
-            "Alila Hotels", "Ascend Hotel Collection"
-        ],
-        
-        "Класичний і традиційний": [
-            "The Ritz-Carlton", "Marriott Hotels", "Sheraton", 
-            "Waldorf Astoria Hotels & Resorts", "Hilton Hotels & Resorts", 
-            "InterContinental Hotels & Resorts", "Holiday Inn Hotels & Resorts", 
-            "Wyndham", "Fairmont Hotels", "Raffles Hotels & Resorts", 
-            "Ascend Hotel Collection"
-        ],
-        
-        "Сучасний і дизайнерський": [
-            "Conrad Hotels & Resorts", "Kimpton Hotels & Restaurants", 
-            "Crowne Plaza", "Wyndham Grand", "Novotel Hotels", 
-            "Ibis Hotels", "ibis Styles", "Cambria Hotels", 
-            "Park Hyatt Hotels", "Grand Hyatt", "Hyatt Place"
-        ],
-        
-        "Затишний і сімейний": [
-            "Fairfield Inn & Suites", "DoubleTree by Hilton", 
-            "Hampton by Hilton", "Holiday Inn Hotels & Resorts", 
-            "Candlewood Suites", "Wyndham", "Days Inn by Wyndham", 
-            "Mercure Hotels", "Novotel Hotels", "Quality Inn Hotels", 
-            "Comfort Inn Hotels", "Hyatt House"
-        ],
-        
-        "Практичний і економічний": [
-            "Fairfield Inn & Suites", "Courtyard by Marriott", 
-            "Hampton by Hilton", "Hilton Garden Inn", 
-            "Holiday Inn Hotels & Resorts", "Holiday Inn Express", 
-            "Candlewood Suites", "Wingate by Wyndham", 
-            "Super 8 by Wyndham", "Days Inn by Wyndham", 
-            "Ibis Hotels", "ibis Styles", "Quality Inn Hotels", 
-            "Comfort Inn Hotels", "Econo Lodge Hotels", 
-            "Rodeway Inn Hotels", "Hyatt Place", "Hyatt House"
-        ]
-    }
-    
-    # Додаємо англійські ключі для стилів
-    style_mapping_en = {
-        "Luxurious and refined": style_mapping["Розкішний і вишуканий"],
-        "Boutique and unique": style_mapping["Бутік і унікальний"],
-        "Classic and traditional": style_mapping["Класичний і традиційний"],
-        "Modern and designer": style_mapping["Сучасний і дизайнерський"],
-        "Cozy and family-friendly": style_mapping["Затишний і сімейний"],
-        "Practical and economical": style_mapping["Практичний і економічний"]
-    }
-    
-    # Об'єднуємо словники
-    combined_mapping = {**style_mapping, **style_mapping_en}
-    
-    result = {}
-    for style, brands in combined_mapping.items():
-        # Більш гнучке порівняння назв брендів
-        is_match = False
-        for brand in brands:
-            brand_lower = brand.lower()
-            # Перевіряємо, чи містить бренд готелю назву бренду зі списку
-            if brand_lower in hotel_brand:
-                is_match = True
-                break
-        result[style] = is_match
+    Перетворює вибрані користувачем назви на бітову маску
     
-    return result
+    Назва вважається відповідною, якщо вона збігається з назвою стилю/мети
+    або одна з них містить іншу (та сама логіка, що й у попередній порядковій фільтрації).
+    """
+    bits = 0
+    for item in selected:
+        item_lower = item.lower()
+        for name, bit in name_bits.items():
+            name_lower = name.lower()
+            if name_lower == item_lower or item_lower in name_lower or name_lower in item_lower:
+                bits |= bit
+    return bits
 
-def map_hotel_purpose(hotel_brand):
+def get_style_bits(styles):
+    """Повертає бітову маску для вибраних стилів"""
+    return _selection_bits(styles, STYLE_BITS)
+
+def get_purpose_bits(purposes):
+    """Повертає бітову маску для вибраних цілей"""
+    return _selection_bits(purposes, PURPOSE_BITS)
+
+def _masks_by_value(values, mask_for):
     """
-    Зіставляє бренд готелю з метою подорожі
-    
-    Args:
-        hotel_brand: бренд готелю (один рядок, не список)
+    Обчислює маску один раз на унікальне значення та розносить її по рядках через коди
     
-    Returns:
-        Словник цілей із відповідними значеннями True/False
-    """
-    # Переконуємося, що hotel_brand є рядком
-    if not isinstance(hotel_brand, str):
-        hotel_brand = str(hotel_brand)
-    
-    hotel_brand = hotel_brand.lower()
-    
-    purpose_mapping = {
-        "Бізнес-подорожі / відрядження": ["Marriott Hotels", "InterContinental Hotels & Resorts", "Crowne Plaza", 
-                                      "Hyatt Regency", "Grand Hyatt", "Courtyard by Marriott", "Hilton Garden Inn", 
-                                      "Sheraton", "DoubleTree by Hilton", "Novotel Hotels", "Cambria Hotels", 
-                                      "Fairfield Inn & Suites", "Holiday Inn Express", "Wingate by Wyndham", 
-                                      "Quality Inn Hotels", "ibis Hotels", "Econo Lodge Hotels", "Hyatt Place", "Rodeway Inn Hotels"],
-        
-        "Відпустка / релакс": ["The Ritz-Carlton", "JW Marriott", "Waldorf Astoria Hotels & Resorts", 
-                             "Conrad Hotels & Resorts", "Park Hyatt Hotels", "Fairmont Hotels", 
-                             "Raffles Hotels & Resorts", "InterContinental Hotels & Resorts", 
-                             "Kimpton Hotels & Restaurants", "Alila Hotels", "Registry Collection Hotels", 
-                             "Ascend Hotel Collection", "Hilton Hotels & Resorts", "Wyndham Grand", "Grand Hyatt"],
-        
-        "Сімейний відпочинок": ["JW Marriott", "Hyatt Regency", "Sheraton", "Holiday Inn Hotels & Resorts", 
-                              "DoubleTree by Hilton", "Wyndham", "Mercure Hotels", "Novotel Hotels", 
-                              "Comfort Inn Hotels", "Hampton by Hilton", "Holiday Inn Express", 
-                              "Days Inn by Wyndham", "Super 8 by Wyndham", "Hilton Hotels & Resorts", "Wyndham Grand", "Marriott Hotels", 
-                              "Courtyard by Marriott", "Crowne Plaza", "The Ritz-Carlton"],
-        
-        "Довготривале проживання": ["Hyatt House", "Candlewood Suites", "ibis Styles"]
-    }
-    
-    # Переклад для англійської мови
-    purpose_mapping_en = {
-        "Business travel": purpose_mapping["Бізнес-подорожі / відрядження"],
-        "Vacation / relaxation": purpose_mapping["Відпустка / релакс"],
-        "Family vacation": purpose_mapping["Сімейний відпочинок"],
-        "Long-term stay": purpose_mapping["Довготривале проживання"]
-    }
-    
-    # Об'єднуємо обидва словники
-    combined_mapping = {**purpose_mapping, **purpose_mapping_en}
-    
-    result = {}
-    for purpose, brands in combined_mapping.items():
-        # Більш гнучке порівняння назв брендів
-        is_match = False
-        for brand in brands:
-            brand_lower = brand.lower()
-            # Перевіряємо, чи бренд готелю містить назву бренду зі списку
-            if brand_lower in hotel_brand:
-                is_match = True
-                break
-        result[purpose] = is_match
-    
-    return result
+    Працює однаково для текстових і категоріальних колонок; порожні значення отримують 0.
+    """
+    codes, uniques = pd.factorize(values)
+    masks = np.array([mask_for(value) for value in uniques] + [0], dtype='uint8')
+    return pd.Series(masks[codes], index=values.index, dtype='uint8')
 
-# ===============================
-# ЧАСТИНА 10: НОВА ЛОГІКА ПІДРАХУНКУ БАЛІВ ТА ГОЛОВНІ ФУНКЦІЇ
-# ===============================
+def _brand_masks(brands, mapping):
+    """Обчислює бітову маску для кожного бренду (один раз на унікальний бренд)"""
+    def brand_mask(brand):
+        # Бренд готелю відповідає назві, якщо містить хоча б один її бренд (без урахування регістру)
+        brand_lower = str(brand).lower()
+        return sum(
+            1 << i for i, brands in enumerate(mapping.values())
+            if any(name.lower() in brand_lower for name in brands)
+        )
+    return _masks_by_value(brands, brand_mask)
 
-# Функції фільтрації готелів
-def filter_hotels_by_region(df, regions=None, countries=None):
-    """Фільтрує готелі за регіоном або країною"""
-    if not regions and not countries:
-        return df
-    
-    filtered_df = df.copy()
-    
-    if regions and len(regions) > 0:
-        region_mask = filtered_df['region'].apply(lambda x: any(region.lower() in str(x).lower() for region in regions))
-        filtered_df = filtered_df[region_mask]
-    
-    if countries and len(countries) > 0:
-        country_mask = filtered_df['country'].apply(lambda x: any(country.lower() in str(x).lower() for country in countries))
-        filtered_df = filtered_df[country_mask]
-    
-    return filtered_df
+def _segment_masks(segments):
+    """Обчислює бітову маску категорій для кожного сегмента (один раз на унікальний сегмент)"""
+    def segment_mask(segment):
+        segment_lower = str(segment).lower()
+        return sum(
+            bit for category, bit in CATEGORY_BITS.items()
+            if any(cat.lower() in segment_lower for cat in CATEGORY_MAPPING[category])
+        )
+    return _masks_by_value(segments, segment_mask)
 
-def filter_hotels_by_category(df, category):
-    """Фільтрує готелі за категорією"""
-    category_mapping = {
-        "Luxury": ["Luxury"],
-        "Comfort": ["Comfort"],
-        "Standard": ["Standard", "Standart"],
-    }
-    
-    if category in category_mapping:
-        if 'segment' in df.columns:
-            mask = df['segment'].apply(lambda x: any(cat.lower() in str(x).lower() for cat in category_mapping[category]))
-            return df[mask]
+def _lowered_categorical(values):
+    """Повертає категоріальну колонку зі значеннями str(x).lower() (обчислюється один раз на унікальне значення)"""
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    lowered_codes, lowered_uniques = pd.factorize(np.array([str(value).lower() for value in uniques], dtype=object))
+    if len(codes) and len(lowered_codes):
+        codes = lowered_codes[codes]
+    return pd.Categorical.from_codes(codes, categories=lowered_uniques)
+
+def add_location_columns(df):
+    """
+    Додає до DataFrame колонки region_lower та country_lower
     
+    Це категоріальні колонки з назвами в нижньому регістрі, тому фільтр за
+    регіоном перевіряє лише унікальні значення, а не кожен рядок.
+    """
+    for column in ('region', 'country'):
+        if column in df.columns:
+            df[f'{column}_lower'] = _lowered_categorical(df[column])
     return df
 
-def filter_hotels_by_style(df, styles):
-    """Фільтрує готелі за стилем"""
-    if not styles or len(styles) == 0:
-        return df
-    
-    logger.info(f"Фільтрація за стилями: {styles}")
-    
-    style_mask = pd.Series(False, index=df.index)
-    
-    for idx, row in df.iterrows():
-        if 'Hotel Brand' in df.columns and pd.notna(row['Hotel Brand']):
-            hotel_brand = row['Hotel Brand']
-            hotel_styles = map_hotel_style(hotel_brand)
-            
-            for style in styles:
-                style_lower = style.lower()
-                for hotel_style, matches in hotel_styles.items():
-                    if matches and (hotel_style.lower() == style_lower or 
-                                    style_lower in hotel_style.lower() or
-                                    hotel_style.lower() in style_lower):
-                        style_mask.loc[idx] = True
-                        break
-    
-    filtered_df = df[style_mask]
-    logger.info(f"Готелів після фільтрації за стилем: {len(filtered_df)}")
-    
-    return filtered_df
+def _location_mask(df, column, names):
+    """Булева маска рядків, у яких значення колонки містить хоча б одну з назв"""
+    lowered = df[f'{column}_lower'] if f'{column}_lower' in df.columns else pd.Series(_lowered_categorical(df[column]))
+    names_lower = [name.lower() for name in names]
+    category_matches = np.array(
+        [any(name in category for name in names_lower) for category in lowered.cat.categories],
+        dtype=bool
+    )
+    return category_matches[lowered.cat.codes.to_numpy()]
 
-def filter_hotels_by_purpose(df, purposes):
-    """Фільтрує готелі за метою подорожі"""
-    if not purposes or len(purposes) == 0:
-        return df
-    
-    logger.info(f"Фільтрація за метою: {purposes}")
-    
-    purpose_mask = pd.Series(False, index=df.index)
+def add_mask_columns(df):
+    """
+    Додає до DataFrame колонки category_mask, style_mask та purpose_mask
     
-    for idx, row in df.iterrows():
-        if 'Hotel Brand' in df.columns and pd.notna(row['Hotel Brand']):
-            hotel_brand = row['Hotel Brand']
-            hotel_purposes = map_hotel_purpose(hotel_brand)
-            
-            for purpose in purposes:
-                purpose_lower = purpose.lower()
-                for hotel_purpose, matches in hotel_purposes.items():
-                    if matches and (hotel_purpose.lower() == purpose_lower or 
-                                    purpose_lower in hotel_purpose.lower() or
-                                    hotel_purpose.lower() in purpose_lower):
-                        purpose_mask.loc[idx] = True
-                        break
-    
-    filtered_df = df[purpose_mask]
-    logger.info(f"Готелів після фільтрації за метою: {len(filtered_df)}")
+    Кожен біт колонки відповідає одній категорії (CATEGORY_MAPPING), стилю
+    (STYLE_BRAND_MAPPING) або меті (PURPOSE_BRAND_MAPPING), тому фільтрація
+    зводиться до однієї побітової операції.
+    """
+    if 'segment' in df.columns:
+        df['category_mask'] = _segment_masks(df['segment'])
+    else:
+        # Без колонки 'segment' фільтр за категорією не застосовується
+        df['category_mask'] = pd.Series(sum(CATEGORY_BITS.values()), index=df.index, dtype='uint8')
     
-    return filtered_df
+    if 'Hotel Brand' in df.columns:
+        df['style_mask'] = _brand_masks(df['Hotel Brand'], STYLE_BRAND_MAPPING)
+        df['purpose_mask'] = _brand_masks(df['Hotel Brand'], PURPOSE_BRAND_MAPPING)
+    else:
+        df['style_mask'] = pd.Series(0, index=df.index, dtype='uint8')
+        df['purpose_mask'] = pd.Series(0, index=df.index, dtype='uint8')
+    return df
+
+# ===============================
+# ЧАСТИНА 12: НОВА ЛОГІКА ПІДРАХУНКУ БАЛІВ ТА ГОЛОВНІ ФУНКЦІЇ
+# ===============================
 
 def get_adjacent_categories(category):
     """Повертає суміжні категорії"""
@@ -1179,6 +2518,46 @@ def get_adjacent_categories(category):
     }
     return adjacent_mapping.get(category, [])
 
+def distribute_scores_array(counts, score_values):
+    """
+    Векторизований розподіл балів з урахуванням однакових значень
+    
+    Місце програми - кількість програм із більшою кількістю готелів, тож однакові
+    кількості ділять місце, а наступні місця пропускаються (1, 2, 2, 4).
+    Програми без готелів та місця поза score_values отримують 0 балів.
+    
+    Args:
+        counts: масив кількостей готелів форми (запити × програми) або (програми,)
+        score_values: список балів [21, 18, 15, 12, 9, 6, 3] або [7, 6, 5, 4, 3, 2, 1]
+    
+    Returns:
+        масив балів float64 тієї ж форми
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    single_row = counts.ndim == 1
+    counts = np.atleast_2d(counts)
+    scores = np.zeros(counts.shape)
+    
+    if counts.size > 0 and len(score_values) > 0:
+        # Сортуємо кожен рядок за спаданням; NaN опиняються в кінці й балів не отримують
+        order = np.argsort(-counts, axis=1, kind='stable')
+        sorted_counts = np.take_along_axis(counts, order, axis=1)
+        
+        # Місце = позиція першої програми з такою ж кількістю у відсортованому рядку
+        positions = np.arange(counts.shape[1])
+        group_starts = np.ones(counts.shape, dtype=bool)
+        group_starts[:, 1:] = sorted_counts[:, 1:] != sorted_counts[:, :-1]
+        sorted_ranks = np.maximum.accumulate(np.where(group_starts, positions, 0), axis=1)
+        
+        ranks = np.empty_like(sorted_ranks)
+        np.put_along_axis(ranks, order, sorted_ranks, axis=1)
+        
+        values = np.asarray(score_values, dtype=np.float64)
+        awarded = (counts > 0) & (ranks < len(values))
+        scores[awarded] = values[ranks[awarded]]
+    
+    return scores[0] if single_row else scores
+
 def distribute_scores_with_ties(counts_dict, score_values):
     """
     Універсальна функція для розподілу балів з урахуванням однакових значень
@@ -1190,67 +2569,191 @@ def distribute_scores_with_ties(counts_dict, score_values):
     Returns:
         словник {програма: бали}
     """
-    if not counts_dict or not score_values:
-        return {program: 0.0 for program in counts_dict.keys()}
-    
-    # Фільтруємо програми з кількістю > 0
-    filtered_counts = {prog: count for prog, count in counts_dict.items() if count > 0}
+    programs = list(counts_dict.keys())
+    scores = distribute_scores_array([counts_dict[program] for program in programs], score_values)
+    return {program: float(score) for program, score in zip(programs, scores)}
+
+# Колонки з кількістю готелів програми в регіоні/країні (значення з першого рядка програми)
+REGION_TOTAL_COLUMN = 'Total hotels of Corporation / Loyalty Program in this region'
+COUNTRY_TOTAL_COLUMN = 'Total hotels of Corporation / Loyalty Program in this country'
+
+# Таблиці кількостей останніх наборів даних: {id(DataFrame): (DataFrame, таблиця)}.
+# Зберігаються поточні й попередні дані - для розрахунків, що завершуються після перезавантаження.
+count_tables = OrderedDict()
+count_tables_lock = threading.Lock()
+COUNT_TABLES_KEPT = 2
+
+def build_count_table(df):
+    """
+    Будує таблицю кількостей готелів для набору даних (один раз при завантаженні)
     
-    if not filtered_counts:
-        return {program: 0.0 for program in counts_dict.keys()}
+    Кожен рядок DataFrame отримує код програми, номер клітинки куба
+    (програма × категорія × стиль × мета) і кількість готелів, тож запит
+    зводиться до вибору рядків за регіоном і одного np.bincount по клітинках.
+    Рядки без програми лояльності мають код програми та клітинки -1 і в куб не потрапляють.
     
-    # Групуємо програми за кількістю готелів
-    count_groups = {}
-    for program, count in filtered_counts.items():
-        if count not in count_groups:
-            count_groups[count] = []
-        count_groups[count].append(program)
+    Returns:
+        словник: programs, program_codes, cells, hotels, cell_program_codes,
+        cell_category_mask, cell_style_mask, cell_purpose_mask,
+        region_totals та country_totals (None, якщо колонки немає)
+    """
+    if not {'category_mask', 'style_mask', 'purpose_mask'}.issubset(df.columns):
+        df = add_mask_columns(df.copy())
+    
+    # Порядок програм - як у groupby (відсортовані)
+    program_codes, programs = pd.factorize(df['loyalty_program'], sort=True)
+    valid = program_codes >= 0
+    
+    # Клітинка куба: програма та три маски, упаковані в одне число
+    cell_keys = (
+        (program_codes.astype(np.int64) << 24)
+        | (df['category_mask'].to_numpy().astype(np.int64) << 16)
+        | (df['style_mask'].to_numpy().astype(np.int64) << 8)
+        | df['purpose_mask'].to_numpy().astype(np.int64)
+    )
+    unique_cells, valid_cells = np.unique(cell_keys[valid], return_inverse=True)
+    cells = np.full(len(df), -1, dtype=np.int64)
+    cells[valid] = valid_cells
+    
+    return {
+        'programs': list(programs),
+        'program_codes': program_codes,
+        'cells': cells,
+        'hotels': hotel_counts(df).astype(np.int64),
+        'cell_program_codes': unique_cells >> 24,
+        'cell_category_mask': ((unique_cells >> 16) & 0xFF).astype(np.uint8),
+        'cell_style_mask': ((unique_cells >> 8) & 0xFF).astype(np.uint8),
+        'cell_purpose_mask': (unique_cells & 0xFF).astype(np.uint8),
+        'region_totals': df[REGION_TOTAL_COLUMN].to_numpy() if REGION_TOTAL_COLUMN in df.columns else None,
+        'country_totals': df[COUNTRY_TOTAL_COLUMN].to_numpy() if COUNTRY_TOTAL_COLUMN in df.columns else None
+    }
+
+def get_count_table(df):
+    """Таблиця кількостей для DataFrame (будується один раз на набір даних)"""
+    with count_tables_lock:
+        entry = count_tables.get(id(df))
+        if entry is not None and entry[0] is df:
+            count_tables.move_to_end(id(df))
+            return entry[1]
+    
+    table = build_count_table(df)
+    with count_tables_lock:
+        count_tables[id(df)] = (df, table)
+        count_tables.move_to_end(id(df))
+        while len(count_tables) > COUNT_TABLES_KEPT:
+            count_tables.popitem(last=False)
+    return table
+
+def select_count_table_rows(df, regions=None, countries=None):
+    """Булева маска рядків таблиці кількостей для готелів у вибраних регіонах/країнах"""
+    selected = np.ones(len(df), dtype=bool)
+    if regions:
+        selected &= _location_mask(df, 'region', regions)
+    if countries:
+        selected &= _location_mask(df, 'country', countries)
+    return selected
+
+def first_program_rows(table, selected):
+    """
+    Номер першого вибраного рядка кожної програми (у порядку рядків) - {програма: рядок}
     
-    # Сортуємо групи за кількістю готелів (по спаданню)
-    sorted_counts = sorted(count_groups.keys(), reverse=True)
+    Як і drop_duplicates('loyalty_program'), рядки без програми дають ключ NaN.
+    """
+    rows = np.flatnonzero(selected)
+    # Позиція 0 - рядки без програми (код -1)
+    first = np.full(len(table['programs']) + 1, len(table['program_codes']))
+    np.minimum.at(first, table['program_codes'][rows] + 1, rows)
+    present = np.flatnonzero(first < len(table['program_codes']))
+    present = present[np.argsort(first[present])]
+    return {table['programs'][slot - 1] if slot > 0 else np.nan: first[slot] for slot in present}
+
+def cube_from_count_table(table, selected):
+    """
+    Куб кількостей готелів програма × категорія × стиль × мета для вибраних рядків
     
-    # Розподіляємо бали
-    result_scores = {program: 0.0 for program in counts_dict.keys()}
-    current_position = 0
+    Returns:
+        словник з масивами NumPy: programs, program_codes, category_mask,
+        style_mask, purpose_mask, hotels (лише непорожні клітинки)
+    """
+    selected = selected & (table['cells'] >= 0)
+    hotels = np.bincount(
+        table['cells'][selected],
+        weights=table['hotels'][selected],
+        minlength=len(table['cell_program_codes'])
+    ).astype(np.int64)
+    present = np.flatnonzero(hotels)
+    
+    # Лише програми з готелями у вибраних регіонах, перенумеровані по порядку
+    cell_programs = table['cell_program_codes'][present]
+    present_programs = np.flatnonzero(np.bincount(cell_programs, minlength=len(table['programs'])))
+    program_index = np.zeros(len(table['programs']), dtype=np.int64)
+    program_index[present_programs] = np.arange(len(present_programs))
+    
+    return {
+        'programs': [table['programs'][code] for code in present_programs],
+        'program_codes': program_index[cell_programs],
+        'category_mask': table['cell_category_mask'][present],
+        'style_mask': table['cell_style_mask'][present],
+        'purpose_mask': table['cell_purpose_mask'][present],
+        'hotels': hotels[present]
+    }
+
+def region_score_cube(df, regions=None, countries=None):
+    """Куб кількостей для готелів у вибраних регіонах/країнах (з таблиці кількостей)"""
+    return cube_from_count_table(get_count_table(df), select_count_table_rows(df, regions, countries))
+
+def count_hotels_in_cube(cube, category=None, style_bits=None, purpose_bits=None):
+    """
+    Підраховує кількість готелів кожної програми з куба
     
-    for count in sorted_counts:
-        programs_in_group = count_groups[count]
-        group_size = len(programs_in_group)
-        
-        # Перевіряємо, чи ще є доступні бали
-        if current_position >= len(score_values):
-            # Всі наступні програми отримують 0 балів
-            break
-        
-        # Беремо бал для поточної позиції
-        score_for_group = score_values[current_position]
-        
-        # Всі програми в групі отримують однакові бали
-        for program in programs_in_group:
-            result_scores[program] = float(score_for_group)
-        
-        # Переходимо до наступної позиції, пропускаючи зайняті місця
-        current_position += group_size
+    Args:
+        cube: куб з cube_from_count_table
+        category: категорія (None - без фільтра за категорією)
+        style_bits: бітова маска стилів (None - без фільтра за стилем)
+        purpose_bits: бітова маска цілей (None - без фільтра за метою)
     
-    return result_scores
+    Returns:
+        словник {програма: кількість готелів}
+    """
+    selected = np.ones(len(cube['hotels']), dtype=bool)
+    
+    if category in CATEGORY_BITS:
+        selected &= (cube['category_mask'] & CATEGORY_BITS[category]) != 0
+    if style_bits is not None:
+        selected &= (cube['style_mask'] & style_bits) != 0
+    if purpose_bits is not None:
+        selected &= (cube['purpose_mask'] & purpose_bits) != 0
+    
+    totals = np.bincount(
+        cube['program_codes'][selected],
+        weights=cube['hotels'][selected],
+        minlength=len(cube['programs'])
+    )
+    return {program: int(total) for program, total in zip(cube['programs'], totals)}
 
-def get_region_score(df, regions=None, countries=None):
-    """Обчислює бали для програм лояльності за регіонами/країнами з правильним розподілом при ties"""
+def get_region_score(table, selected, regions=None, countries=None):
+    """
+    Обчислює бали для програм лояльності за регіонами/країнами з правильним розподілом при ties
+    
+    Args:
+        table: таблиця кількостей (get_count_table)
+        selected: маска рядків таблиці у вибраних регіонах/країнах
+    """
     try:
         if regions and len(regions) > 0:
-            if 'Total hotels of Corporation / Loyalty Program in this region' in df.columns:
-                region_data = df.drop_duplicates('loyalty_program')[['loyalty_program', 'Total hotels of Corporation / Loyalty Program in this region']]
-                region_counts = region_data.set_index('loyalty_program')['Total hotels of Corporation / Loyalty Program in this region'].to_dict()
+            if table['region_totals'] is not None:
+                region_counts = {program: table['region_totals'][row]
+                                 for program, row in first_program_rows(table, selected).items()}
             else:
-                region_counts = df.groupby('loyalty_program').size().to_dict()
+                region_counts = count_hotels_in_cube(cube_from_count_table(table, selected))
                 logger.warning("Колонка 'Total hotels of Corporation / Loyalty Program in this region' відсутня. Використовуємо кількість рядків.")
         
         elif countries and len(countries) > 0:
-            if 'Total hotels of Corporation / Loyalty Program in this country' in df.columns:
-                country_data = df.drop_duplicates('loyalty_program')[['loyalty_program', 'Total hotels of Corporation / Loyalty Program in this country']]
-                region_counts = country_data.set_index('loyalty_program')['Total hotels of Corporation / Loyalty Program in this country'].to_dict()
+            if table['country_totals'] is not None:
+                region_counts = {program: table['country_totals'][row]
+                                 for program, row in first_program_rows(table, selected).items()}
             else:
-                region_counts = df.groupby('loyalty_program').size().to_dict()
+                region_counts = count_hotels_in_cube(cube_from_count_table(table, selected))
                 logger.warning("Колонка 'Total hotels of Corporation / Loyalty Program in this country' відсутня. Використовуємо кількість рядків.")
         
         else:
@@ -1279,128 +2782,100 @@ def get_region_score(df, regions=None, countries=None):
     
     return region_scores
 
-def get_detailed_category_scores(filtered_by_region, program, category):
-    """Розраховує детальні бали для категорій з правильним розподілом при ties"""
-    scores = {'main': {'hotels': 0, 'points': 0.0}, 'adjacent': {}}
-    
-    if not category:
-        return scores
-    
-    # Основна категорія
-    main_filtered = filter_hotels_by_category(filtered_by_region, category)
-    main_program_hotels = len(main_filtered[main_filtered['loyalty_program'] == program])
-    scores['main']['hotels'] = main_program_hotels
-    
-    # Розраховуємо бали для основної категорії з правильним розподілом при ties
-    if main_program_hotels > 0:
-        main_counts = main_filtered.groupby('loyalty_program').size().to_dict()
-        main_score_values = [21, 18, 15, 12, 9, 6, 3]
-        main_scores = distribute_scores_with_ties(main_counts, main_score_values)
-        scores['main']['points'] = main_scores.get(program, 0.0)
-    
-    # Суміжні категорії
-    adjacent_categories = get_adjacent_categories(category)
-    for adj_cat in adjacent_categories:
-        adj_filtered = filter_hotels_by_category(filtered_by_region, adj_cat)
-        adj_program_hotels = len(adj_filtered[adj_filtered['loyalty_program'] == program])
-        
-        adj_score = 0.0
-        if adj_program_hotels > 0:
-            adj_counts = adj_filtered.groupby('loyalty_program').size().to_dict()
-            adj_score_values = [7, 6, 5, 4, 3, 2, 1]
-            adj_scores = distribute_scores_with_ties(adj_counts, adj_score_values)
-            adj_score = adj_scores.get(program, 0.0)
-        
-        scores['adjacent'][adj_cat] = {'hotels': adj_program_hotels, 'points': adj_score}
+def get_region_hotels(table, selected, cube, regions=None):
+    """
+    Кількість готелів кожної програми у вибраних регіонах: значення з першого рядка програми
     
-    return scores
-
-def calculate_style_scores_new_logic(filtered_by_region, loyalty_programs, category, styles):
+    Без колонки загальної кількості - сума готелів з куба; без вибраних регіонів - порожній словник.
     """
-    НОВА ЛОГІКА розрахунку балів за стилем з правильним розподілом при ties
+    if not regions:
+        return {}
+    if table['region_totals'] is not None:
+        return {program: table['region_totals'][row]
+                for program, row in first_program_rows(table, selected).items()
+                if pd.notna(program)}
+    return count_hotels_in_cube(cube)
+
+def _calculate_selection_scores(cube, loyalty_programs, category, selection_filter, count_selected, label):
     """
-    if not styles or len(styles) == 0:
-        return {program: 0.0 for program in loyalty_programs}, {program: 0 for program in loyalty_programs}
-    
-    logger.info(f"=== STYLE CALCULATION (NEW LOGIC WITH TIES) ===")
-    logger.info(f"Category: {category}, Styles: {styles}")
+    Спільна логіка розрахунку балів за стилем або метою з правильним розподілом при ties
     
+    Args:
+        cube: куб з cube_from_count_table
+        loyalty_programs: список усіх програм лояльності
+        category: основна категорія
+        selection_filter: {'style_bits': ...} або {'purpose_bits': ...}
+        count_selected: кількість вибраних стилів/цілей (для нормалізації)
+        label: 'style' або 'purpose' (для логування)
+    """
     # Отримуємо суміжні категорії
     adjacent_categories = get_adjacent_categories(category) if category else []
     logger.info(f"Adjacent categories: {adjacent_categories}")
     
-    # Розраховуємо готелі за стилем для MAIN категорії
-    main_style_counts = {}
-    main_style_scores = {}
-    
+    # Розраховуємо готелі для MAIN категорії
     if category:
-        main_category_hotels = filter_hotels_by_category(filtered_by_region, category)
-        main_style_filtered = filter_hotels_by_style(main_category_hotels, styles)
-        
-        for program in loyalty_programs:
-            count = len(main_style_filtered[main_style_filtered['loyalty_program'] == program])
-            main_style_counts[program] = count
+        cube_counts = count_hotels_in_cube(cube, category, **selection_filter)
+        main_counts = {program: cube_counts.get(program, 0) for program in loyalty_programs}
         
-        logger.info(f"Main category ({category}) style counts: {main_style_counts}")
+        logger.info(f"Main category ({category}) {label} counts: {main_counts}")
         
-        # Використовуємо нову функцію розподілу балів
         main_score_values = [21, 18, 15, 12, 9, 6, 3]
-        main_style_scores = distribute_scores_with_ties(main_style_counts, main_score_values)
+        main_scores = distribute_scores_with_ties(main_counts, main_score_values)
     else:
-        main_style_counts = {program: 0 for program in loyalty_programs}
-        main_style_scores = {program: 0.0 for program in loyalty_programs}
+        main_counts = {program: 0 for program in loyalty_programs}
+        main_scores = {program: 0.0 for program in loyalty_programs}
     
-    logger.info(f"Main style scores: {main_style_scores}")
+    logger.info(f"Main {label} scores: {main_scores}")
     
-    # Розраховуємо готелі за стилем для ADJACENT категорій
-    adjacent_style_scores = {program: 0.0 for program in loyalty_programs}
+    # Розраховуємо готелі для ADJACENT категорій: рядок на категорію, ранжуємо всі разом
+    adjacent_counts = []
     
-    if adjacent_categories:
-        for adj_cat in adjacent_categories:
-            logger.info(f"Processing adjacent category: {adj_cat}")
-            
-            adj_category_hotels = filter_hotels_by_category(filtered_by_region, adj_cat)
-            adj_style_filtered = filter_hotels_by_style(adj_category_hotels, styles)
-            
-            adj_style_counts = {}
-            for program in loyalty_programs:
-                count = len(adj_style_filtered[adj_style_filtered['loyalty_program'] == program])
-                adj_style_counts[program] = count
-            
-            logger.info(f"Adjacent category ({adj_cat}) style counts: {adj_style_counts}")
-            
-            # Використовуємо нову функцію розподілу балів
-            adj_score_values = [7, 6, 5, 4, 3, 2, 1]
-            adj_category_scores = distribute_scores_with_ties(adj_style_counts, adj_score_values)
-            
-            logger.info(f"Adjacent category ({adj_cat}) scores: {adj_category_scores}")
-            
-            # Для кожної програми беремо МАКСИМУМ з усіх adjacent категорій
-            for program in loyalty_programs:
-                current_score = adj_category_scores.get(program, 0.0)
-                adjacent_style_scores[program] = max(adjacent_style_scores[program], current_score)
+    for adj_cat in adjacent_categories:
+        cube_counts = count_hotels_in_cube(cube, adj_cat, **selection_filter)
+        adj_counts = [cube_counts.get(program, 0) for program in loyalty_programs]
+        adjacent_counts.append(adj_counts)
+        
+        logger.info(f"Adjacent category ({adj_cat}) {label} counts: {dict(zip(loyalty_programs, adj_counts))}")
+    
+    adjacent_scores = {program: 0.0 for program in loyalty_programs}
+    if adjacent_counts:
+        adj_score_values = [7, 6, 5, 4, 3, 2, 1]
+        adj_category_scores = distribute_scores_array(adjacent_counts, adj_score_values)
+        
+        # Для кожної програми беремо МАКСИМУМ з усіх adjacent категорій
+        adjacent_scores = dict(zip(loyalty_programs, adj_category_scores.max(axis=0).tolist()))
     
-    logger.info(f"Final adjacent style scores: {adjacent_style_scores}")
+    logger.info(f"Final adjacent {label} scores: {adjacent_scores}")
     
     # Об'єднуємо бали (main + adjacent)
-    final_style_scores = {}
+    final_scores = {}
     for program in loyalty_programs:
-        main_score = main_style_scores.get(program, 0.0)
-        adj_score = adjacent_style_scores.get(program, 0.0)
-        final_style_scores[program] = main_score + adj_score
+        final_scores[program] = main_scores.get(program, 0.0) + adjacent_scores.get(program, 0.0)
     
-    # Нормалізуємо, якщо обрано кілька стилів
-    if len(styles) > 1:
-        normalization_factor = len(styles)
-        final_style_scores = {program: score / normalization_factor 
-                             for program, score in final_style_scores.items()}
-        logger.info(f"Applied normalization factor: {normalization_factor}")
+    # Нормалізуємо, якщо обрано кілька варіантів
+    if count_selected > 1:
+        final_scores = {program: score / count_selected for program, score in final_scores.items()}
+        logger.info(f"Applied normalization factor: {count_selected}")
     
-    logger.info(f"Final style scores after normalization: {final_style_scores}")
+    logger.info(f"Final {label} scores after normalization: {final_scores}")
     
-    return final_style_scores, main_style_counts
+    return final_scores, main_counts
 
-def calculate_purpose_scores_new_logic(filtered_by_region, loyalty_programs, category, purposes):
+def calculate_style_scores_new_logic(cube, loyalty_programs, category, styles):
+    """
+    НОВА ЛОГІКА розрахунку балів за стилем з правильним розподілом при ties
+    """
+    if not styles or len(styles) == 0:
+        return {program: 0.0 for program in loyalty_programs}, {program: 0 for program in loyalty_programs}
+    
+    logger.info(f"=== STYLE CALCULATION (NEW LOGIC WITH TIES) ===")
+    logger.info(f"Category: {category}, Styles: {styles}")
+    
+    return _calculate_selection_scores(
+        cube, loyalty_programs, category, {'style_bits': get_style_bits(styles)}, len(styles), 'style'
+    )
+
+def calculate_purpose_scores_new_logic(cube, loyalty_programs, category, purposes):
     """
     НОВА ЛОГІКА розрахунку балів за метою з правильним розподілом при ties
     """
@@ -1410,84 +2885,55 @@ def calculate_purpose_scores_new_logic(filtered_by_region, loyalty_programs, cat
     logger.info(f"=== PURPOSE CALCULATION (NEW LOGIC WITH TIES) ===")
     logger.info(f"Category: {category}, Purposes: {purposes}")
     
-    # Отримуємо суміжні категорії
-    adjacent_categories = get_adjacent_categories(category) if category else []
-    logger.info(f"Adjacent categories: {adjacent_categories}")
-    
-    # Розраховуємо готелі за метою для MAIN категорії
-    main_purpose_counts = {}
-    main_purpose_scores = {}
-    
-    if category:
-        main_category_hotels = filter_hotels_by_category(filtered_by_region, category)
-        main_purpose_filtered = filter_hotels_by_purpose(main_category_hotels, purposes)
-        
-        for program in loyalty_programs:
-            count = len(main_purpose_filtered[main_purpose_filtered['loyalty_program'] == program])
-            main_purpose_counts[program] = count
-        
-        logger.info(f"Main category ({category}) purpose counts: {main_purpose_counts}")
-        
-        # Використовуємо нову функцію розподілу балів
-        main_score_values = [21, 18, 15, 12, 9, 6, 3]
-        main_purpose_scores = distribute_scores_with_ties(main_purpose_counts, main_score_values)
-    else:
-        main_purpose_counts = {program: 0 for program in loyalty_programs}
-        main_purpose_scores = {program: 0.0 for program in loyalty_programs}
-    
-    logger.info(f"Main purpose scores: {main_purpose_scores}")
-    
-    # Розраховуємо готелі за метою для ADJACENT категорій
-    adjacent_purpose_scores = {program: 0.0 for program in loyalty_programs}
-    
-    if adjacent_categories:
-        for adj_cat in adjacent_categories:
-            logger.info(f"Processing adjacent category: {adj_cat}")
-            
-            adj_category_hotels = filter_hotels_by_category(filtered_by_region, adj_cat)
-            adj_purpose_filtered = filter_hotels_by_purpose(adj_category_hotels, purposes)
-            
-            adj_purpose_counts = {}
-            for program in loyalty_programs:
-                count = len(adj_purpose_filtered[adj_purpose_filtered['loyalty_program'] == program])
-                adj_purpose_counts[program] = count
-            
-            logger.info(f"Adjacent category ({adj_cat}) purpose counts: {adj_purpose_counts}")
-            
-            # Використовуємо нову функцію розподілу балів
-            adj_score_values = [7, 6, 5, 4, 3, 2, 1]
-            adj_category_scores = distribute_scores_with_ties(adj_purpose_counts, adj_score_values)
-            
-            logger.info(f"Adjacent category ({adj_cat}) scores: {adj_category_scores}")
-            
-            # Для кожної програми беремо МАКСИМУМ з усіх adjacent категорій
-            for program in loyalty_programs:
-                current_score = adj_category_scores.get(program, 0.0)
-                adjacent_purpose_scores[program] = max(adjacent_purpose_scores[program], current_score)
-    
-    logger.info(f"Final adjacent purpose scores: {adjacent_purpose_scores}")
+    return _calculate_selection_scores(
+        cube, loyalty_programs, category, {'purpose_bits': get_purpose_bits(purposes)}, len(purposes), 'purpose'
+    )
+
+def _hotel_count_column(values):
+    """
+    Кількості готелів для колонки scores_df
     
-    # Об'єднуємо бали (main + adjacent)
-    final_purpose_scores = {}
-    for program in loyalty_programs:
-        main_score = main_purpose_scores.get(program, 0.0)
-        adj_score = adjacent_purpose_scores.get(program, 0.0)
-        final_purpose_scores[program] = main_score + adj_score
+    Цілі значення дають int64; NaN або дробові - float64, як і запис у колонку з нулями.
+    """
+    column = np.array(values, dtype=np.float64)
+    if np.all(column == np.round(column)):
+        return column.astype(np.int64)
+    return column
+
+def top_k_order(scores, k=None):
+    """
+    Індекси k найкращих балів за спаданням; однакові бали - у порядку програм
     
-    # Нормалізуємо, якщо обрано кілька цілей
-    if len(purposes) > 1:
-        normalization_factor = len(purposes)
-        final_purpose_scores = {program: score / normalization_factor 
-                               for program, score in final_purpose_scores.items()}
-        logger.info(f"Applied normalization factor: {normalization_factor}")
+    Ключ ранжування - float32. Для k менших за кількість програм лише кандидати,
+    відібрані np.argpartition, сортуються повністю.
     
-    logger.info(f"Final purpose scores after normalization: {final_purpose_scores}")
+    Args:
+        scores: одновимірний масив балів
+        k: кількість найкращих (None - усі)
     
-    return final_purpose_scores, main_purpose_counts
+    Returns:
+        масив індексів int64 довжиною min(k, len(scores))
+    """
+    keys = -np.asarray(scores, dtype=np.float32)
+    if k is None or k >= len(keys):
+        return np.argsort(keys, kind='stable')
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    
+    # Поріг - k-й найкращий бал; з рівних порогу беремо перші за порядком
+    threshold = keys[np.argpartition(keys, k - 1)[k - 1]]
+    better = np.flatnonzero(keys < threshold)
+    ties = np.flatnonzero(keys == threshold)[:k - len(better)]
+    candidates = np.concatenate([better, ties])
+    return candidates[np.lexsort((candidates, keys[candidates]))]
 
-def calculate_scores(user_data, hotel_data):
+def calculate_scores(user_data, hotel_data, return_cube=False, top_k=None):
     """
     ОНОВЛЕНА функція розрахунку балів з правильним розподілом при ties
+    
+    З top_k повертає компактний результат замість DataFrame: словник колонок
+    scores_df (масиви) лише для top_k найкращих програм за спаданням total_score.
+    З return_cube=True повертає (scores_df, cube) - куб вибраних регіонів для детального звіту.
     """
     logger.info(f"=== STARTING SCORE CALCULATION WITH TIES HANDLING ===")
     logger.info(f"User data: {user_data}")
@@ -1499,52 +2945,52 @@ def calculate_scores(user_data, hotel_data):
     styles = user_data.get('styles', []) or []
     purposes = user_data.get('purposes', []) or []
     
-    # Ініціалізуємо DataFrame для зберігання результатів
+    # Ініціалізуємо колонки результатів (масиви NumPy по програмах)
     loyalty_programs = hotel_data['loyalty_program'].unique()
-    scores_df = pd.DataFrame({
+    programs = list(loyalty_programs)
+    zeros = np.zeros(len(programs))
+    scores = {
         'loyalty_program': loyalty_programs,
-        'region_score': 0.0,
-        'category_score': 0.0,
-        'style_score': 0.0,
-        'purpose_score': 0.0,
-        'total_score': 0.0,
-        'region_hotels': 0,
-        'category_hotels': 0,
-        'style_hotels': 0,
-        'purpose_hotels': 0
-    })
+        'region_score': zeros,
+        'category_score': zeros,
+        'style_score': zeros,
+        'purpose_score': zeros,
+        'total_score': zeros,
+        'region_hotels': zeros.astype(np.int64),
+        'category_hotels': zeros.astype(np.int64),
+        'style_hotels': zeros.astype(np.int64),
+        'purpose_hotels': zeros.astype(np.int64)
+    }
+    
+    stage_timer = StageTimer()
     
-    # Крок 1: Фільтруємо готелі за регіоном
-    filtered_by_region = filter_hotels_by_region(hotel_data, regions, countries)
-    logger.info(f"Hotels after region filter: {len(filtered_by_region)}")
+    # Крок 1: Рядки таблиці кількостей (будується при завантаженні) у вибраних регіонах
+    table = get_count_table(hotel_data)
+    selected = select_count_table_rows(hotel_data, regions, countries)
+    logger.info(f"Hotels after region filter: {int(table['hotels'][selected].sum())}")
+    stage_timer.lap('region_filter')
+    
+    # Куб кількостей для кроків категорії, стилю та мети - одна np.bincount
+    cube = cube_from_count_table(table, selected)
+    stage_timer.lap('cube')
     
     # Розподіляємо бали за регіонами/країнами
-    region_scores = get_region_score(filtered_by_region, regions, countries)
+    region_scores = get_region_score(table, selected, regions, countries)
     logger.info(f"Region scores: {region_scores}")
     
-    for index, row in scores_df.iterrows():
-        program = row['loyalty_program']
-        if program in region_scores:
-            scores_df.at[index, 'region_score'] = region_scores[program]
-        
-        # Також заповнюємо region_hotels
-        if regions and len(regions) > 0:
-            if 'Total hotels of Corporation / Loyalty Program in this region' in filtered_by_region.columns:
-                program_data = filtered_by_region[filtered_by_region['loyalty_program'] == program]
-                if not program_data.empty:
-                    region_hotels = program_data['Total hotels of Corporation / Loyalty Program in this region'].iloc[0]
-                    scores_df.at[index, 'region_hotels'] = region_hotels
-            else:
-                region_counts = filtered_by_region.groupby('loyalty_program').size()
-                if program in region_counts:
-                    scores_df.at[index, 'region_hotels'] = region_counts[program]
+    # Кількість готелів у регіоні: значення з першого рядка кожної програми
+    region_hotels_by_program = get_region_hotels(table, selected, cube, regions)
+    
+    scores['region_score'] = np.array([region_scores.get(program, 0.0) for program in programs], dtype=np.float64)
+    scores['region_hotels'] = _hotel_count_column([region_hotels_by_program.get(program, 0) for program in programs])
+    
+    stage_timer.lap('region_score')
     
     # Крок 2: Розраховуємо бали за категорією з правильним розподілом при ties
     if category:
-        filtered_by_category = filter_hotels_by_category(filtered_by_region, category)
-        category_counts = filtered_by_category.groupby('loyalty_program').size().to_dict()
+        category_counts = count_hotels_in_cube(cube, category)
         
-        if category_counts:
+        if any(count > 0 for count in category_counts.values()):
             # ВИКОРИСТОВУЄМО функцію distribute_scores_with_ties замість старої логіки
             category_score_values = [21, 18, 15, 12, 9, 6, 3]
             category_scores = distribute_scores_with_ties(category_counts, category_score_values)
@@ -1554,178 +3000,373 @@ def calculate_scores(user_data, hotel_data):
             adjacent_scores = {}
             
             for adj_cat in adjacent_categories:
-                adjacent_filtered = filter_hotels_by_category(filtered_by_region, adj_cat)
-                adjacent_counts = adjacent_filtered.groupby('loyalty_program').size().to_dict()
-                
-                if adjacent_counts:
-                    adjacent_score_values = [7, 6, 5, 4, 3, 2, 1]
-                    adj_scores = distribute_scores_with_ties(adjacent_counts, adjacent_score_values)
-                    
-                    for program, score in adj_scores.items():
-                        adjacent_scores[program] = max(adjacent_scores.get(program, 0.0), score)
-            
-            # Оновлюємо DataFrame з балами
-            for index, row in scores_df.iterrows():
-                program = row['loyalty_program']
+                adjacent_counts = count_hotels_in_cube(cube, adj_cat)
                 
-                main_score = category_scores.get(program, 0.0)
-                adj_score = adjacent_scores.get(program, 0.0)
-                scores_df.at[index, 'category_score'] = main_score + adj_score
+                adjacent_score_values = [7, 6, 5, 4, 3, 2, 1]
+                adj_scores = distribute_scores_with_ties(adjacent_counts, adjacent_score_values)
                 
-                # Записуємо кількість готелів у категорії
-                scores_df.at[index, 'category_hotels'] = category_counts.get(program, 0)
+                for program, score in adj_scores.items():
+                    adjacent_scores[program] = max(adjacent_scores.get(program, 0.0), score)
+            
+            # Оновлюємо колонки балів та кількості готелів у категорії
+            scores['category_score'] = np.array([category_scores.get(program, 0.0) + adjacent_scores.get(program, 0.0)
+                                                 for program in programs], dtype=np.float64)
+            scores['category_hotels'] = _hotel_count_column([category_counts.get(program, 0) for program in programs])
+    
+    stage_timer.lap('category_score')
     
     # Крок 3: НОВА ЛОГІКА - Розраховуємо бали за стилем
     if styles and len(styles) > 0:
         style_scores, style_counts = calculate_style_scores_new_logic(
-            filtered_by_region, loyalty_programs, category, styles
+            cube, loyalty_programs, category, styles
         )
         
-        for index, row in scores_df.iterrows():
-            program = row['loyalty_program']
-            scores_df.at[index, 'style_score'] = style_scores.get(program, 0.0)
-            scores_df.at[index, 'style_hotels'] = style_counts.get(program, 0)
+        scores['style_score'] = np.array([style_scores.get(program, 0.0) for program in programs], dtype=np.float64)
+        scores['style_hotels'] = _hotel_count_column([style_counts.get(program, 0) for program in programs])
+    
+    stage_timer.lap('style_score')
     
     # Крок 4: НОВА ЛОГІКА - Розраховуємо бали за метою
     if purposes and len(purposes) > 0:
         purpose_scores, purpose_counts = calculate_purpose_scores_new_logic(
-            filtered_by_region, loyalty_programs, category, purposes
+            cube, loyalty_programs, category, purposes
         )
         
-        for index, row in scores_df.iterrows():
-            program = row['loyalty_program']
-            scores_df.at[index, 'purpose_score'] = purpose_scores.get(program, 0.0)
-            scores_df.at[index, 'purpose_hotels'] = purpose_counts.get(program, 0)
+        scores['purpose_score'] = np.array([purpose_scores.get(program, 0.0) for program in programs], dtype=np.float64)
+        scores['purpose_hotels'] = _hotel_count_column([purpose_counts.get(program, 0) for program in programs])
+    
+    stage_timer.lap('purpose_score')
     
     # Обчислюємо загальний рейтинг
-    scores_df['total_score'] = (
-        scores_df['region_score'] + 
-        scores_df['category_score'] + 
-        scores_df['style_score'] + 
-        scores_df['purpose_score']
+    scores['total_score'] = (
+        scores['region_score'] + 
+        scores['category_score'] + 
+        scores['style_score'] + 
+        scores['purpose_score']
     )
     
     logger.info(f"=== FINAL CALCULATION COMPLETE WITH TIES HANDLING ===")
-    for _, row in scores_df.head(3).iterrows():
-        logger.info(f"{row['loyalty_program']}: region={row['region_score']:.1f}, "
-                   f"category={row['category_score']:.1f}, style={row['style_score']:.1f}, "
-                   f"purpose={row['purpose_score']:.1f}, total={row['total_score']:.1f}")
-    
-    # Сортуємо за загальним рейтингом
-    scores_df = scores_df.sort_values('total_score', ascending=False)
+    for i in range(min(3, len(programs))):
+        logger.info(f"{programs[i]}: region={scores['region_score'][i]:.1f}, "
+                   f"category={scores['category_score'][i]:.1f}, style={scores['style_score'][i]:.1f}, "
+                   f"purpose={scores['purpose_score'][i]:.1f}, total={scores['total_score'][i]:.1f}")
+    
+    # Ранжуємо за загальним рейтингом: лише top_k найкращих, без сортування всіх програм
+    order = top_k_order(scores['total_score'], top_k)
+    if top_k is None:
+        scores_df = pd.DataFrame(scores).take(order)
+    else:
+        scores_df = {column: values[order] for column, values in scores.items()}
+    stage_timer.lap('ranking')
     
+    if return_cube:
+        return scores_df, cube
     return scores_df
 
-def get_detailed_style_scores(filtered_by_region, program, category, styles):
-    """Розраховує детальні бали для стилів з правильним розподілом при ties"""
-    scores = {'main': {}, 'adjacent': {}}
+def _cube_counts_batch(cube, filters):
+    """
+    Підраховує кількість готелів кожної програми куба для багатьох фільтрів одразу
     
-    if not styles or not category:
-        return scores
+    Args:
+        cube: куб з cube_from_count_table
+        filters: масив (запити × 3) з бітами категорії, стилю та мети; -1 - без фільтра
     
-    # Основна категорія
-    main_category_hotels = filter_hotels_by_category(filtered_by_region, category)
-    main_style_filtered = filter_hotels_by_style(main_category_hotels, styles)
-    main_counts = main_style_filtered.groupby('loyalty_program').size().to_dict()
+    Returns:
+        масив int64 форми (запити × програми куба)
+    """
+    filters = np.asarray(filters, dtype=np.int64).reshape(-1, 3)
+    matched = np.ones((len(filters), len(cube['hotels'])), dtype=bool)
     
-    # Використовуємо нову функцію розподілу балів
-    main_score_values = [21, 18, 15, 12, 9, 6, 3]
-    main_scores = distribute_scores_with_ties(main_counts, main_score_values)
-    main_total_score = main_scores.get(program, 0.0)
+    for mask_column, bits in zip(('category_mask', 'style_mask', 'purpose_mask'), filters.T):
+        masks = cube[mask_column].astype(np.int64)
+        matched &= (bits[:, None] < 0) | ((masks[None, :] & bits[:, None]) != 0)
+    
+    # Готелі клітинок, рознесені по програмах: сума за фільтрами - одне множення матриць
+    program_hotels = np.zeros((len(cube['hotels']), len(cube['programs'])))
+    program_hotels[np.arange(len(cube['hotels'])), cube['program_codes']] = cube['hotels']
+    return np.rint(matched.astype(np.float64) @ program_hotels).astype(np.int64)
+
+def calculate_scores_batch(answer_sets, hotel_data):
+    """
+    Розраховує бали для багатьох наборів відповідей за один виклик (аналітика, прогрів кешу)
     
-    # Нормалізуємо, якщо кілька стилів
-    if len(styles) > 1:
-        main_total_score = main_total_score / len(styles)
+    Відповіді з однаковими регіонами/країнами ділять вибір рядків, куб і бали за регіоном.
+    Кількості для категорій, стилів і цілей групи рахуються одним множенням матриць
+    по унікальних фільтрах, а бали розподіляються через distribute_scores_array.
+    Бали збігаються з calculate_scores для кожного набору.
     
-    for style in styles:
-        main_program_hotels = len(filter_hotels_by_style(main_category_hotels[main_category_hotels['loyalty_program'] == program], [style]))
-        scores['main'][style] = {'hotels': main_program_hotels, 'points': main_total_score}
+    Args:
+        answer_sets: список словників відповідей (як user_data для calculate_scores)
+        hotel_data: DataFrame з даними готелів
     
-    # Суміжні категорії
-    adjacent_categories = get_adjacent_categories(category)
-    max_adj_score = 0.0
+    Returns:
+        DataFrame у довгому форматі: answer_index (номер набору у списку) та колонки
+        calculate_scores; у межах набору - за спаданням total_score
+    """
+    main_score_values = [21, 18, 15, 12, 9, 6, 3]
+    adj_score_values = [7, 6, 5, 4, 3, 2, 1]
+    steps = ('category', 'style', 'purpose')
     
-    for adj_cat in adjacent_categories:
-        adj_category_hotels = filter_hotels_by_category(filtered_by_region, adj_cat)
-        adj_style_filtered = filter_hotels_by_style(adj_category_hotels, styles)
-        adj_counts = adj_style_filtered.groupby('loyalty_program').size().to_dict()
+    loyalty_programs = hotel_data['loyalty_program'].unique()
+    programs = list(loyalty_programs)
+    program_positions = {program: position for position, program in enumerate(programs) if pd.notna(program)}
+    n_answers, n_programs = len(answer_sets), len(programs)
+    table = get_count_table(hotel_data)
+    
+    region_score = np.zeros((n_answers, n_programs))
+    region_hotels = np.zeros((n_answers, n_programs))
+    step_scores = {step: np.zeros((n_answers, n_programs)) for step in steps}
+    step_hotels = {step: np.zeros((n_answers, n_programs)) for step in steps}
+    
+    # Групуємо набори з однаковими регіонами/країнами
+    groups = {}
+    for index, answers in enumerate(answer_sets):
+        key = (tuple(answers.get('regions', []) or []), tuple(answers.get('countries', []) or []))
+        groups.setdefault(key, []).append(index)
+    
+    for (regions, countries), indices in groups.items():
+        regions, countries = list(regions), list(countries)
+        selected = select_count_table_rows(hotel_data, regions, countries)
+        cube = cube_from_count_table(table, selected)
         
-        # Використовуємо нову функцію розподілу балів
-        adj_score_values = [7, 6, 5, 4, 3, 2, 1]
-        adj_scores = distribute_scores_with_ties(adj_counts, adj_score_values)
-        adj_score = adj_scores.get(program, 0.0)
+        # Бали за регіоном однакові для всієї групи
+        region_scores = get_region_score(table, selected, regions, countries)
+        region_hotels_by_program = get_region_hotels(table, selected, cube, regions)
+        region_score[indices] = [region_scores.get(program, 0.0) for program in programs]
+        region_hotels[indices] = [region_hotels_by_program.get(program, 0) for program in programs]
         
-        # Нормалізуємо, якщо кілька стилів
-        if len(styles) > 1:
-            adj_score = adj_score / len(styles)
+        # Запити до куба: (набір, крок, основна категорія?, біти категорії, стилю, мети)
+        queries = []
+        divisors = {step: np.ones(n_answers) for step in steps}
+        for index in indices:
+            answers = answer_sets[index]
+            category = answers.get('category')
+            if not category:
+                continue
+            styles = answers.get('styles', []) or []
+            purposes = answers.get('purposes', []) or []
+            
+            selections = [('category', -1, -1)]
+            if styles:
+                selections.append(('style', get_style_bits(styles), -1))
+                divisors['style'][index] = len(styles)
+            if purposes:
+                selections.append(('purpose', -1, get_purpose_bits(purposes)))
+                divisors['purpose'][index] = len(purposes)
+            
+            for step, style_bits, purpose_bits in selections:
+                queries.append((index, step, True, CATEGORY_BITS.get(category, -1), style_bits, purpose_bits))
+                for adj_cat in get_adjacent_categories(category):
+                    queries.append((index, step, False, CATEGORY_BITS.get(adj_cat, -1), style_bits, purpose_bits))
         
-        max_adj_score = max(max_adj_score, adj_score)
+        if not queries:
+            continue
         
-        scores['adjacent'][adj_cat] = {}
-        for style in styles:
-            adj_program_hotels = len(filter_hotels_by_style(adj_category_hotels[adj_category_hotels['loyalty_program'] == program], [style]))
-            scores['adjacent'][adj_cat][style] = {'hotels': adj_program_hotels, 'points': adj_score}
+        # Однакові фільтри рахуємо й ранжуємо один раз
+        filters, rows = np.unique(np.array([query[3:] for query in queries], dtype=np.int64),
+                                  axis=0, return_inverse=True)
+        counts = np.zeros((len(filters), n_programs), dtype=np.int64)
+        counts[:, [program_positions[program] for program in cube['programs']]] = _cube_counts_batch(cube, filters)
+        main_scores = distribute_scores_array(counts, main_score_values)
+        adj_scores = distribute_scores_array(counts, adj_score_values)
+        
+        query_answers = np.array([query[0] for query in queries])
+        query_steps = np.array([query[1] for query in queries])
+        query_main = np.array([query[2] for query in queries])
+        rows = rows.reshape(-1)
+        
+        for step in steps:
+            main = query_main & (query_steps == step)
+            adjacent = ~query_main & (query_steps == step)
+            main_answers, main_rows = query_answers[main], rows[main]
+            
+            # Суміжні категорії: МАКСИМУМ балів по всіх суміжних категоріях
+            adjacent_max = np.zeros((n_answers, n_programs))
+            np.maximum.at(adjacent_max, query_answers[adjacent], adj_scores[rows[adjacent]])
+            
+            if step == 'category':
+                # Бали за категорією нараховуються, лише якщо в основній категорії є готелі
+                has_hotels = (counts[main_rows] > 0).any(axis=1)
+                main_answers, main_rows = main_answers[has_hotels], main_rows[has_hotels]
+            
+            step_scores[step][main_answers] = (
+                (main_scores[main_rows] + adjacent_max[main_answers]) / divisors[step][main_answers, None]
+            )
+            step_hotels[step][main_answers] = counts[main_rows]
+    
+    total_score = region_score + step_scores['category'] + step_scores['style'] + step_scores['purpose']
+    
+    result = pd.DataFrame({
+        'answer_index': np.repeat(np.arange(n_answers), n_programs),
+        'loyalty_program': loyalty_programs.take(np.tile(np.arange(n_programs), n_answers)),
+        'region_score': region_score.ravel(),
+        'category_score': step_scores['category'].ravel(),
+        'style_score': step_scores['style'].ravel(),
+        'purpose_score': step_scores['purpose'].ravel(),
+        'total_score': total_score.ravel(),
+        'region_hotels': _hotel_count_column(region_hotels.ravel()),
+        'category_hotels': _hotel_count_column(step_hotels['category'].ravel()),
+        'style_hotels': _hotel_count_column(step_hotels['style'].ravel()),
+        'purpose_hotels': _hotel_count_column(step_hotels['purpose'].ravel())
+    })
     
-    return scores
+    # У межах набору - за спаданням балу (ключ float32, як у top_k_order); однакові бали - у порядку програм
+    order = np.lexsort((-result['total_score'].to_numpy(dtype=np.float32), result['answer_index'].to_numpy()))
+    logger.info(f"Batch scoring: {n_answers} answer sets, {len(groups)} region groups")
+    return result.iloc[order].reset_index(drop=True)
 
-def get_detailed_purpose_scores(filtered_by_region, program, category, purposes):
-    """Розраховує детальні бали для цілей з правильним розподілом при ties"""
-    scores = {'main': {}, 'adjacent': {}}
-    
-    if not purposes or not category:
-        return scores
-    
-    # Основна категорія
-    main_category_hotels = filter_hotels_by_category(filtered_by_region, category)
-    main_purpose_filtered = filter_hotels_by_purpose(main_category_hotels, purposes)
-    main_counts = main_purpose_filtered.groupby('loyalty_program').size().to_dict()
+def random_answer_sets(count, region_sets=40, seed=0):
+    """
+    Випадкові набори відповідей для бенчмарків
     
-    # Використовуємо нову функцію розподілу балів
-    main_score_values = [21, 18, 15, 12, 9, 6, 3]
-    main_scores = distribute_scores_with_ties(main_counts, main_score_values)
-    main_total_score = main_scores.get(program, 0.0)
+    Регіони беруться з region_sets різних виборів: як і в реальному трафіку,
+    багато користувачів обирають однакові регіони.
+    """
+    import random  # Потрібен лише для бенчмарків
+    rng = random.Random(seed)
+    langs = [rng.choice(list(REGION_NAMES)) for _ in range(region_sets)]
+    region_pool = [
+        (lang, [region for region in REGION_NAMES[lang] if rng.random() < 0.3] or [rng.choice(REGION_NAMES[lang])])
+        for lang in langs
+    ]
+    answer_sets = []
+    for _ in range(count):
+        lang, regions = rng.choice(region_pool)
+        answer_sets.append({
+            'regions': regions,
+            'countries': None,
+            'category': rng.choice(['Luxury', 'Comfort', 'Standard', None]),
+            'styles': rng.sample(STYLE_NAMES[lang], rng.randint(0, 3)),
+            'purposes': rng.sample(PURPOSE_NAMES[lang], rng.randint(0, 2))
+        })
+    return answer_sets
+
+def benchmark_scoring_batch(csv_path, count=3000):
+    """
+    Пропускна здатність calculate_scores_batch проти циклу по calculate_scores
     
-    # Нормалізуємо, якщо кілька цілей
-    if len(purposes) > 1:
-        main_total_score = main_total_score / len(purposes)
+    Якщо CSV не існує, використовується синтетичний файл на 500 тисяч готелів.
+    """
+    import tempfile  # Потрібен лише для бенчмарку
+    if os.path.exists(csv_path):
+        df = load_hotel_data(csv_path)
+    else:
+        logger.info(f"{csv_path} not found, using a synthetic CSV with 500000 hotels")
+        with tempfile.TemporaryDirectory() as directory:
+            synthetic_path = os.path.join(directory, "hotels.csv")
+            write_synthetic_hotel_csv(synthetic_path, 500000)
+            df = load_hotel_data(synthetic_path)
+    if df is None:
+        return
+    answer_sets = random_answer_sets(count)
     
-    for purpose in purposes:
-        main_program_hotels = len(filter_hotels_by_purpose(main_category_hotels[main_category_hotels['loyalty_program'] == program], [purpose]))
-        scores['main'][purpose] = {'hotels': main_program_hotels, 'points': main_total_score}
+    # calculate_scores пише кілька рядків INFO на кожен набір - на час вимірювання вимикаємо
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+    try:
+        get_count_table(df)
+        started = time.perf_counter()
+        batch = calculate_scores_batch(answer_sets, df)
+        batch_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        singles = [calculate_scores(answers, df) for answers in answer_sets]
+        loop_seconds = time.perf_counter() - started
+    finally:
+        logger.setLevel(level)
+    
+    columns = ['loyalty_program', 'total_score']
+    mismatches = sum(
+        not batch.loc[batch['answer_index'] == index, columns].reset_index(drop=True).equals(
+            single[columns].reset_index(drop=True))
+        for index, single in enumerate(singles)
+    )
+    logger.info(f"{count} answer sets over {len(df)} rows: batch {count / batch_seconds:.0f}/s, "
+                f"loop {count / loop_seconds:.0f}/s (x{loop_seconds / batch_seconds:.1f}), "
+                f"{mismatches} answer sets differ")
+
+# Шаблони детального звіту (статичні частини кожною мовою, підготовлені один раз)
+RESULT_TEMPLATES = {
+    'uk': {
+        'header': "🥇 {rank}. {program}\nЗагальний бал: {total:.2f}\n" + "-" * 30 + "\n",
+        'region': "📍 REGION: {score:.1f} балів\n   {hotels} готелів у {places}\n\n",
+        'category': "🏨 CATEGORY: {score:.1f} балів\n",
+        'category_main': "   (основна) {category} – {hotels} готелів – {points:.1f} балів\n",
+        'category_adjacent': "   (суміжна) {category} – {hotels} готелів – {points:.1f} балів\n",
+        'style': "🎨 STYLE: {score:.1f} балів\n",
+        'purpose': "🎯 PURPOSE: {score:.1f} балів\n",
+        'selection_main': "   {item} в {category} {hotels} готелів – {points:.1f} балів\n",
+        'selection_adjacent': "   {item} в {category} (суміжний сегмент) {hotels} готелів – {points:.1f} балів\n",
+        'summary': "➕ ПІДСУМОК:\n   {region:.1f} + {category:.1f} + {style:.1f} + {purpose:.1f} = {total:.2f} балів\n",
+    },
+    'en': {
+        'header': "🥇 {rank}. {program}\nTotal score: {total:.2f}\n" + "-" * 30 + "\n",
+        'region': "📍 REGION: {score:.1f} points\n   {hotels} hotels in {places}\n\n",
+        'category': "🏨 CATEGORY: {score:.1f} points\n",
+        'category_main': "   (main) {category} – {hotels} hotels – {points:.1f} points\n",
+        'category_adjacent': "   (adjacent) {category} – {hotels} hotels – {points:.1f} points\n",
+        'style': "🎨 STYLE: {score:.1f} points\n",
+        'purpose': "🎯 PURPOSE: {score:.1f} points\n",
+        'selection_main': "   {item} in {category} {hotels} hotels – {points:.1f} points\n",
+        'selection_adjacent': "   {item} in {category} (adjacent segment) {hotels} hotels – {points:.1f} points\n",
+        'summary': "➕ SUMMARY:\n   {region:.1f} + {category:.1f} + {style:.1f} + {purpose:.1f} = {total:.2f} points\n",
+    }
+}
+RESULT_TEMPLATES = {lang: {name: template.format for name, template in templates.items()}
+                    for lang, templates in RESULT_TEMPLATES.items()}
+RESULT_SEPARATOR = "\n" + "=" * 50 + "\n\n"
+
+def _report_details(cube, category, adjacent_categories, styles, purposes):
+    """
+    Кількості готелів і бали для всіх рядків детального звіту - однакові для всіх програм
     
-    # Суміжні категорії
-    adjacent_categories = get_adjacent_categories(category)
-    max_adj_score = 0.0
+    Усі фільтри (категорія, стилі, цілі) рахуються одним множенням на куб, а бали
+    за основною та суміжними категоріями - двома викликами distribute_scores_array.
     
-    for adj_cat in adjacent_categories:
-        adj_category_hotels = filter_hotels_by_category(filtered_by_region, adj_cat)
-        adj_purpose_filtered = filter_hotels_by_purpose(adj_category_hotels, purposes)
-        adj_counts = adj_purpose_filtered.groupby('loyalty_program').size().to_dict()
-        
-        # Використовуємо нову функцію розподілу балів
-        adj_score_values = [7, 6, 5, 4, 3, 2, 1]
-        adj_scores = distribute_scores_with_ties(adj_counts, adj_score_values)
-        adj_score = adj_scores.get(program, 0.0)
-        
-        # Нормалізуємо, якщо кілька цілей
-        if len(purposes) > 1:
-            adj_score = adj_score / len(purposes)
-        
-        max_adj_score = max(max_adj_score, adj_score)
-        
-        scores['adjacent'][adj_cat] = {}
-        for purpose in purposes:
-            adj_program_hotels = len(filter_hotels_by_purpose(adj_category_hotels[adj_category_hotels['loyalty_program'] == program], [purpose]))
-            scores['adjacent'][adj_cat][purpose] = {'hotels': adj_program_hotels, 'points': adj_score}
+    Returns:
+        словник: columns ({програма: стовпець}), hotels, main_points, adjacent_points
+        (списки рядків по стовпцях) та rows ({(категорія, біти стилю, біти мети): рядок})
+    """
+    style_bits = {style: get_style_bits([style]) for style in styles}
+    purpose_bits = {purpose: get_purpose_bits([purpose]) for purpose in purposes}
     
-    return scores
+    filters = []
+    if category:
+        for cat in [category] + adjacent_categories:
+            filters.append((cat, None, None))
+            if styles:
+                filters += [(cat, get_style_bits(styles), None)] + [(cat, style_bits[style], None) for style in styles]
+            if purposes:
+                filters += [(cat, None, get_purpose_bits(purposes))] + [(cat, None, purpose_bits[purpose]) for purpose in purposes]
+    filters = list(dict.fromkeys(filters))
+    
+    details = {
+        'columns': {program: column for column, program in enumerate(cube['programs'])},
+        'rows': {key: row for row, key in enumerate(filters)},
+        'style_bits': style_bits,
+        'purpose_bits': purpose_bits
+    }
+    counts = _cube_counts_batch(cube, [
+        (CATEGORY_BITS.get(cat, -1), -1 if bits is None else bits, -1 if other is None else other)
+        for cat, bits, other in filters
+    ])
+    details['hotels'] = counts.tolist()
+    details['main_points'] = distribute_scores_array(counts, [21, 18, 15, 12, 9, 6, 3]).tolist()
+    details['adjacent_points'] = distribute_scores_array(counts, [7, 6, 5, 4, 3, 2, 1]).tolist()
+    return details
 
-def format_detailed_results(user_data, scores_df, lang='en'):
-    """Форматує ДЕТАЛЬНІ результати з правильним розрахунком балів за ties"""
-    results = ""
+def format_detailed_results(user_data, scores_df, lang='en', df=None, cube=None):
+    """
+    Форматує ДЕТАЛЬНІ результати з правильним розрахунком балів за ties
+    
+    Args:
+        scores_df: відсортовані бали - DataFrame або компактний результат calculate_scores(top_k=...)
+        df: дані, за якими рахували бали
+        cube: куб вибраних регіонів з calculate_scores (None - побудувати з df)
+    """
+    stage_timer = StageTimer()
+    templates = RESULT_TEMPLATES['uk' if lang == 'uk' else 'en']
     
-    max_programs = min(5, len(scores_df))
-    top_programs = scores_df.head(max_programs)
+    max_programs = min(RESULTS_TOP_K, len(scores_df['loyalty_program']))
     
     # Отримуємо детальну інформацію
     regions = user_data.get('regions', []) or []
@@ -1734,174 +3375,652 @@ def format_detailed_results(user_data, scores_df, lang='en'):
     styles = user_data.get('styles', []) or []
     purposes = user_data.get('purposes', []) or []
     
-    # Фільтруємо дані за регіоном для детального аналізу
-    filtered_by_region = filter_hotels_by_region(hotel_data, regions, countries)
+    # Куб кількостей готелів у вибраних регіонах для детального аналізу
+    if cube is None:
+        cube = region_score_cube(hotel_data if df is None else df, regions, countries)
+    
+    adjacent_categories = get_adjacent_categories(category) if category else []
+    details = _report_details(cube, category, adjacent_categories, styles, purposes)
+    rows, hotels = details['rows'], details['hotels']
+    places = ', '.join(regions) if regions else ', '.join(countries) if countries else 'N/A'
+    
+    # Рядки звіту за стилем і метою: (шаблон, назва, категорія, рядок кількостей, рядок балів, дільник)
+    selection_lines = {}
+    for title, selected, item_bits, key in (('style', styles, details['style_bits'], lambda cat, bits: (cat, bits, None)),
+                                           ('purpose', purposes, details['purpose_bits'], lambda cat, bits: (cat, None, bits))):
+        lines = []
+        if selected and category:
+            all_bits = get_style_bits(selected) if title == 'style' else get_purpose_bits(selected)
+            for cat in [category] + adjacent_categories:
+                is_main = cat == category
+                points_row = (details['main_points'] if is_main else details['adjacent_points'])[rows[key(cat, all_bits)]]
+                template = templates['selection_main'] if is_main else templates['selection_adjacent']
+                lines += [(template, item, cat.lower(), hotels[rows[key(cat, item_bits[item])]], points_row) for item in selected]
+        selection_lines[title] = lines
+    
+    columns = ('loyalty_program', 'total_score', 'region_score', 'region_hotels',
+               'category_score', 'style_score', 'purpose_score')
+    table = zip(*[np.asarray(scores_df[column])[:max_programs].tolist() for column in columns])
     
-    for i, (index, row) in enumerate(top_programs.iterrows()):
-        program = row['loyalty_program']
+    parts = []
+    for i, (program, total, region_score, region_hotels, category_score, style_score, purpose_score) in enumerate(table):
+        column = details['columns'].get(program)
         
-        if lang == 'uk':
-            results += f"🥇 {i+1}. {program}\n"
-            results += f"Загальний бал: {row['total_score']:.2f}\n"
-            results += "-" * 30 + "\n"
-        else:
-            results += f"🥇 {i+1}. {program}\n"
-            results += f"Total score: {row['total_score']:.2f}\n"
-            results += "-" * 30 + "\n"
+        parts.append(templates['header'](rank=i + 1, program=program, total=total))
         
         # РЕГІОН
-        if lang == 'uk':
-            results += f"📍 REGION: {row['region_score']:.1f} балів\n"
-            region_str = ', '.join(regions) if regions else ', '.join(countries) if countries else 'N/A'
-            results += f"   {row['region_hotels']} готелів у {region_str}\n\n"
-        else:
-            results += f"📍 REGION: {row['region_score']:.1f} points\n"
-            region_str = ', '.join(regions) if regions else ', '.join(countries) if countries else 'N/A'
-            results += f"   {row['region_hotels']} hotels in {region_str}\n\n"
+        parts.append(templates['region'](score=region_score, hotels=region_hotels, places=places))
         
-        # КАТЕГОРІЯ - використовуємо правильний розрахунок з ties
+        # КАТЕГОРІЯ
         if category:
-            # Розраховуємо кількість готелів для основної категорії
-            main_filtered = filter_hotels_by_category(filtered_by_region, category)
-            main_program_hotels = len(main_filtered[main_filtered['loyalty_program'] == program])
-            
-            # Розраховуємо бали для основної категорії з правильним розподілом при ties
-            main_counts = main_filtered.groupby('loyalty_program').size().to_dict()
-            main_score_values = [21, 18, 15, 12, 9, 6, 3]
-            main_scores = distribute_scores_with_ties(main_counts, main_score_values)
-            main_category_score = main_scores.get(program, 0.0)
-            
-            # Розраховуємо кількість готелів для суміжних категорій
-            adjacent_categories = get_adjacent_categories(category)
-            adjacent_hotels_data = {}
-            adjacent_scores_data = {}
-            
-            for adj_cat in adjacent_categories:
-                adj_filtered = filter_hotels_by_category(filtered_by_region, adj_cat)
-                adj_program_hotels = len(adj_filtered[adj_filtered['loyalty_program'] == program])
-                adjacent_hotels_data[adj_cat] = adj_program_hotels
-                
-                # Розраховуємо бали для цієї суміжної категорії з правильним розподілом при ties
-                adj_counts = adj_filtered.groupby('loyalty_program').size().to_dict()
-                adj_score = 0.0
-                if adj_counts:
-                    adj_score_values = [7, 6, 5, 4, 3, 2, 1]
-                    adj_scores = distribute_scores_with_ties(adj_counts, adj_score_values)
-                    adj_score = adj_scores.get(program, 0.0)
-                adjacent_scores_data[adj_cat] = adj_score
-            
-            if lang == 'uk':
-                results += f"🏨 CATEGORY: {row['category_score']:.1f} балів\n"
-                results += f"   (основна) {category} – {main_program_hotels} готелів – {main_category_score:.1f} балів\n"
-                
-                for adj_cat in adjacent_categories:
-                    adj_hotels = adjacent_hotels_data[adj_cat]
-                    adj_score = adjacent_scores_data[adj_cat]
-                    results += f"   (суміжна) {adj_cat} – {adj_hotels} готелів – {adj_score:.1f} балів\n"
-                results += "\n"
-            else:
-                results += f"🏨 CATEGORY: {row['category_score']:.1f} points\n"
-                results += f"   (main) {category} – {main_program_hotels} hotels – {main_category_score:.1f} points\n"
-                
-                for adj_cat in adjacent_categories:
-                    adj_hotels = adjacent_hotels_data[adj_cat]
-                    adj_score = adjacent_scores_data[adj_cat]
-                    results += f"   (adjacent) {adj_cat} – {adj_hotels} hotels – {adj_score:.1f} points\n"
-                results += "\n"
-        
-        # СТИЛЬ
-        if styles:
-            style_scores = get_detailed_style_scores(filtered_by_region, program, category, styles)
-            
-            if lang == 'uk':
-                results += f"🎨 STYLE: {row['style_score']:.1f} балів\n"
-                
-                # Основна категорія
-                for style in styles:
-                    if style in style_scores['main']:
-                        data = style_scores['main'][style]
-                        results += f"   {style} в {category.lower()} {data['hotels']} готелів – {data['points']:.1f} балів\n"
-                
-                # Суміжні категорії - показуємо всі, навіть з 0 готелів
-                for adj_cat, adj_styles in style_scores['adjacent'].items():
-                    for style in styles:
-                        if style in adj_styles:
-                            data = adj_styles[style]
-                            results += f"   {style} в {adj_cat.lower()} (суміжний сегмент) {data['hotels']} готелів – {data['points']:.1f} балів\n"
-                results += "\n"
-            else:
-                results += f"🎨 STYLE: {row['style_score']:.1f} points\n"
-                
-                # Основна категорія
-                for style in styles:
-                    if style in style_scores['main']:
-                        data = style_scores['main'][style]
-                        results += f"   {style} in {category.lower()} {data['hotels']} hotels – {data['points']:.1f} points\n"
-                
-                # Суміжні категорії - показуємо всі, навіть з 0 готелів
-                for adj_cat, adj_styles in style_scores['adjacent'].items():
-                    for style in styles:
-                        if style in adj_styles:
-                            data = adj_styles[style]
-                            results += f"   {style} in {adj_cat.lower()} (adjacent segment) {data['hotels']} hotels – {data['points']:.1f} points\n"
-                results += "\n"
-        
-        # МЕТА
-        if purposes:
-            purpose_scores = get_detailed_purpose_scores(filtered_by_region, program, category, purposes)
-            
-            if lang == 'uk':
-                results += f"🎯 PURPOSE: {row['purpose_score']:.1f} балів\n"
-                
-                # Основна категорія
-                for purpose in purposes:
-                    if purpose in purpose_scores['main']:
-                        data = purpose_scores['main'][purpose]
-                        results += f"   {purpose} в {category.lower()} {data['hotels']} готелів – {data['points']:.1f} балів\n"
-                
-                # Суміжні категорії - показуємо всі, навіть з 0 готелів
-                for adj_cat, adj_purposes in purpose_scores['adjacent'].items():
-                    for purpose in purposes:
-                        if purpose in adj_purposes:
-                            data = adj_purposes[purpose]
-                            results += f"   {purpose} в {adj_cat.lower()} (суміжний сегмент) {data['hotels']} готелів – {data['points']:.1f} балів\n"
-                results += "\n"
-            else:
-                results += f"🎯 PURPOSE: {row['purpose_score']:.1f} points\n"
-                
-                # Основна категорія
-                for purpose in purposes:
-                    if purpose in purpose_scores['main']:
-                        data = purpose_scores['main'][purpose]
-                        results += f"   {purpose} in {category.lower()} {data['hotels']} hotels – {data['points']:.1f} points\n"
-                
-                # Суміжні категорії - показуємо всі, навіть з 0 готелів
-                for adj_cat, adj_purposes in purpose_scores['adjacent'].items():
-                    for purpose in purposes:
-                        if purpose in adj_purposes:
-                            data = adj_purposes[purpose]
-                            results += f"   {purpose} in {adj_cat.lower()} (adjacent segment) {data['hotels']} hotels – {data['points']:.1f} points\n"
-                results += "\n"
+            parts.append(templates['category'](score=category_score))
+            for cat in [category] + adjacent_categories:
+                row = rows[(cat, None, None)]
+                is_main = cat == category
+                points = (details['main_points'] if is_main else details['adjacent_points'])[row]
+                template = templates['category_main'] if is_main else templates['category_adjacent']
+                parts.append(template(category=cat,
+                                      hotels=hotels[row][column] if column is not None else 0,
+                                      points=points[column] if column is not None else 0.0))
+            parts.append("\n")
+        
+        # СТИЛЬ ТА МЕТА: основна категорія, потім суміжні (показуємо всі, навіть з 0 готелів)
+        for title, selected, score in (('style', styles, style_score), ('purpose', purposes, purpose_score)):
+            if not selected:
+                continue
+            parts.append(templates[title](score=score))
+            for template, item, cat_lower, item_hotels, points in selection_lines[title]:
+                program_points = points[column] if column is not None else 0.0
+                # Нормалізуємо, якщо обрано кілька варіантів
+                if len(selected) > 1:
+                    program_points = program_points / len(selected)
+                parts.append(template(item=item, category=cat_lower,
+                                      hotels=item_hotels[column] if column is not None else 0,
+                                      points=program_points))
+            parts.append("\n")
         
         # ПІДСУМОК
-        if lang == 'uk':
-            results += f"➕ ПІДСУМОК:\n"
-            results += f"   {row['region_score']:.1f} + {row['category_score']:.1f} + {row['style_score']:.1f} + {row['purpose_score']:.1f} = {row['total_score']:.2f} балів\n"
-        else:
-            results += f"➕ SUMMARY:\n"
-            results += f"   {row['region_score']:.1f} + {row['category_score']:.1f} + {row['style_score']:.1f} + {row['purpose_score']:.1f} = {row['total_score']:.2f} points\n"
+        parts.append(templates['summary'](region=region_score, category=category_score,
+                                          style=style_score, purpose=purpose_score, total=total))
         
         if i < max_programs - 1:
-            results += "\n" + "="*50 + "\n\n"
+            parts.append(RESULT_SEPARATOR)
+    
+    results = ''.join(parts)
+    stage_timer.lap('format')
+    
+    return results
+
+# ===============================
+# ЧАСТИНА 13: КЕШ РЕЗУЛЬТАТІВ
+# ===============================
+
+# Кеш {ключ: (час створення, текст результатів)} у порядку останнього використання
+results_cache = OrderedDict()
+results_cache_stats = {'hits': 0, 'misses': 0, 'precomputed_hits': 0}
+
+def set_hotel_data(df, signature=None):
+    """Встановлює нові дані готелів і скидає кеш результатів"""
+    global hotel_data, hotel_data_version, hotel_data_signature
+    hotel_data = df
+    hotel_data_version += 1
+    if df is not None:
+        get_count_table(df)  # Таблиця кількостей готова до першого запиту (при перезавантаженні - вже в кеші)
+    hotel_data_signature = signature
+    results_cache.clear()
+    logger.info(f"Hotel data version {hotel_data_version} is active. Results cache cleared.")
+
+def _canonical_order(items, options):
+    """Сортує вибрані варіанти в порядку питання (невідомі значення - в кінці)"""
+    order = {name: i for i, name in enumerate(options)}
+    return sorted(items, key=lambda item: (order.get(item, len(order)), item))
+
+def canonicalize_answers(user_data):
+    """
+    Повертає відповіді користувача в канонічному вигляді
+    
+    Порядок натискання чекбоксів не впливає на результат, тому регіони, стилі
+    та цілі сортуються в порядку питання.
+    """
+    return {
+        'regions': _canonical_order(user_data.get('regions', []) or [], REGION_NAMES['uk'] + REGION_NAMES['en']),
+        'countries': sorted(user_data.get('countries', []) or []),
+        'category': user_data.get('category'),
+        'styles': _canonical_order(user_data.get('styles', []) or [], list(STYLE_BITS)),
+        'purposes': _canonical_order(user_data.get('purposes', []) or [], list(PURPOSE_BITS))
+    }
+
+def make_results_cache_key(answers, lang):
+    """Ключ кешу для канонічних відповідей, мови та версії даних"""
+    return (
+        hotel_data_version,
+        tuple(answers['regions']),
+        tuple(answers['countries']),
+        answers['category'],
+        tuple(answers['styles']),
+        tuple(answers['purposes']),
+        lang
+    )
+
+def get_results_cache_stats():
+    """Повертає лічильники кешу результатів"""
+    return {
+        'hits': results_cache_stats['hits'],
+        'misses': results_cache_stats['misses'],
+        'precomputed_hits': results_cache_stats['precomputed_hits'],
+        'size': len(results_cache)
+    }
+
+def compute_results(answers, lang):
+    """
+    Розраховує бали та форматує детальні результати для канонічних відповідей
+    
+    Returns:
+        текст результатів або None, якщо програм лояльності не знайдено
+    """
+    # Одне посилання на дані на весь розрахунок: перезавантаження CSV під час
+    # розрахунку не змінює дані цього запиту
+    df = hotel_data
+    top_scores, cube = calculate_scores(answers, df, return_cube=True, top_k=RESULTS_TOP_K)
+    if len(top_scores['loyalty_program']) == 0:
+        return None
+    return format_detailed_results(answers, top_scores, lang, df, cube)
+
+def lookup_results(answers, lang):
+    """
+    Шукає результати в кеші, а потім у попередньо обчисленій таблиці
+    
+    Returns:
+        (знайдено, текст результатів або None)
+    """
+    key = make_results_cache_key(answers, lang)
+    
+    entry = results_cache.get(key)
+    if entry is not None:
+        created_at, results = entry
+        if time.monotonic() - created_at <= RESULTS_CACHE_TTL:
+            results_cache.move_to_end(key)
+            results_cache_stats['hits'] += 1
+            logger.info(f"Results cache hit. Stats: {get_results_cache_stats()}")
+            return True, results
+        del results_cache[key]
+    
+    results_cache_stats['misses'] += 1
+    logger.info(f"Results cache miss. Stats: {get_results_cache_stats()}")
+    
+    found, results = lookup_precomputed_results(answers, lang)
+    if found:
+        results_cache_stats['precomputed_hits'] += 1
+        store_results(key, results)
+    return found, results
+
+def store_results(key, results):
+    """Зберігає результати в кеші (якщо дані готелів не оновилися під час розрахунку)"""
+    if key[0] != hotel_data_version or RESULTS_CACHE_SIZE <= 0:
+        return
+    
+    results_cache[key] = (time.monotonic(), results)
+    results_cache.move_to_end(key)
+    while len(results_cache) > RESULTS_CACHE_SIZE:
+        results_cache.popitem(last=False)
+
+# ===============================
+# ЧАСТИНА 14: ПОПЕРЕДНЬО ОБЧИСЛЕНІ РЕЗУЛЬТАТИ
+# ===============================
+
+# Простір відповідей скінченний, тому всі результати можна обчислити заздалегідь
+# (python hotel-quiz-bot.py --precompute) і зберегти в SQLite поруч із CSV.
+PRECOMPUTED_MAX_STYLES = 3
+PRECOMPUTED_MAX_PURPOSES = 2
+
+# Версія формату таблиці результатів (змінюється разом із розрахунком або звітом)
+PRECOMPUTED_FORMAT_VERSION = 1
+
+precomputed_results_db = None  # Відкрите з'єднання SQLite (лише читання)
+precomputed_results_path = None  # Шлях до таблиці (для перевірки після перезавантаження CSV)
+precomputed_results_signature = None  # SHA-256 CSV, для якого обчислено таблицю
+precomputed_results_zdict = b''  # Спільний словник zlib для текстів результатів
+precompute_worker_zdict = b''  # Словник zlib у процесі пулу попереднього обчислення
+
+def make_precomputed_key(answers, lang):
+    """
+    Компактний цілочисельний ключ таблиці попередньо обчислених результатів
+    
+    Біти ключа (від старших до молодших): мова, регіони (8), категорія (2),
+    стилі (6), цілі (4).
+    
+    Returns:
+        ключ або None, якщо відповіді не входять до простору питань
+    """
+    if answers['countries'] or lang not in REGION_NAMES:
+        return None
+    try:
+        key = list(REGION_NAMES).index(lang)
+        key = (key << max(map(len, REGION_NAMES.values()))) | sum(
+            1 << REGION_NAMES[lang].index(region) for region in answers['regions'])
+        key = (key << 2) | list(CATEGORY_MAPPING).index(answers['category'])
+        key = (key << max(map(len, STYLE_NAMES.values()))) | sum(
+            1 << STYLE_NAMES[lang].index(style) for style in answers['styles'])
+        key = (key << max(map(len, PURPOSE_NAMES.values()))) | sum(
+            1 << PURPOSE_NAMES[lang].index(purpose) for purpose in answers['purposes'])
+    except ValueError:
+        return None
+    return key
+
+def _compress_results(results, zdict):
+    """Стискає текст результатів zlib зі спільним словником"""
+    compressor = zlib.compressobj(9, zdict=zdict)
+    return compressor.compress(results.encode('utf-8')) + compressor.flush()
+
+def _precomputed_schema():
+    """Ідентифікатор формату таблиці: версія, розмір звіту, шаблони звіту та формат знімка даних"""
+    templates = repr(({lang: {name: template.__self__ for name, template in lang_templates.items()}
+                       for lang, lang_templates in RESULT_TEMPLATES.items()}, RESULT_SEPARATOR))
+    return (f"{PRECOMPUTED_FORMAT_VERSION}:{RESULTS_TOP_K}:"
+            f"{hashlib.sha256(templates.encode('utf-8')).hexdigest()[:16]}:{_snapshot_schema()}")
+
+def _decompress_results(blob, zdict):
+    """Розпаковує текст результатів, стиснутий _compress_results"""
+    decompressor = zlib.decompressobj(zdict=zdict)
+    return (decompressor.decompress(blob) + decompressor.flush()).decode('utf-8')
+
+def load_precomputed_results(path, signature):
+    """Відкриває таблицю попередньо обчислених результатів, якщо вона відповідає CSV"""
+    global precomputed_results_db, precomputed_results_path, precomputed_results_signature, precomputed_results_zdict
+    
+    precomputed_results_path = path
+    if not path or not os.path.exists(path):
+        logger.info(f"Precomputed results not found: {path}")
+        return False
+    
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        meta = dict(conn.execute("SELECT name, value FROM meta").fetchall())
+    except sqlite3.Error as e:
+        logger.error(f"Error opening precomputed results {path}: {e}")
+        return False
+    
+    if meta.get('csv_sha256') != signature:
+        logger.warning(f"Precomputed results {path} were built for another CSV. Ignoring them.")
+        conn.close()
+        return False
+    
+    if meta.get('schema') != _precomputed_schema():
+        logger.warning(f"Precomputed results {path} were built with another report format. Ignoring them.")
+        conn.close()
+        return False
+    
+    if precomputed_results_db is not None:
+        precomputed_results_db.close()
+    precomputed_results_db = conn
+    precomputed_results_signature = signature
+    precomputed_results_zdict = meta.get('zdict', b'')
+    logger.info(f"Loaded precomputed results from {path}")
+    return True
+
+def lookup_precomputed_results(answers, lang):
+    """
+    Шукає результати в попередньо обчисленій таблиці
+    
+    Returns:
+        (знайдено, текст результатів або None)
+    """
+    if precomputed_results_db is None or precomputed_results_signature != hotel_data_signature:
+        return False, None
+    
+    key = make_precomputed_key(answers, lang)
+    if key is None:
+        return False, None
+    
+    row = precomputed_results_db.execute("SELECT results FROM results WHERE key = ?", (key,)).fetchone()
+    if row is None:
+        return False, None
+    if row[0] is None:
+        return True, None
+    return True, _decompress_results(row[0], precomputed_results_zdict)
+
+def _init_precompute_worker(csv_path, zdict):
+    """Ініціалізує процес пулу: дані готелів завантажуються один раз на процес"""
+    global precompute_worker_zdict
+    logging.getLogger().setLevel(logging.WARNING)
+    set_hotel_data(load_hotel_data(csv_path))
+    precompute_worker_zdict = zdict
+
+def _precompute_region_set(task):
+    """Обчислює результати для всіх відповідей з одним набором регіонів"""
+    lang, region_bits = task
+    regions = [region for i, region in enumerate(REGION_NAMES[lang]) if region_bits & (1 << i)]
+    
+    style_combos = [combo for size in range(1, PRECOMPUTED_MAX_STYLES + 1)
+                    for combo in itertools.combinations(STYLE_NAMES[lang], size)]
+    purpose_combos = [combo for size in range(1, PRECOMPUTED_MAX_PURPOSES + 1)
+                      for combo in itertools.combinations(PURPOSE_NAMES[lang], size)]
+    
+    rows = []
+    for category in CATEGORY_MAPPING:
+        for styles in style_combos:
+            for purposes in purpose_combos:
+                answers = {
+                    'regions': regions,
+                    'countries': [],
+                    'category': category,
+                    'styles': list(styles),
+                    'purposes': list(purposes)
+                }
+                results = compute_results(answers, lang)
+                compressed = _compress_results(results, precompute_worker_zdict) if results is not None else None
+                rows.append((make_precomputed_key(answers, lang), compressed))
+    return rows
+
+def precompute_all_results(csv_path, output_path, workers=None):
+    """
+    Обчислює результати для всього простору відповідей і записує їх у SQLite
+    
+    Args:
+        csv_path: шлях до CSV з даними готелів
+        output_path: шлях до файлу SQLite
+        workers: кількість процесів (за замовчуванням - кількість ядер)
+    """
+    signature = compute_file_sha256(csv_path) if os.path.exists(csv_path) else None
+    df, signature = load_hotel_data(csv_path, signature, return_signature=True)
+    if df is None:
+        logger.error("Не вдалося завантажити дані. Попереднє обчислення скасовано.")
+        return False
+    
+    # Словник zlib з типових результатів: тексти дуже схожі, тож стискаються значно краще
+    set_hotel_data(df, signature)
+    zdict = "".join(
+        compute_results({
+            'regions': REGION_NAMES[lang],
+            'countries': [],
+            'category': category,
+            'styles': STYLE_NAMES[lang][:PRECOMPUTED_MAX_STYLES],
+            'purposes': PURPOSE_NAMES[lang][:PRECOMPUTED_MAX_PURPOSES]
+        }, lang) or ""
+        for lang in REGION_NAMES for category in ("Luxury", "Comfort")
+    ).encode('utf-8')[-32768:]
+    tasks = [(lang, region_bits) for lang in REGION_NAMES
+             for region_bits in range(1, 1 << len(REGION_NAMES[lang]))]
+    
+    tmp_path = output_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    
+    conn = sqlite3.connect(tmp_path)
+    conn.execute("CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("CREATE TABLE results (key INTEGER PRIMARY KEY, results BLOB)")
+    
+    started = time.monotonic()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_precompute_worker,
+                             initargs=(csv_path, zdict)) as executor:
+        for done, rows in enumerate(executor.map(_precompute_region_set, tasks), 1):
+            conn.executemany("INSERT INTO results VALUES (?, ?)", rows)
+            if done % 25 == 0 or done == len(tasks):
+                conn.commit()
+                logger.info(f"Precomputed {done}/{len(tasks)} region sets "
+                            f"in {time.monotonic() - started:.0f}s")
+    
+    conn.executemany("INSERT INTO meta VALUES (?, ?)", [('csv_sha256', signature), ('schema', _precomputed_schema()), ('zdict', zdict)])
+    conn.commit()
+    conn.close()
+    os.replace(tmp_path, output_path)
+    
+    logger.info(f"Precomputed results written to {output_path}")
+    return True
+
+# ===============================
+# ЧАСТИНА 15: РОЗРАХУНОК БАЛІВ У ПУЛІ ПОТОКІВ/ПРОЦЕСІВ
+# ===============================
+
+# Розрахунок балів синхронний і важкий (pandas), тому виконується в пулі,
+# щоб не блокувати обробку оновлень інших користувачів.
+scoring_executor = None
+scoring_jobs = 0  # Розрахунки в роботі та в черзі пулу
+scoring_csv_path = None  # Шлях до CSV для процесів пулу
+
+class ScoringBusyError(Exception):
+    """Черга розрахунків заповнена"""
+
+def _init_scoring_worker(csv_path, signature):
+    """Ініціалізує процес пулу: дані готелів завантажуються один раз на процес"""
+    global stage_observations
+    stage_observations = []
+    set_hotel_data(load_hotel_data(csv_path, signature), signature)
+
+def _compute_results_in_worker(answers, lang, csv_path, signature):
+    """
+    Розрахунок у процесі пулу; дані перезавантажуються, лише якщо змінився CSV
+    
+    Returns:
+        (текст результатів або None, список (стадія, тривалість) для метрик)
+    """
+    if hotel_data is None or hotel_data_signature != signature:
+        set_hotel_data(load_hotel_data(csv_path, signature), signature)
+    results = compute_results(answers, lang)
+    observations = stage_observations[:]
+    stage_observations.clear()
+    return results, observations
+
+def create_scoring_executor(csv_path):
+    """Створює пул для розрахунку балів відповідно до SCORING_EXECUTOR"""
+    global scoring_executor, scoring_csv_path
+    scoring_csv_path = csv_path
+    
+    if SCORING_EXECUTOR == "process":
+        # spawn: процес бота вже має потоки, тож fork небезпечний
+        scoring_executor = ProcessPoolExecutor(
+            max_workers=SCORING_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_scoring_worker,
+            initargs=(csv_path, hotel_data_signature)
+        )
+    else:
+        scoring_executor = ThreadPoolExecutor(max_workers=SCORING_WORKERS, thread_name_prefix="scoring")
     
+    logger.info(f"Scoring executor: {SCORING_EXECUTOR}, workers: {SCORING_WORKERS}, queue size: {SCORING_QUEUE_SIZE}")
+
+async def run_scoring_job(answers, lang):
+    """
+    Виконує compute_results у пулі
+    
+    Raises:
+        ScoringBusyError: якщо в роботі вже SCORING_QUEUE_SIZE розрахунків
+    """
+    global scoring_jobs
+    
+    if scoring_executor is None:
+        return compute_results(answers, lang)
+    
+    if scoring_jobs >= SCORING_QUEUE_SIZE:
+        raise ScoringBusyError()
+    
+    loop = asyncio.get_running_loop()
+    scoring_jobs += 1
+    try:
+        if isinstance(scoring_executor, ProcessPoolExecutor):
+            results, observations = await loop.run_in_executor(
+                scoring_executor, _compute_results_in_worker,
+                answers, lang, scoring_csv_path, hotel_data_signature
+            )
+            for stage, seconds in observations:
+                observe_stage(stage, seconds)
+            return results
+        return await loop.run_in_executor(scoring_executor, compute_results, answers, lang)
+    finally:
+        scoring_jobs -= 1
+
+async def get_results(user_data, lang):
+    """
+    Повертає детальні результати: з кешу, з попередньо обчисленої таблиці або з пулу
+    
+    Returns:
+        текст результатів або None, якщо програм лояльності не знайдено
+    
+    Raises:
+        ScoringBusyError: якщо черга розрахунків заповнена
+    """
+    answers = canonicalize_answers(user_data)
+    found, results = lookup_results(answers, lang)
+    if found:
+        return results
+    
+    key = make_results_cache_key(answers, lang)
+    results = await run_scoring_job(answers, lang)
+    store_results(key, results)
     return results
 
+register_gauge("hotel_bot_results_cache_hits_total", "Results cache hits.",
+               lambda: results_cache_stats['hits'], 'counter')
+register_gauge("hotel_bot_results_cache_misses_total", "Results cache misses.",
+               lambda: results_cache_stats['misses'], 'counter')
+register_gauge("hotel_bot_precomputed_results_hits_total", "Cache misses served from the precomputed table.",
+               lambda: results_cache_stats['precomputed_hits'], 'counter')
+register_gauge("hotel_bot_results_cache_size", "Entries in the results cache.",
+               lambda: len(results_cache))
+register_gauge("hotel_bot_scoring_jobs", "Scoring jobs running or queued in the executor.",
+               lambda: scoring_jobs)
+
+# ===============================
+# ЧАСТИНА 16: ПЕРЕЗАВАНТАЖЕННЯ ДАНИХ ГОТЕЛІВ БЕЗ ПЕРЕЗАПУСКУ
+# ===============================
+
+hotel_data_path = None  # CSV, з якого завантажено дані готелів
+hotel_data_reload_lock = asyncio.Lock()
+hotel_data_reloads = {'success': 0, 'failed': 0}
+
+def _prepare_hotel_data_reload(csv_path, current_signature):
+    """
+    Фонова частина перезавантаження: хеш, розбір CSV, маски, перевірка та таблиця кількостей
+    
+    Returns:
+        (DataFrame або None, якщо CSV не змінився, SHA-256 CSV)
+    
+    Raises:
+        HotelDataError: якщо нові дані непридатні
+    """
+    signature = compute_file_sha256(csv_path)
+    if signature == current_signature:
+        return None, signature
+    # Підпис - хеш фактично розібраних байтів: CSV міг змінитися після обчислення хешу
+    df, signature = load_hotel_data(csv_path, signature, return_signature=True)
+    validate_hotel_data(df)
+    if df.empty:
+        raise HotelDataError("CSV не містить жодного готелю")
+    # load_hotel_data створює відсутні колонки порожніми - такі дані не підміняють робочі
+    empty_columns = [col for col in REQUIRED_COLUMNS if (df[col].isna() | df[col].isin([''])).all()]
+    if empty_columns:
+        raise HotelDataError(f"Порожні колонки: {empty_columns}")
+    # Таблиця кількостей будується тут, поза циклом подій: set_hotel_data бере її з кешу
+    get_count_table(df)
+    return df, signature
+
+def _warm_up_scoring_worker():
+    """Порожнє завдання: змушує пул запустити процес (і завантажити дані) заздалегідь"""
+
+def restart_scoring_processes():
+    """Замінює процеси пулу новими з актуальними даними; старі завершують свої розрахунки"""
+    global scoring_executor
+    old_executor = scoring_executor
+    create_scoring_executor(scoring_csv_path)
+    new_executor = scoring_executor
+    old_executor.shutdown(wait=False)
+    
+    # Процеси запускаються під час submit, тому прогріваємо їх у фоновому потоці
+    def warm_up():
+        for _ in range(SCORING_WORKERS):
+            new_executor.submit(_warm_up_scoring_worker)
+    threading.Thread(target=warm_up, name="scoring-warm-up", daemon=True).start()
+
+async def reload_hotel_data(reason):
+    """
+    Перезавантажує CSV у фоновому потоці та підміняє дані готелів однією операцією
+    
+    Розрахунки, що вже виконуються, завершуються зі старими даними: compute_results
+    бере посилання на DataFrame один раз, а кеш не приймає результати старої версії.
+    
+    Returns:
+        опис результату (для журналу та відповіді адміністратору)
+    """
+    async with hotel_data_reload_lock:
+        logger.info(f"Reloading hotel data from {hotel_data_path} ({reason})")
+        try:
+            df, signature = await asyncio.to_thread(_prepare_hotel_data_reload, hotel_data_path, hotel_data_signature)
+        except (OSError, HotelDataError) as e:
+            hotel_data_reloads['failed'] += 1
+            logger.error(f"Hotel data reload failed, keeping version {hotel_data_version}: {e}")
+            return f"Reload failed, keeping data version {hotel_data_version}: {e}"
+        
+        if df is None:
+            logger.info(f"Hotel data file is unchanged (version {hotel_data_version})")
+            return f"CSV is unchanged, data version {hotel_data_version}"
+        
+        # Підміна виконується в циклі подій, тому ключі кешу та дані завжди узгоджені
+        set_hotel_data(df, signature)
+        load_precomputed_results(precomputed_results_path, signature)
+        if isinstance(scoring_executor, ProcessPoolExecutor):
+            restart_scoring_processes()
+        
+        hotel_data_reloads['success'] += 1
+        return f"Hotel data version {hotel_data_version} is active: {len(df)} rows"
+
+def _hotel_data_file_state():
+    """Час модифікації та розмір CSV (None, якщо файл недоступний)"""
+    try:
+        stat = os.stat(hotel_data_path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+async def watch_hotel_data_file():
+    """Стежить за CSV і перезавантажує дані після його зміни"""
+    seen = _hotel_data_file_state()
+    changed = None
+    while True:
+        await asyncio.sleep(HOTEL_DATA_WATCH_INTERVAL)
+        current = _hotel_data_file_state()
+        if current is None or current == seen:
+            changed = None
+            continue
+        # Чекаємо ще одну перевірку без змін, щоб не читати файл, який ще записується
+        if current != changed:
+            changed = current
+            continue
+        seen, changed = current, None
+        await reload_hotel_data("file changed")
+
+@timed_handler
+async def reload_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Команда /reload для адміністраторів (ADMIN_IDS): перезавантажує CSV без перезапуску"""
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_IDS:
+        logger.warning(f"User {user_id} tried to use /reload without permission")
+        return
+    
+    await update.message.reply_text("Reloading hotel data...")
+    status = await reload_hotel_data(f"/reload by {user_id}")
+    await update.message.reply_text(status)
+
+register_gauge("hotel_bot_hotel_data_version", "Version of the active hotel data snapshot.",
+               lambda: hotel_data_version)
+register_gauge("hotel_bot_hotel_data_reloads_total", "Successful hotel data reloads.",
+               lambda: hotel_data_reloads['success'], 'counter')
+register_gauge("hotel_bot_hotel_data_reload_failures_total", "Hotel data reloads rejected by validation or I/O errors.",
+               lambda: hotel_data_reloads['failed'], 'counter')
+
+# ===============================
+# ЧАСТИНА 17: ВІДОБРАЖЕННЯ РЕЗУЛЬТАТІВ ТА ЗАПУСК БОТА
+# ===============================
+
+@timed_handler
 async def calculate_and_show_results(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обчислює результати та відображає їх користувачеві з детальним звітом"""
     
     user_id = update.effective_user.id
-    user_data = user_data_global[user_id]
-    lang = user_data['language']
+    session = sessions.get(user_id)
+    if session is None:
+        return await session_expired(update, context)
+    user_data = session.to_answers()
+    lang = session.language
     
     try:
         logger.info(f"Розрахунок балів для користувача {user_id}")
@@ -1920,10 +4039,25 @@ async def calculate_and_show_results(update: Update, context: ContextTypes.DEFAU
                 )
             return ConversationHandler.END
         
-        # Підраховуємо бали для кожної програми лояльності
-        scores_df = calculate_scores(user_data, hotel_data)
+        # Підраховуємо бали та форматуємо ДЕТАЛЬНІ результати (з кешу, якщо можливо)
+        try:
+            results = await get_results(user_data, lang)
+        except ScoringBusyError:
+            logger.warning(f"Scoring queue is full ({SCORING_QUEUE_SIZE}). User {user_id} asked to retry.")
+            if lang == 'uk':
+                await context.bot.send_message(
+                    chat_id=update.callback_query.message.chat_id,
+                    text="Зараз бот обробляє забагато запитів. Будь ласка, натисніть «Відповісти» ще раз за кілька секунд."
+                )
+            else:
+                await context.bot.send_message(
+                    chat_id=update.callback_query.message.chat_id,
+                    text="The bot is busy right now. Please press \"Submit\" again in a few seconds."
+                )
+            # Повторно показуємо питання 4/4 зі збереженим вибором
+            return await ask_purpose(update, context)
         
-        if scores_df.empty:
+        if results is None:
             if lang == 'uk':
                 await context.bot.send_message(
                     chat_id=update.callback_query.message.chat_id,
@@ -1938,13 +4072,10 @@ async def calculate_and_show_results(update: Update, context: ContextTypes.DEFAU
                 )
             return ConversationHandler.END
         
-        # Форматуємо ДЕТАЛЬНІ результати для відображення
-        results = format_detailed_results(user_data, scores_df, lang)
-        
         # Відправляємо результати користувачеві частинами (через довгий текст)
         if lang == 'uk':
             intro_text = ("🎉 **Аналіз завершено!** \n\n"
-                         "Ось топ-5 програм лояльності готелів з детальним розбором балів:\n\n")
+                         f"Ось топ-{RESULTS_TOP_K} програм лояльності готелів з детальним розбором балів:\n\n")
             outro_text = ("\n\n📝 **Пояснення логіки:**\n"
                          "• **Основна категорія**: бали за вибрану категорію (21,18,15,12,9,6,3)\n"
                          "• **Суміжні категорії**: додаткові бали (7,6,5,4,3,2,1)\n"
@@ -1954,7 +4085,7 @@ async def calculate_and_show_results(update: Update, context: ContextTypes.DEFAU
                          "Щоб почати нове опитування, надішліть команду /start.")
         else:
             intro_text = ("🎉 **Analysis completed!** \n\n"
-                         "Here are the top 5 hotel loyalty programs with detailed score breakdown:\n\n")
+                         f"Here are the top {RESULTS_TOP_K} hotel loyalty programs with detailed score breakdown:\n\n")
             outro_text = ("\n\n📝 **Logic explanation:**\n"
                          "• **Main category**: points for selected category (21,18,15,12,9,6,3)\n"
                          "• **Adjacent categories**: additional points (7,6,5,4,3,2,1)\n"
@@ -1983,68 +4114,240 @@ async def calculate_and_show_results(update: Update, context: ContextTypes.DEFAU
     
     return ConversationHandler.END
 
-async def send_long_message_to_chat(context, chat_id, text, max_length=4000):
-    """Відправляє довге повідомлення частинами до чату"""
-    if len(text) <= max_length:
-        await context.bot.send_message(chat_id=chat_id, text=text, parse_mode="Markdown")
-        return
+# Службові символи Markdown (legacy) Telegram; зворотна коса риска перед ними - екранування
+MARKDOWN_SPECIAL_RE = re.compile(r'[\\_*`\[]')
+
+def _markdown_entity_end(text, start):
+    """
+    Кінець сутності Markdown, що починається з text[start], за правилами Telegram (None - не закрита)
     
-    # Розбиваємо повідомлення на частини
-    parts = []
-    current_part = ""
+    Сутність закривається наступним таким самим символом; ``` - наступними ```;
+    посилання - лише повна форма [текст](url).
+    """
+    char = text[start]
+    if char == '\\':
+        # Екранований службовий символ або звичайна коса риска
+        return start + 2 if text[start + 1:start + 2] in ('_', '*', '`', '[') else start + 1
+    if char == '`' and text.startswith('```', start):
+        close = text.find('```', start + 3)
+        return close + 3 if close >= 0 else None
+    if char == '[':
+        close = text.find(']', start + 1)
+        if close < 0 or not text.startswith('(', close + 1):
+            return None
+        close = text.find(')', close + 2)
+        return close + 1 if close >= 0 else None
+    close = text.find(char, start + 1)
+    return close + 1 if close >= 0 else None
+
+def sanitize_markdown(text):
+    """
+    Перевіряє текст Markdown локально та екранує незакриті службові символи
     
-    for line in text.split('\n'):
-        if len(current_part + line + '\n') > max_length:
-            if current_part:
-                parts.append(current_part.strip())
-                current_part = line + '\n'
-            else:
-                # Якщо один рядок занадто довгий, розбиваємо його
-                parts.append(line[:max_length])
+    Returns:
+        (text, spans): текст, який Telegram розбере без помилки, та список
+        (початок, кінець) сутностей і екранованих символів у ньому
+    """
+    pieces = []
+    spans = []
+    position = 0
+    i = 0
+    while True:
+        match = MARKDOWN_SPECIAL_RE.search(text, i)
+        if match is None:
+            pieces.append(text[i:])
+            break
+        start = match.start()
+        pieces.append(text[i:start])
+        position += start - i
+        
+        end = _markdown_entity_end(text, start)
+        if end is None:
+            # Незакритий символ показуємо як текст, а не відправляємо частину без форматування
+            entity = '\\' + text[start]
+            i = start + 1
         else:
-            current_part += line + '\n'
+            entity = text[start:end]
+            i = end
+        pieces.append(entity)
+        spans.append((position, position + len(entity)))
+        position += len(entity)
     
-    if current_part:
-        parts.append(current_part.strip())
+    return ''.join(pieces), spans
+
+def _find_markdown_cut(text, blocked, start, limit):
+    """Найпізніша позиція розрізу в (start, limit] поза сутностями: після рядка, після пробілу, будь-де"""
+    for separator in ('\n', ' '):
+        index = text.rfind(separator, start, limit)
+        while index >= start and blocked[index + 1]:
+            index = text.rfind(separator, start, index)
+        if index >= start:
+            return index + 1
+    for cut in range(limit, start, -1):
+        if not blocked[cut]:
+            return cut
+    return None
+
+def split_markdown_message(text, max_length=4000):
+    """
+    Розбиває текст Markdown на повідомлення не довші за max_length
+    
+    Текст спершу перевіряється локально (sanitize_markdown), а розрізи робляться
+    лише поза сутностями, тож кожна частина - коректний Markdown. Сутність, довша
+    за max_length, розрізається, і обидві половини перевіряються знову.
+    """
+    text, spans = sanitize_markdown(text)
+    if len(text) <= max_length:
+        return [text]
+    
+    # blocked[p] - розріз перед позицією p розірвав би сутність
+    blocked = bytearray(len(text) + 1)
+    for start, end in spans:
+        blocked[start + 1:end] = b'\x01' * (end - start - 1)
+    
+    parts = []
+    start = 0
+    while len(text) - start > max_length:
+        limit = start + max_length
+        cut = _find_markdown_cut(text, blocked, start, limit)
+        if cut is None:
+            # Половина розрізаної сутності отримує екрановані символи - зменшуємо її, доки не вміститься
+            head = sanitize_markdown(text[start:limit])[0]
+            while len(head) > max_length:
+                limit -= len(head) - max_length
+                head = sanitize_markdown(text[start:limit])[0]
+            parts.append(head)
+            parts.extend(split_markdown_message(text[limit:], max_length))
+            break
+        parts.append(text[start:cut])
+        start = cut
+    else:
+        parts.append(text[start:])
+    
+    return [part for part in (part.strip() for part in parts) if part]
+
+@timed_handler
+async def send_long_message_to_chat(context, chat_id, text, max_length=4000):
+    """
+    Відправляє довге повідомлення частинами до чату (з пріоритетом результатів у черзі запитів)
     
-    # Відправляємо частинами
-    for i, part in enumerate(parts):
+    Частини відправляються по черзі: Telegram не гарантує порядок одночасних запитів,
+    а темп задає обмежувач запитів застосунку.
+    """
+    for part in split_markdown_message(text, max_length):
         try:
-            await context.bot.send_message(chat_id=chat_id, text=part, parse_mode="Markdown")
-        except Exception as e:
-            # Якщо Markdown не працює, відправляємо без форматування
+            await context.bot.send_message(chat_id=chat_id, text=part, parse_mode="Markdown",
+                                           rate_limit_args=PRIORITY_RESULTS)
+        except BadRequest as e:
+            # Markdown уже перевірено локально; сюди потрапляємо лише, якщо Telegram розібрав інакше
             logger.warning(f"Markdown parsing failed: {e}")
-            await context.bot.send_message(chat_id=chat_id, text=part)
+            await context.bot.send_message(chat_id=chat_id, text=part, rate_limit_args=PRIORITY_RESULTS)
+
+async def flush_sessions_periodically():
+    """Пакетно записує змінені сесії у сховище кожні SESSION_FLUSH_INTERVAL секунд"""
+    while True:
+        await asyncio.sleep(SESSION_FLUSH_INTERVAL)
+        await sessions.flush()
+
+async def run_bot(application, port, webhook_url=None, webhook_path=None):
+    """
+    Запускає бота разом з aiohttp сервером на порту PORT
+    
+    Сервер обслуговує /metrics, а в режимі webhook - і маршрут webhook,
+    тому метрики доступні на тому самому порту, що й webhook.
+    """
+    web_app = web.Application()
+    web_app.router.add_get("/metrics", handle_metrics)
+    
+    if webhook_url and webhook_path:
+        async def handle_webhook(request):
+            """Передає оновлення від Telegram у чергу застосунку"""
+            try:
+                data = await request.json()
+            except ValueError:
+                return web.Response(status=400)
+            await application.update_queue.put(Update.de_json(data, application.bot))
+            return web.Response()
+        
+        web_app.router.add_post(webhook_path if webhook_path.startswith("/") else f"/{webhook_path}", handle_webhook)
+    
+    runner = web.AppRunner(web_app, access_log=None)
+    await runner.setup()
+    
+    # Коректна зупинка за SIGINT/SIGTERM (наприклад, під час redeploy на Render)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+    
+    async with application:
+        if webhook_url and webhook_path:
+            await application.bot.set_webhook(url=f"{webhook_url}{webhook_path}", allowed_updates=Update.ALL_TYPES)
+        else:
+            await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        await application.start()
+        await web.TCPSite(runner, "0.0.0.0", port).start()
+        background_tasks = [asyncio.create_task(flush_sessions_periodically())]
+        if HOTEL_DATA_WATCH_INTERVAL > 0 and hotel_data_path:
+            background_tasks.append(asyncio.create_task(watch_hotel_data_file()))
+        logger.info(f"Бот запущено. Метрики: http://0.0.0.0:{port}/metrics")
         
-        # Невелика пауза між повідомленнями
-        if i < len(parts) - 1:
-            await asyncio.sleep(0.5)
+        try:
+            await stop_event.wait()
+        finally:
+            for task in background_tasks:
+                task.cancel()
+            await runner.cleanup()
+            if application.updater and application.updater.running:
+                await application.updater.stop()
+            await application.stop()
 
 def main(token, csv_path, webhook_url=None, webhook_port=None, webhook_path=None):
     """Головна функція запуску бота з підтримкою webhook"""
-    # Завантаження даних
-    global hotel_data
-    hotel_data = load_hotel_data(csv_path)
+    global hotel_data_path
     
-    if hotel_data is None:
-        logger.error("Не вдалося завантажити дані. Бот не запущено.")
+    # Завантаження та перевірка даних (зі знімка, якщо CSV не змінився)
+    signature = compute_file_sha256(csv_path) if os.path.exists(csv_path) else None
+    df, signature = load_hotel_data(csv_path, signature, return_signature=True)
+    try:
+        validate_hotel_data(df)
+    except HotelDataError as e:
+        logger.error(f"{e}. Бот не запущено.")
         return
     
-    # Додаткова перевірка наявності необхідних колонок
-    required_columns = ['loyalty_program', 'region', 'country', 'Hotel Brand']
-    missing_required = [col for col in required_columns if col not in hotel_data.columns]
+    hotel_data_path = csv_path
+    set_hotel_data(df, signature)
     
-    if missing_required:
-        logger.error(f"Відсутні критично важливі колонки: {missing_required}. Бот не запущено.")
-        return
+    # Попередньо обчислені результати (python hotel-quiz-bot.py --precompute)
+    load_precomputed_results(os.environ.get("PRECOMPUTED_RESULTS_PATH", f"{csv_path}.results.sqlite"), signature)
     
-    # Переконуємося, що є колонка 'segment'
-    if 'segment' not in hotel_data.columns:
-        logger.error("Відсутня колонка 'segment'. Бот не запущено.")
-        return
+    # Пул для розрахунку балів поза циклом подій
+    create_scoring_executor(csv_path)
+    
+    # Клавіатури питань для всіх комбінацій вибору
+    prebuild_keyboards()
     
-    # Створення застосунку
-    app = Application.builder().token(token)
+    # Сесії користувачів: після перезапуску відновлюються лише активні
+    sessions.backend = create_session_backend()
+    restored = sessions.load()
+    logger.info(f"Restored {restored} active sessions from {SESSION_BACKEND} session storage")
+    
+    # Створення застосунку (оновлення різних користувачів обробляються паралельно, одного - по черзі)
+    app = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+        .request(TimedHTTPXRequest(connection_pool_size=256))
+        .rate_limiter(rate_limiter)
+        .persistence(SessionPersistence(sessions, SESSION_FLUSH_INTERVAL))
+    )
+    
+    # У режимі webhook оновлення приймає наш aiohttp сервер (разом з /metrics)
+    if webhook_url and webhook_path:
+        app = app.updater(None)
     
     # Побудова застосунку
     application = app.build()
@@ -2053,38 +4356,38 @@ def main(token, csv_path, webhook_url=None, webhook_port=None, webhook_path=None
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler("start", start)],
         states={
-            LANGUAGE: [CallbackQueryHandler(language_choice)],
-            WAITING_REGION_SUBMIT: [CallbackQueryHandler(region_choice)],
-            CATEGORY: [CallbackQueryHandler(category_choice)],
-            WAITING_STYLE_SUBMIT: [CallbackQueryHandler(style_choice)],
-            WAITING_PURPOSE_SUBMIT: [CallbackQueryHandler(purpose_choice)]
+            LANGUAGE: [CallbackQueryHandler(choice_callback, pattern="^l:")],
+            WAITING_REGION_SUBMIT: [CallbackQueryHandler(choice_callback, pattern="^r:")],
+            CATEGORY: [CallbackQueryHandler(choice_callback, pattern="^c:")],
+            WAITING_STYLE_SUBMIT: [CallbackQueryHandler(choice_callback, pattern="^s:")],
+            WAITING_PURPOSE_SUBMIT: [CallbackQueryHandler(choice_callback, pattern="^p:")]
         },
         fallbacks=[
             CommandHandler("cancel", cancel),
-            CommandHandler("start", start)  # Додаємо /start як fallback
-        ]
+            CommandHandler("start", start),  # Додаємо /start як fallback
+            CallbackQueryHandler(stale_callback)  # Кнопки попередніх питань
+        ],
+        name="hotel_quiz",
+        persistent=True  # Етапи розмови відновлюються разом із сесіями
     )
     
     application.add_handler(conv_handler)
+    application.add_handler(CommandHandler("reload", reload_command))
     
     # Використання PORT для webhook
     port = int(os.environ.get("PORT", "10000"))
     
     if webhook_url and webhook_path:
-        webhook_info = f"{webhook_url}{webhook_path}"
-        logger.info(f"Запуск бота в режимі webhook на {webhook_info}")
-        application.run_webhook(
-            listen="0.0.0.0",
-            port=port,
-            url_path=webhook_path,
-            webhook_url=webhook_info,
-            allowed_updates=Update.ALL_TYPES
-        )
+        logger.info(f"Запуск бота в режимі webhook на {webhook_url}{webhook_path}")
     else:
         logger.info("WEBHOOK_URL не вказано. Запуск бота в режимі polling...")
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
     
-    logger.info("Бот запущено")
+    try:
+        asyncio.run(run_bot(application, port, webhook_url, webhook_path))
+    finally:
+        scoring_executor.shutdown(wait=False, cancel_futures=True)
+        sessions.backend.close()
+        logger.info("Бот зупинено")
 
 if __name__ == "__main__":
     # Використовуємо змінні середовища або значення за замовчуванням
@@ -2096,6 +4399,39 @@ if __name__ == "__main__":
         exit(1)
     logger.info(f"Використовується шлях до CSV: {CSV_PATH}")
     
+    # Режим попереднього обчислення всіх результатів:
+    # python hotel-quiz-bot.py --precompute [шлях до SQLite]
+    if len(sys.argv) > 1 and sys.argv[1] == "--precompute":
+        output_path = sys.argv[2] if len(sys.argv) > 2 else os.environ.get(
+            "PRECOMPUTED_RESULTS_PATH", f"{CSV_PATH}.results.sqlite")
+        workers = int(os.environ["PRECOMPUTE_WORKERS"]) if os.environ.get("PRECOMPUTE_WORKERS") else None
+        exit(0 if precompute_all_results(CSV_PATH, output_path, workers) else 1)
+    
+    # Порівняння часу та пікової пам'яті читання CSV частинами:
+    # python hotel-quiz-bot.py --benchmark-load [розміри частин через кому, 0 - весь файл]
+    if len(sys.argv) > 1 and sys.argv[1] == "--benchmark-load":
+        chunk_sizes = sys.argv[2] if len(sys.argv) > 2 else f"0,10000,{HOTEL_DATA_CHUNK_SIZE}"
+        benchmark_hotel_data_load(CSV_PATH, [int(size) for size in chunk_sizes.split(",")])
+        exit(0)
+    
+    # Фільтр за регіоном/країною на синтетичному CSV (CSV_PATH не потрібен):
+    # python hotel-quiz-bot.py --benchmark-region [кількість рядків]
+    if len(sys.argv) > 1 and sys.argv[1] == "--benchmark-region":
+        benchmark_region_filter(int(sys.argv[2]) if len(sys.argv) > 2 else 500000)
+        exit(0)
+    
+    # Процесорний час на натискання чекбокса з готовими клавіатурами і без них:
+    # python hotel-quiz-bot.py --benchmark-keyboards [кількість натискань]
+    if len(sys.argv) > 1 and sys.argv[1] == "--benchmark-keyboards":
+        benchmark_keyboards(int(sys.argv[2]) if len(sys.argv) > 2 else 20000)
+        exit(0)
+    
+    # Пропускна здатність пакетного розрахунку балів:
+    # python hotel-quiz-bot.py --benchmark-batch [кількість наборів відповідей]
+    if len(sys.argv) > 1 and sys.argv[1] == "--benchmark-batch":
+        benchmark_scoring_batch(CSV_PATH, int(sys.argv[2]) if len(sys.argv) > 2 else 3000)
+        exit(0)
+    
     # Параметри для webhook (опціонально)
     WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "").replace("https://", "")  # Очистити https://, якщо є
     WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", f"/webhook/{TOKEN}")
@@ -0,0 +1,160 @@
+"""
+Наскрізна затримка вікторини з обмежувачем вихідних запитів ChatRateLimiter і без нього
+
+Обробники викликаються напряму з імітацією Bot API: кожен запит триває API_ROUND_TRIP
+секунд і проходить через ChatRateLimiter.process_request, як у справжньому боті.
+Результат - сумарний час обробників на одну вікторину (без пауз користувача).
+
+    python tests/benchmark_quiz_latency.py [пауза користувача між відповідями, с ...]
+"""
+import asyncio
+import logging
+import pathlib
+import sys
+import time
+import types
+
+from conftest import load_bot_module
+
+API_ROUND_TRIP = 0.04
+TOGGLE_PAUSE = 0.2  # Між натисканнями чекбоксів одного питання
+DATA_PATH = pathlib.Path(__file__).resolve().parent / "data" / "hotels.csv"
+
+# (мова, регіони, категорія, стилі, цілі) - номери варіантів у callback_data
+QUIZZES = [
+    ('en', [0, 2], 1, [3, 1], [2, 0]),
+    ('uk', [2, 0, 7], 0, [1], [1, 2, 3]),
+]
+
+
+class FakeTelegram:
+    """Імітація Bot API: затримка мережі та (за наявності) обмежувач запитів"""
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.requests = 0
+        self.next_message_id = 100
+
+    async def call(self, endpoint, chat_id, result=None):
+        async def request():
+            await asyncio.sleep(API_ROUND_TRIP)
+            return result
+
+        self.requests += 1
+        if self.limiter is None:
+            return await request()
+        data = {'chat_id': chat_id} if chat_id is not None else {}
+        return await self.limiter.process_request(request, (), {}, endpoint, data, None)
+
+    def message(self):
+        self.next_message_id += 1
+        return types.SimpleNamespace(message_id=self.next_message_id)
+
+
+def make_context(telegram):
+    """Контекст обробника з ботом, що надсилає запити через FakeTelegram"""
+
+    class Bot:
+        async def send_message(self, chat_id, text, **kwargs):
+            return await telegram.call('sendMessage', chat_id, telegram.message())
+
+        async def edit_message_text(self, **kwargs):
+            return await telegram.call('editMessageText', kwargs.get('chat_id'))
+
+        async def edit_message_reply_markup(self, **kwargs):
+            return await telegram.call('editMessageReplyMarkup', kwargs.get('chat_id'))
+
+    return types.SimpleNamespace(bot=Bot(), user_data={})
+
+
+def make_update(telegram, user_id, data=None):
+    """Повідомлення /start (data=None) або натискання кнопки з callback_data"""
+    user = types.SimpleNamespace(id=user_id)
+    chat = types.SimpleNamespace(id=user_id)
+
+    class Message:
+        from_user = user
+        chat_id = user_id
+        message_id = 5
+        text = "question"
+
+        async def reply_text(self, text, **kwargs):
+            return await telegram.call('sendMessage', user_id, telegram.message())
+
+    class CallbackQuery:
+        from_user = user
+        message = Message()
+
+        async def answer(self, *args, **kwargs):
+            await telegram.call('answerCallbackQuery', None)
+
+        async def edit_message_text(self, *args, **kwargs):
+            await telegram.call('editMessageText', user_id)
+
+    CallbackQuery.data = data
+    return types.SimpleNamespace(
+        callback_query=CallbackQuery() if data is not None else None,
+        message=Message() if data is None else None,
+        effective_user=user,
+        effective_chat=chat
+    )
+
+
+async def run_quiz(bot, telegram, user_id, quiz, think):
+    """Проходить вікторину; повертає сумарний час обробників"""
+    lang, regions, category, styles, purposes = quiz
+    context = make_context(telegram)
+    busy = 0.0
+
+    async def step(handler, data, pause):
+        nonlocal busy
+        started = time.perf_counter()
+        await handler(make_update(telegram, user_id, data), context)
+        busy += time.perf_counter() - started
+        await asyncio.sleep(pause)
+
+    await step(bot.start, None, think)
+    await step(bot.choice_callback, f'l:{lang}', think)
+    for region in regions:
+        await step(bot.choice_callback, f'r:{region}', TOGGLE_PAUSE)
+    await step(bot.choice_callback, 'r:ok', think)
+    await step(bot.choice_callback, f'c:{category}', think)
+    for style in styles:
+        await step(bot.choice_callback, f's:{style}', TOGGLE_PAUSE)
+    await step(bot.choice_callback, 's:ok', think)
+    for purpose in purposes:
+        await step(bot.choice_callback, f'p:{purpose}', TOGGLE_PAUSE)
+    await step(bot.choice_callback, 'p:ok', 0)
+    return busy
+
+
+async def measure(bot, think, with_limiter):
+    timings = []
+    delayed = 0
+    for user_id, quiz in enumerate(QUIZZES, start=7):
+        limiter = bot.ChatRateLimiter() if with_limiter else None
+        telegram = FakeTelegram(limiter)
+        timings.append(await run_quiz(bot, telegram, user_id, quiz, think))
+        # Відкладені оновлення клавіатур
+        await asyncio.sleep(bot.KEYBOARD_EDIT_DELAY + API_ROUND_TRIP)
+        delayed += limiter.delayed if limiter is not None else 0
+    return timings, delayed
+
+
+def main(thinks):
+    bot = load_bot_module()
+    logging.disable(logging.CRITICAL)
+    bot.HOTEL_DATA_SNAPSHOT = False
+    bot.set_hotel_data(bot.load_hotel_data(str(DATA_PATH)))
+    bot.prebuild_keyboards()
+
+    for think in thinks:
+        for with_limiter in (False, True):
+            timings, delayed = asyncio.run(measure(bot, think, with_limiter))
+            label = "ChatRateLimiter" if with_limiter else "no limiter"
+            print(f"think {think:.1f}s, {label}: handler time per quiz "
+                  f"{', '.join(f'{seconds:.2f}s' for seconds in timings)}, delayed requests {delayed}")
+
+
+if __name__ == "__main__":
+    main([float(think) for think in sys.argv[1:]] or [0.0, 1.0])
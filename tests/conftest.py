@@ -0,0 +1,22 @@
+import importlib.util
+import logging
+import pathlib
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+
+def load_bot_module():
+    """Завантажує hotel-quiz-bot.py як модуль (назва файлу містить дефіси)"""
+    spec = importlib.util.spec_from_file_location("hotel_quiz_bot", ROOT / "hotel-quiz-bot.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope="session")
+def bot():
+    module = load_bot_module()
+    logging.getLogger(module.__name__).setLevel(logging.WARNING)
+    return module
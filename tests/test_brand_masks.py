@@ -0,0 +1,77 @@
+import itertools
+import pathlib
+import shutil
+
+import pandas as pd
+import pytest
+
+FIXTURE_CSV = pathlib.Path(__file__).resolve().parent / "data" / "hotels.csv"
+
+
+def reference_map_hotel(hotel_brand, mapping, names_en):
+    """Попереднє порядкове зіставлення бренду (map_hotel_style / map_hotel_purpose до масок)"""
+    hotel_brand = str(hotel_brand).lower()
+    combined = {**mapping, **{en: mapping[uk] for en, uk in names_en.items()}}
+    return {name: any(brand.lower() in hotel_brand for brand in brands) for name, brands in combined.items()}
+
+
+def reference_filter(df, selected, mapping, names_en):
+    """Попередня фільтрація через iterrows: індекси рядків, бренд яких відповідає вибору"""
+    matched = []
+    for idx, row in df.iterrows():
+        if pd.isna(row['Hotel Brand']):
+            continue
+        hotel_names = reference_map_hotel(row['Hotel Brand'], mapping, names_en)
+        for item in selected:
+            item_lower = item.lower()
+            if any(matches and (name.lower() == item_lower or item_lower in name.lower() or name.lower() in item_lower)
+                   for name, matches in hotel_names.items()):
+                matched.append(idx)
+                break
+    return matched
+
+
+def selections(names):
+    """Усі вибори з одного та двох варіантів обома мовами"""
+    options = names['uk'] + names['en']
+    return [list(combo) for size in (1, 2) for combo in itertools.combinations(options, size)]
+
+
+@pytest.fixture(scope="module")
+def raw_hotels(bot):
+    return bot.add_mask_columns(pd.read_csv(FIXTURE_CSV))
+
+
+@pytest.fixture(scope="module")
+def loaded_hotels(bot, tmp_path_factory):
+    # Копія CSV, бо поруч із ним записується знімок даних
+    csv_path = tmp_path_factory.mktemp("hotels") / "hotels.csv"
+    shutil.copy(FIXTURE_CSV, csv_path)
+    return bot.load_hotel_data(str(csv_path))
+
+
+@pytest.mark.parametrize("kind", ["style", "purpose"])
+def test_mask_filter_matches_row_path(bot, raw_hotels, kind):
+    mapping, names_en, names, get_bits = {
+        'style': (bot.STYLE_BRAND_MAPPING, bot.STYLE_NAMES_EN, bot.STYLE_NAMES, bot.get_style_bits),
+        'purpose': (bot.PURPOSE_BRAND_MAPPING, bot.PURPOSE_NAMES_EN, bot.PURPOSE_NAMES, bot.get_purpose_bits),
+    }[kind]
+
+    for selected in selections(names):
+        mask = (raw_hotels[f'{kind}_mask'] & get_bits(selected)) != 0
+        assert list(raw_hotels.index[mask]) == reference_filter(raw_hotels, selected, mapping, names_en), selected
+
+
+@pytest.mark.parametrize("kind", ["style", "purpose"])
+def test_cube_counts_match_row_path(bot, raw_hotels, loaded_hotels, kind):
+    mapping, names_en, names, get_bits = {
+        'style': (bot.STYLE_BRAND_MAPPING, bot.STYLE_NAMES_EN, bot.STYLE_NAMES, bot.get_style_bits),
+        'purpose': (bot.PURPOSE_BRAND_MAPPING, bot.PURPOSE_NAMES_EN, bot.PURPOSE_NAMES, bot.get_purpose_bits),
+    }[kind]
+    cube = bot.region_score_cube(loaded_hotels)
+
+    for selected in selections(names):
+        bits = {f'{kind}_bits': get_bits(selected)}
+        counts = bot.count_hotels_in_cube(cube, **bits)
+        expected = raw_hotels.loc[reference_filter(raw_hotels, selected, mapping, names_en), 'loyalty_program'].value_counts()
+        assert {program: count for program, count in counts.items() if count} == expected.to_dict(), selected
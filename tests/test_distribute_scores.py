@@ -0,0 +1,82 @@
+import random
+
+import numpy as np
+import pytest
+
+MAIN_SCORES = [21, 18, 15, 12, 9, 6, 3]
+ADJACENT_SCORES = [7, 6, 5, 4, 3, 2, 1]
+
+
+def reference_distribute_scores(counts_dict, score_values):
+    """Попередня реалізація distribute_scores_with_ties на словниках (еталон)"""
+    if not counts_dict or not score_values:
+        return {program: 0.0 for program in counts_dict.keys()}
+
+    filtered_counts = {prog: count for prog, count in counts_dict.items() if count > 0}
+    if not filtered_counts:
+        return {program: 0.0 for program in counts_dict.keys()}
+
+    count_groups = {}
+    for program, count in filtered_counts.items():
+        count_groups.setdefault(count, []).append(program)
+
+    result_scores = {program: 0.0 for program in counts_dict.keys()}
+    current_position = 0
+    for count in sorted(count_groups.keys(), reverse=True):
+        programs_in_group = count_groups[count]
+        if current_position >= len(score_values):
+            break
+        for program in programs_in_group:
+            result_scores[program] = float(score_values[current_position])
+        current_position += len(programs_in_group)
+    return result_scores
+
+
+def random_counts(rng):
+    """Кількості готелів з великою ймовірністю однакових значень та нулів"""
+    n_programs = rng.randint(0, 14)
+    high = rng.choice([1, 2, 3, 5, 50])
+    return {f"program {i}": rng.randint(0, high) for i in range(n_programs)}
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_with_ties_matches_reference(bot, seed):
+    rng = random.Random(seed)
+    for _ in range(100):
+        counts = random_counts(rng)
+        score_values = rng.choice([MAIN_SCORES, ADJACENT_SCORES, MAIN_SCORES[:rng.randint(0, 7)]])
+        assert bot.distribute_scores_with_ties(counts, score_values) == reference_distribute_scores(counts, score_values)
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_array_rows_match_reference(bot, seed):
+    rng = random.Random(seed)
+    n_programs = rng.randint(1, 14)
+    high = rng.choice([1, 3, 50])
+    counts = np.array([[rng.randint(0, high) for _ in range(n_programs)] for _ in range(rng.randint(1, 20))])
+    score_values = rng.choice([MAIN_SCORES, ADJACENT_SCORES])
+
+    scores = bot.distribute_scores_array(counts, score_values)
+
+    assert scores.shape == counts.shape
+    for row, row_scores in zip(counts, scores):
+        expected = reference_distribute_scores(dict(enumerate(row.tolist())), score_values)
+        assert row_scores.tolist() == [expected[i] for i in range(n_programs)]
+        assert bot.distribute_scores_array(row, score_values).tolist() == row_scores.tolist()
+
+
+def test_ties_share_a_place_and_skip_the_next(bot):
+    counts = {"a": 10, "b": 7, "c": 7, "d": 3, "e": 0}
+    assert bot.distribute_scores_with_ties(counts, MAIN_SCORES) == {
+        "a": 21.0, "b": 18.0, "c": 18.0, "d": 12.0, "e": 0.0
+    }
+
+
+def test_places_beyond_score_values_get_nothing(bot):
+    counts = {f"p{i}": 1 for i in range(9)}
+    counts["top"] = 2
+    scores = bot.distribute_scores_with_ties(counts, ADJACENT_SCORES)
+    assert scores["top"] == 7.0
+    assert all(scores[f"p{i}"] == 6.0 for i in range(9))
+    assert bot.distribute_scores_with_ties({}, MAIN_SCORES) == {}
+    assert bot.distribute_scores_with_ties({"a": 5}, []) == {"a": 0.0}
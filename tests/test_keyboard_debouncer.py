@@ -0,0 +1,144 @@
+import asyncio
+
+import pytest
+
+DELAY = 0.01
+CHAT_ID = 7
+MESSAGE_ID = 100
+
+
+class RecordingBot:
+    """Бот, що запам'ятовує edit_message_reply_markup (або відповідає помилкою error)"""
+
+    def __init__(self, error=None):
+        self.edits = []
+        self.error = error
+
+    async def edit_message_reply_markup(self, chat_id, message_id, reply_markup):
+        await asyncio.sleep(0)
+        if self.error is not None:
+            raise self.error
+        self.edits.append((chat_id, message_id, reply_markup))
+
+
+@pytest.fixture
+def debouncer(bot):
+    return bot.KeyboardEditDebouncer(DELAY, max_tracked=100)
+
+
+async def settle():
+    """Чекає, доки минуть вікна затримки всіх запланованих оновлень"""
+    await asyncio.sleep(DELAY * 10)
+
+
+def test_taps_within_window_are_coalesced(debouncer):
+    telegram = RecordingBot()
+
+    async def scenario():
+        debouncer.remember(CHAT_ID, MESSAGE_ID, "markup 0")
+        for tap in range(1, 6):
+            debouncer.schedule(telegram, CHAT_ID, MESSAGE_ID, lambda tap=tap: f"markup {tap}")
+        await settle()
+
+    asyncio.run(scenario())
+
+    assert telegram.edits == [(CHAT_ID, MESSAGE_ID, "markup 5")]
+    assert (debouncer.sent_edits, debouncer.coalesced, debouncer.skipped) == (1, 4, 0)
+
+
+def test_markup_is_built_when_sent(debouncer):
+    telegram = RecordingBot()
+    state = {'bits': 0}
+
+    async def scenario():
+        debouncer.schedule(telegram, CHAT_ID, MESSAGE_ID, lambda: f"bits {state['bits']}")
+        # Натискання після планування, але у вікні затримки
+        state['bits'] = 3
+        await settle()
+
+    asyncio.run(scenario())
+
+    assert telegram.edits == [(CHAT_ID, MESSAGE_ID, "bits 3")]
+
+
+def test_identical_markup_is_not_sent(debouncer):
+    telegram = RecordingBot()
+
+    async def scenario():
+        debouncer.remember(CHAT_ID, MESSAGE_ID, "markup A")
+        # Чекбокс увімкнули й одразу вимкнули - клавіатура та сама
+        debouncer.schedule(telegram, CHAT_ID, MESSAGE_ID, lambda: "markup B")
+        debouncer.schedule(telegram, CHAT_ID, MESSAGE_ID, lambda: "markup A")
+        await settle()
+
+    asyncio.run(scenario())
+
+    assert telegram.edits == []
+    assert (debouncer.sent_edits, debouncer.skipped) == (0, 1)
+
+
+def test_sent_markup_is_remembered(debouncer):
+    telegram = RecordingBot()
+
+    async def scenario():
+        debouncer.schedule(telegram, CHAT_ID, MESSAGE_ID, lambda: "markup B")
+        await settle()
+        debouncer.schedule(telegram, CHAT_ID, MESSAGE_ID, lambda: "markup B")
+        await settle()
+
+    asyncio.run(scenario())
+
+    assert telegram.edits == [(CHAT_ID, MESSAGE_ID, "markup B")]
+    assert (debouncer.sent_edits, debouncer.skipped) == (1, 1)
+
+
+def test_not_modified_error_counts_as_shown(bot, debouncer):
+    telegram = RecordingBot(error=bot.BadRequest("Message is not modified"))
+
+    async def scenario():
+        debouncer.schedule(telegram, CHAT_ID, MESSAGE_ID, lambda: "markup B")
+        await settle()
+        telegram.error = None
+        debouncer.schedule(telegram, CHAT_ID, MESSAGE_ID, lambda: "markup B")
+        await settle()
+
+    asyncio.run(scenario())
+
+    assert telegram.edits == []
+    assert debouncer.skipped == 1
+
+
+def test_messages_are_debounced_separately(debouncer):
+    telegram = RecordingBot()
+
+    async def scenario():
+        debouncer.schedule(telegram, CHAT_ID, MESSAGE_ID, lambda: "first")
+        debouncer.schedule(telegram, CHAT_ID, MESSAGE_ID + 1, lambda: "second")
+        await settle()
+
+    asyncio.run(scenario())
+
+    assert sorted(telegram.edits) == [(CHAT_ID, MESSAGE_ID, "first"), (CHAT_ID, MESSAGE_ID + 1, "second")]
+    assert debouncer.coalesced == 0
+
+
+def test_cancel_drops_pending_edit(debouncer):
+    telegram = RecordingBot()
+
+    async def scenario():
+        debouncer.schedule(telegram, CHAT_ID, MESSAGE_ID, lambda: "markup B")
+        await debouncer.cancel(CHAT_ID, MESSAGE_ID)
+        await settle()
+
+    asyncio.run(scenario())
+
+    assert telegram.edits == []
+    assert debouncer._tasks == {}
+
+
+def test_tracked_keyboards_are_bounded(bot):
+    debouncer = bot.KeyboardEditDebouncer(DELAY, max_tracked=2)
+    for message_id in range(5):
+        debouncer.remember(CHAT_ID, message_id, f"markup {message_id}")
+
+    assert list(debouncer._shown) == [(CHAT_ID, 3), (CHAT_ID, 4)]
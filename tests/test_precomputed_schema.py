@@ -0,0 +1,98 @@
+import sqlite3
+
+import pytest
+
+SIGNATURE = "a" * 64
+ANSWERS = {
+    'regions': ["Europe"],
+    'countries': [],
+    'category': "Luxury",
+    'styles': ["Luxurious and refined"],
+    'purposes': ["Business travel"],
+}
+
+
+def write_table(bot, path, signature, schema, results):
+    """Таблиця результатів у форматі precompute_all_results; schema=None - таблиця старого формату"""
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("CREATE TABLE results (key INTEGER PRIMARY KEY, results BLOB)")
+    conn.execute("INSERT INTO results VALUES (?, ?)",
+                 (bot.make_precomputed_key(ANSWERS, 'en'), bot._compress_results(results, b'')))
+    meta = [('csv_sha256', signature), ('zdict', b'')]
+    if schema is not None:
+        meta.append(('schema', schema))
+    conn.executemany("INSERT INTO meta VALUES (?, ?)", meta)
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def precomputed(bot, monkeypatch):
+    """Стан попередньо обчислених результатів для даних із підписом SIGNATURE"""
+    monkeypatch.setattr(bot, 'precomputed_results_db', None)
+    monkeypatch.setattr(bot, 'precomputed_results_path', None)
+    monkeypatch.setattr(bot, 'precomputed_results_signature', None)
+    monkeypatch.setattr(bot, 'precomputed_results_zdict', b'')
+    monkeypatch.setattr(bot, 'hotel_data_signature', SIGNATURE)
+    yield
+    if bot.precomputed_results_db is not None:
+        bot.precomputed_results_db.close()
+
+
+def change_top_k(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'RESULTS_TOP_K', bot.RESULTS_TOP_K + 1)
+
+
+def change_template(bot, monkeypatch):
+    monkeypatch.setitem(bot.RESULT_TEMPLATES['en'], 'summary', "Total: {total:.2f}\n".format)
+
+
+def change_separator(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'RESULT_SEPARATOR', "\n---\n")
+
+
+def change_format_version(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'PRECOMPUTED_FORMAT_VERSION', bot.PRECOMPUTED_FORMAT_VERSION + 1)
+
+
+def change_brand_mapping(bot, monkeypatch):
+    style = next(iter(bot.STYLE_BRAND_MAPPING))
+    monkeypatch.setitem(bot.STYLE_BRAND_MAPPING, style, bot.STYLE_BRAND_MAPPING[style] + ["New Brand"])
+
+
+def test_matching_table_is_used(bot, precomputed, tmp_path):
+    path = str(tmp_path / "hotels.csv.results.sqlite")
+    write_table(bot, path, SIGNATURE, bot._precomputed_schema(), "precomputed report")
+
+    assert bot.load_precomputed_results(path, SIGNATURE)
+    assert bot.lookup_precomputed_results(ANSWERS, 'en') == (True, "precomputed report")
+
+
+def test_table_without_schema_is_ignored(bot, precomputed, tmp_path):
+    path = str(tmp_path / "hotels.csv.results.sqlite")
+    write_table(bot, path, SIGNATURE, None, "old report")
+
+    assert not bot.load_precomputed_results(path, SIGNATURE)
+    assert bot.lookup_precomputed_results(ANSWERS, 'en') == (False, None)
+
+
+def test_table_for_another_csv_is_ignored(bot, precomputed, tmp_path):
+    path = str(tmp_path / "hotels.csv.results.sqlite")
+    write_table(bot, path, "b" * 64, bot._precomputed_schema(), "report for other data")
+
+    assert not bot.load_precomputed_results(path, SIGNATURE)
+    assert bot.lookup_precomputed_results(ANSWERS, 'en') == (False, None)
+
+
+@pytest.mark.parametrize("change", [
+    change_top_k, change_template, change_separator, change_format_version, change_brand_mapping
+])
+def test_table_with_another_report_format_is_ignored(bot, precomputed, tmp_path, monkeypatch, change):
+    path = str(tmp_path / "hotels.csv.results.sqlite")
+    write_table(bot, path, SIGNATURE, bot._precomputed_schema(), "report in the old format")
+
+    change(bot, monkeypatch)
+
+    assert not bot.load_precomputed_results(path, SIGNATURE)
+    assert bot.lookup_precomputed_results(ANSWERS, 'en') == (False, None)
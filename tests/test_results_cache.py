@@ -0,0 +1,101 @@
+import pathlib
+import shutil
+from collections import OrderedDict
+
+import pytest
+
+FIXTURE_CSV = pathlib.Path(__file__).resolve().parent / "data" / "hotels.csv"
+
+ANSWERS = {
+    'regions': ["Europe", "Asia"],
+    'countries': [],
+    'category': "Luxury",
+    'styles': ["Luxurious and refined", "Boutique and unique"],
+    'purposes': ["Business travel"],
+}
+
+
+@pytest.fixture(scope="module")
+def hotels(bot, tmp_path_factory):
+    # Копія CSV, бо поруч із ним записується знімок даних
+    csv_path = tmp_path_factory.mktemp("hotels") / "hotels.csv"
+    shutil.copy(FIXTURE_CSV, csv_path)
+    return bot.load_hotel_data(str(csv_path))
+
+
+@pytest.fixture
+def cache(bot, hotels, monkeypatch):
+    """Порожній кеш результатів і власний стан даних готелів (відновлюється після тесту)"""
+    monkeypatch.setattr(bot, 'results_cache', OrderedDict())
+    monkeypatch.setattr(bot, 'results_cache_stats', {'hits': 0, 'misses': 0, 'precomputed_hits': 0})
+    monkeypatch.setattr(bot, 'precomputed_results_db', None)
+    monkeypatch.setattr(bot, 'hotel_data', None)
+    monkeypatch.setattr(bot, 'hotel_data_version', 0)
+    monkeypatch.setattr(bot, 'hotel_data_signature', None)
+    bot.set_hotel_data(hotels, "first")
+    return bot.results_cache
+
+
+def test_stored_results_are_served_from_cache(bot, cache):
+    answers = bot.canonicalize_answers(ANSWERS)
+    assert bot.lookup_results(answers, 'en') == (False, None)
+
+    results = bot.compute_results(answers, 'en')
+    assert results
+    bot.store_results(bot.make_results_cache_key(answers, 'en'), results)
+
+    assert bot.lookup_results(answers, 'en') == (True, results)
+    assert bot.get_results_cache_stats() == {'hits': 1, 'misses': 1, 'precomputed_hits': 0, 'size': 1}
+
+
+def test_key_ignores_toggle_order_but_not_language(bot, cache):
+    reordered = dict(ANSWERS, regions=["Asia", "Europe"], styles=list(reversed(ANSWERS['styles'])))
+    key = bot.make_results_cache_key(bot.canonicalize_answers(ANSWERS), 'en')
+
+    assert bot.make_results_cache_key(bot.canonicalize_answers(reordered), 'en') == key
+    assert bot.make_results_cache_key(bot.canonicalize_answers(ANSWERS), 'uk') != key
+
+
+def test_new_data_version_invalidates_cache(bot, cache, hotels):
+    answers = bot.canonicalize_answers(ANSWERS)
+    old_key = bot.make_results_cache_key(answers, 'en')
+    bot.store_results(old_key, "old results")
+
+    bot.set_hotel_data(hotels, "second")
+
+    assert len(cache) == 0
+    assert bot.make_results_cache_key(answers, 'en')[0] == old_key[0] + 1
+    assert bot.lookup_results(answers, 'en') == (False, None)
+
+
+def test_results_computed_before_reload_are_not_stored(bot, cache, hotels):
+    answers = bot.canonicalize_answers(ANSWERS)
+    # Розрахунок почався зі старою версією даних, а завершився вже після перезавантаження
+    key = bot.make_results_cache_key(answers, 'en')
+    bot.set_hotel_data(hotels, "second")
+    bot.store_results(key, "stale results")
+
+    assert len(cache) == 0
+    assert bot.lookup_results(answers, 'en') == (False, None)
+
+
+def test_expired_entries_are_dropped(bot, cache, monkeypatch):
+    answers = bot.canonicalize_answers(ANSWERS)
+    bot.store_results(bot.make_results_cache_key(answers, 'en'), "results")
+    monkeypatch.setattr(bot, 'RESULTS_CACHE_TTL', -1)
+
+    assert bot.lookup_results(answers, 'en') == (False, None)
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted(bot, cache, monkeypatch):
+    monkeypatch.setattr(bot, 'RESULTS_CACHE_SIZE', 2)
+    keys = [bot.make_results_cache_key(bot.canonicalize_answers(dict(ANSWERS, category=category)), 'en')
+            for category in ("Luxury", "Comfort", "Standard")]
+
+    bot.store_results(keys[0], "luxury")
+    bot.store_results(keys[1], "comfort")
+    assert bot.lookup_results(bot.canonicalize_answers(ANSWERS), 'en') == (True, "luxury")
+    bot.store_results(keys[2], "standard")
+
+    assert list(cache) == [keys[0], keys[2]]
@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+
+class FakeClock:
+    """Замінює модуль time у боті: час рухається лише через advance()"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.wall = 1_700_000_000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.wall + self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(bot, monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(bot, 'time', fake)
+    return fake
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(bot, request, tmp_path):
+    if request.param == "memory":
+        yield bot.MemorySessionBackend()
+        return
+    backend = bot.SQLiteSessionBackend(str(tmp_path / "sessions.sqlite3"))
+    yield backend
+    backend.close()
+
+
+def test_least_recently_used_session_is_evicted(bot, clock):
+    store = bot.SessionStore(max_size=3, idle_ttl=600)
+    for user_id in (1, 2, 3):
+        store.create(user_id)
+        clock.advance(1)
+    store.get(1)  # Активність переносить сесію в кінець черги LRU
+
+    store.create(4)
+
+    assert [user_id for user_id in (1, 2, 3, 4) if store.peek(user_id) is not None] == [1, 3, 4]
+    assert store.evicted == 1
+
+
+def test_idle_session_expires(bot, clock):
+    store = bot.SessionStore(max_size=10, idle_ttl=600)
+    store.create(1)
+    store.create(2)
+
+    clock.advance(400)
+    assert store.get(1) is not None
+    clock.advance(400)
+
+    # Сесію 1 щойно використано, сесія 2 неактивна 800 секунд
+    assert store.get(1) is not None
+    assert store.get(2) is None
+    assert store.expired == 1
+
+
+def test_create_drops_expired_sessions(bot, clock):
+    store = bot.SessionStore(max_size=10, idle_ttl=600)
+    store.create(1)
+    store.create(2)
+    clock.advance(601)
+
+    store.create(3)
+
+    assert store.peek(1) is None and store.peek(2) is None
+    assert store.live_count() == 1
+    assert store.expired == 2
+
+
+def test_flush_writes_changes_in_one_batch(bot, clock, backend):
+    store = bot.SessionStore(max_size=10, idle_ttl=600, backend=backend)
+    session = store.create(1)
+    for bit in (1, 2, 4):
+        session.region_bits |= bit
+        store.mark_dirty(1)
+    store.create(2)
+    asyncio.run(store.flush())
+    assert store.pending_writes() == 0
+
+    store.delete(2)
+    asyncio.run(store.flush())
+
+    rows = backend.load_active(0, 10)
+    assert [(row[0], row[4]) for row in rows] == [(1, 0b111)]
+
+
+def test_load_restores_only_active_sessions_in_lru_order(bot, clock, backend):
+    store = bot.SessionStore(max_size=10, idle_ttl=600, backend=backend)
+    for user_id in (1, 2, 3):
+        store.create(user_id).language = 'uk'
+        clock.advance(300)
+    asyncio.run(store.flush())
+
+    # Після перезапуску: сесія 1 неактивна 901 секунду, 2 - 601, 3 - 301 (ліміт - 600)
+    clock.advance(1)
+    restored = bot.SessionStore(max_size=10, idle_ttl=600, backend=backend)
+
+    assert restored.load() == 1
+    assert list(restored._sessions) == [3]
+    assert restored.get(3).language == 'uk'
+
+
+def test_load_keeps_newest_sessions_up_to_max_size(bot, clock, backend):
+    store = bot.SessionStore(max_size=10, idle_ttl=600, backend=backend)
+    for user_id in range(1, 6):
+        store.create(user_id)
+        clock.advance(1)
+    asyncio.run(store.flush())
+
+    restored = bot.SessionStore(max_size=3, idle_ttl=600, backend=backend)
+
+    assert restored.load() == 3
+    assert list(restored._sessions) == [3, 4, 5]
@@ -0,0 +1,84 @@
+import random
+import re
+
+import pytest
+
+TELEGRAM_MAX_LENGTH = 4096
+
+ALPHABET = [
+    'a', 'b', ' ', ' ', '\n', '*', '_', '`', '```', '[', ']', '(', ')', '\\',
+    'слово', 'x' * 50, '**bold**', '_italic_', '`code`', '[link](http://x)'
+]
+
+
+def visible(text):
+    """Текст без пробілів і символів екранування (їх розбиття може додати або прибрати)"""
+    return re.sub(r'\s|\\', '', text)
+
+
+def random_markdown(rng):
+    return ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 400)))
+
+
+def assert_valid_parts(bot, text, parts, max_length):
+    for part in parts:
+        assert len(part) <= max_length
+        # Частина вже коректна: Telegram розбере її без помилки, нічого не екрануючи
+        assert bot.sanitize_markdown(part)[0] == part
+    assert visible(''.join(parts)) == visible(text)
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("max_length", [20, 50, 120, 4000])
+def test_random_texts_split_into_valid_parts(bot, seed, max_length):
+    rng = random.Random(seed)
+    for _ in range(50):
+        text = random_markdown(rng)
+        assert_valid_parts(bot, text, bot.split_markdown_message(text, max_length), max_length)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_entities_are_not_split(bot, seed):
+    rng = random.Random(seed)
+    for _ in range(50):
+        text = random_markdown(rng)
+        sanitized, spans = bot.sanitize_markdown(text)
+        max_length = max([120] + [end - start for start, end in spans])
+        parts = bot.split_markdown_message(text, max_length)
+
+        # Кожна сутність цілком в одній частині: частини містять ті самі сутності, що й увесь текст
+        part_entities = [sanitized_part[start:end] for part in parts
+                         for sanitized_part, part_spans in [bot.sanitize_markdown(part)]
+                         for start, end in part_spans]
+        assert part_entities == [sanitized[start:end] for start, end in spans]
+
+
+def test_entity_at_the_limit_moves_to_next_part(bot):
+    text = "a" * 15 + " *bold text*"
+    assert bot.split_markdown_message(text, 20) == ["a" * 15, "*bold text*"]
+
+
+def test_entity_longer_than_limit_is_cut_into_valid_halves(bot):
+    text = "*" + "x" * 30 + "*"
+    parts = bot.split_markdown_message(text, 20)
+    assert len(parts) > 1
+    assert_valid_parts(bot, text, parts, 20)
+
+
+def test_unclosed_markers_are_escaped(bot):
+    assert bot.split_markdown_message("*unclosed and a_b") == ["\\*unclosed and a\\_b"]
+    assert bot.split_markdown_message("ok *bold* `code` [l](u) \\_") == ["ok *bold* `code` [l](u) \\_"]
+
+
+def test_long_report_fits_telegram_limit(bot):
+    block = "🥇 1. *Program*\nTotal score: 42.00\n   _Europe_, [site](http://example.com) – 10 hotels\n"
+    text = block * 400
+
+    parts = bot.split_markdown_message(text)
+
+    assert len(parts) > 1
+    assert all(len(part) <= TELEGRAM_MAX_LENGTH for part in parts)
+    assert_valid_parts(bot, text, parts, 4000)
+    # Розріз - на межі рядка, тож жоден рядок звіту не розірвано
+    lines = {line.strip() for line in block.strip().split("\n")}
+    assert {line.strip() for part in parts for line in part.split("\n")} == lines